@@ -18,10 +18,10 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 import logging
-from flask import request, redirect
+from flask import request, redirect, Response
 from flask_restx import Resource
 
-from .alpaca_service import AlpacaBaseService, AlpacaTelescopeService
+from .pointing_stream import PointingStream
 
 # error codes from https://ascom-standards.org/Help/Developer/html/T_ASCOM_ErrorCodes.htm
 ALPACA_ERROR_NOTIMPLEMENTED = 0x80040400
@@ -46,21 +46,37 @@ ALPACA_ALIGNMENT_GERMANPOLAR = 2
 class AlpacaBase(Resource):
     """
     Handle common Alpaca REST APIs for all device types.
+
+    Actions are looked up in the AlpacaActionRegistry passed in as the
+    'registry' keyword argument which is built once when the service starts.
     """
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.driver = kwargs['driver']
-        self.base_service = AlpacaBaseService(self.driver)
+        self.registry = kwargs['registry']
 
     def get(self, action):
+        # FIXME Should we add check for a ClientID and ClientTransactionID?
+
+        body = self.registry.get_static_response(action)
+        if body is not None:
+            return Response(body, mimetype='application/json')
+
         resp = {'ErrorNumber': 0, 'ErrorString': '', 'Value': ''}
 
-        try:
-            resp['Value'] = getattr(self.driver, action)
-        except AttributeError:
+        getter = self.registry.get_getter(action)
+        if getter is None:
             resp['ErrorNumber'] = ALPACA_ERROR_NOTIMPLEMENTED
             resp['ErrorString'] = ALPACA_ERROR_STRINGS[resp['ErrorNumber']]
+            return resp
+
+        try:
+            resp['Value'] = getter()
+        except Exception:
+            logging.error(f'AlpacaBase:get() {action} failed', exc_info=True)
+            resp['ErrorNumber'] = ALPACA_ERROR_UNSPECIFIEDERRROR
+            resp['ErrorString'] = ALPACA_ERROR_STRINGS[resp['ErrorNumber']]
 
         return resp
 
@@ -69,60 +85,63 @@ class AlpacaBase(Resource):
 
         logging.debug(f'AlpacaBase:put() {action} {request.form}')
 
-        try:
-            method = getattr(self.base_service, action)
-        except AttributeError:
+        rc = self.registry.handle_put(action, request.form)
+        if rc is None:
             resp['ErrorNumber'] = ALPACA_ERROR_NOTIMPLEMENTED
             resp['ErrorString'] = ALPACA_ERROR_STRINGS[resp['ErrorNumber']]
-        else:
-            if callable(method):
-                if not method(request.form):
-                    resp['ErrorNumber'] = ALPACA_ERROR_UNSPECIFIEDERRROR
-                    resp['ErrorString'] = ALPACA_ERROR_STRINGS[resp['ErrorNumber']]
-            else:
-                resp['ErrorNumber'] = ALPACA_ERROR_NOTIMPLEMENTED
-                resp['ErrorString'] = ALPACA_ERROR_STRINGS[resp['ErrorNumber']]
+        elif not rc:
+            resp['ErrorNumber'] = ALPACA_ERROR_UNSPECIFIEDERRROR
+            resp['ErrorString'] = ALPACA_ERROR_STRINGS[resp['ErrorNumber']]
 
         return resp
 
 class AlpacaTelescope(AlpacaBase):
     """
-    Handle common Alpaca REST APIs for all device types.
+    Handle Alpaca REST APIs for the telescope device.  The registry should
+    be created with create_telescope_registry().
+    """
+
+
+class AlpacaTelescopeState(Resource):
+    """
+    Extension to the Alpaca REST API returning all dynamic telescope
+    properties from one pointing snapshot in a single request.
     """
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.driver = kwargs['driver']
-        self.service = AlpacaTelescopeService(self.driver)
 
-    def get(self, action):
+    def get(self):
         resp = {'ErrorNumber': 0, 'ErrorString': '', 'Value': ''}
 
-        # FIXME Should we add check for a ClientID and ClientTransactionID?
-
         try:
-            resp['Value'] = getattr(self.driver, action)
-        except AttributeError:
-            resp = super().get(action)
+            resp['Value'] = self.driver.get_telescope_state()
+        except Exception:
+            logging.error('AlpacaTelescopeState:get() failed', exc_info=True)
+            resp['ErrorNumber'] = ALPACA_ERROR_UNSPECIFIEDERRROR
+            resp['ErrorString'] = ALPACA_ERROR_STRINGS[resp['ErrorNumber']]
 
         return resp
 
-    def put(self, action):
-        resp = {'ErrorNumber': 0, 'ErrorString': ''}
 
-        logging.debug(f'AlpacaTelescope:put() {action} {request.form}')
+class AlpacaTelescopeStream(Resource):
+    """
+    Extension to the Alpaca REST API streaming the telescope state as
+    Server-Sent Events.  The optional 'rate' query argument sets the
+    events per second.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.broadcaster = kwargs['broadcaster']
 
+    def get(self):
         try:
-            method = getattr(self.service, action)
-        except AttributeError:
-            return super().put(action)
-        else:
-            if callable(method):
-                if not method(request.form):
-                    resp['ErrorNumber'] = ALPACA_ERROR_UNSPECIFIEDERRROR
-                    resp['ErrorString'] = ALPACA_ERROR_STRINGS[resp['ErrorNumber']]
-            else:
-                resp['ErrorNumber'] = ALPACA_ERROR_NOTIMPLEMENTED
-                resp['ErrorString'] = ALPACA_ERROR_STRINGS[resp['ErrorNumber']]
+            stream = PointingStream(self.broadcaster.latest,
+                                    request.args.get('rate'))
+        except ValueError as e:
+            return Response(str(e), status=400, mimetype='text/plain')
 
-        return resp
+        return Response(iter(stream), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache'})
@@ -18,23 +18,27 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import time
 import logging
 import importlib
 import inspect
 import pkgutil
 from collections import namedtuple
 
-from astropy.coordinates import EarthLocation, AltAz, SkyCoord
-from astropy.time import Time
-from astropy import units as u
-
 # import so we can walk all encoder plugins distributed with package
 import alpacadsc
 
 # get version
 from . import __version__ as ALPACADSC_VERSION
 
-from .baseencoders import EncodersBase
+from .baseencoders import EncodersBase, EncoderLinkDown
+from .baseencoders import PRIORITY_SYNC, PRIORITY_POLL
+from .encoder_sampler import EncoderSampler, EncoderSample
+from .encoder_io_loop import shared_io_loop
+from .encoder_pool import shared_encoder_pool
+from .baseencoders_serial import EncodersSerial
+from .single_flight import SingleFlight
+from .transforms import create_transform_engine
 from .profiles import set_current_profile, get_current_profile
 from .altaz_dsc_profile import AltAzSettingCirclesProfile as Profile
 from .alpaca_controller import ALPACA_ALIGNMENT_ALTAZ
@@ -43,9 +47,21 @@ from .alpaca_controller import ALPACA_ALIGNMENT_ALTAZ
 # define named tuple for representing loaded encoders plugins
 Plugin = namedtuple('Plugin', ['name', 'moduleref', 'classref'])
 
+# define named tuple for pointing computed from a single encoder read
+# timestamp is from time.time(), alt/az/ra/dec are in degrees and are
+# None if the driver is not synchronized, age is seconds since the encoders
+# were read
+PointingSnapshot = namedtuple('PointingSnapshot', ['timestamp',
+                                                   'enc_alt', 'enc_az',
+                                                   'alt', 'az',
+                                                   'ra', 'dec', 'age'])
+
 # base name used for profile storage
 PROFILE_BASENAME = "alpacadsc"
 
+# minimum seconds between log messages about encoder reads failing
+READ_FAILURE_LOG_INTERVAL = 10.0
+
 
 class AlpacaBaseModel:
     def __init__(self):
@@ -116,6 +132,23 @@ class AlpacaAltAzTelescopeModel(AlpacaBaseModel):
         self.destinationsideofpier = 0
 
         self.encoders = None
+        self.sampler = None
+        self.transform = None
+
+        # concurrent requests share one encoder read instead of each
+        # sending a command over the serial link
+        self._encoder_reads = SingleFlight()
+
+        # requests wait at most read_deadline seconds for an encoder read
+        # and then use the last sample read
+        self.read_deadline = 0.2
+        self._last_sample = None
+        self._read_failures = 0
+        self._read_failure_logged = None
+
+        # pointing snapshot reused by requests within snapshot_window seconds
+        self.snapshot_window = 0.1
+        self._snapshot = None
 
         self.enc_alt0 = None
         self.enc_az0 = None
@@ -131,37 +164,44 @@ class AlpacaAltAzTelescopeModel(AlpacaBaseModel):
         """
         Implement __getattr__ to generate 'alitude', 'azimuth',
         'right_ascension' and 'declination' attributes on the fly using
-        the latest telescope synchronizaiton.
+        the latest telescope synchronizaiton and pointing snapshot.
 
         """
 
-        if attr in ['altitude', 'azimuth']:
-            altaz = self.get_current_altaz()
+        if attr in ['altitude', 'azimuth', 'rightascension', 'declination']:
+            return self.get_pointing_value(attr)
+        else:
+            return super().__getattribute__(attr)
 
-            # FIXME For now if not synchronized just return 0, 0 for alt/az
-            if altaz is None:
-                altaz = (0, 0)
+    def get_pointing_value(self, attr):
+        """
+        Returns one of the 'altitude', 'azimuth', 'rightascension' or
+        'declination' properties from the current pointing snapshot.
 
-            cur_alt, cur_az = altaz
-            if attr == 'altitude':
-                return cur_alt
-            elif attr == 'azimuth':
-                return cur_az
+        :param attr: Name of property
+        :type attr: str
+        :returns:
+            (float) Value of property - RA is in hours and others in degrees
+        """
 
-        elif attr in ['rightascension', 'declination']:
-            radec = self.get_current_radec()
+        # all four come from the same snapshot so a client reading
+        # them in turn gets one consistent position
+        snapshot = self.get_pointing_snapshot()
 
-            # FIXME For now if not synchronized just return 0, 0 for ra/dec
-            if radec is None:
-                radec = SkyCoord(ra=0*u.hour, dec=0*u.deg)
+        # FIXME For now if not synchronized just return 0 for all
+        if snapshot is None or snapshot.alt is None:
+            return 0
 
-            if attr == 'rightascension':
-                return radec.ra.hour
-            elif attr == 'declination':
-                return radec.dec.degree
+        if attr == 'altitude':
+            return snapshot.alt
+        elif attr == 'azimuth':
+            return snapshot.az
+        elif attr == 'rightascension':
+            return snapshot.ra / 15
+        elif attr == 'declination':
+            return snapshot.dec
 
-        else:
-            return super().__getattribute__(attr)
+        raise ValueError(f'get_pointing_value: unknown property {attr}')
 
     def find_encoders_plugins(self):
         """
@@ -268,13 +308,39 @@ class AlpacaAltAzTelescopeModel(AlpacaBaseModel):
         # set as current
         set_current_profile(PROFILE_BASENAME, self.profile_name)
 
-        # set location
-        self.earth_location = EarthLocation(lat=self.profile.location.latitude,
-                                            lon=self.profile.location.longitude,
-                                            height=self.profile.location.altitude*u.m)
+        # setup coordinate transforms for location
+        if not self.setup_transform(self.profile):
+            logging.error(f'Error with profile {profile_name}: invalid '
+                          f'transform engine {self.profile.pointing.get("engine")}')
+            return False
 
         return True
 
+    def setup_transform(self, profile):
+        """
+        Install the transform engine selected in profile.  The current
+        engine is kept if it already matches the profile so an engine
+        warmed up at startup is the one used after connecting.
+
+        :param profile: Profile with location and pointing settings
+        :type profile: Profile
+        :return: Success code - False if the engine name is invalid
+        :rtype: bool
+
+        """
+
+        engine = profile.pointing.get('engine', 'astropy')
+        location = (profile.location.latitude, profile.location.longitude,
+                    profile.location.altitude)
+
+        current = self.transform
+        if current is not None and current.name() == engine and \
+           (current.latitude, current.longitude, current.elevation) == location:
+            return True
+
+        self.transform = create_transform_engine(engine, *location)
+        return self.transform is not None
+
     def unload_current_profile(self):
         """
         Clear any profile information from object.
@@ -315,14 +381,16 @@ class AlpacaAltAzTelescopeModel(AlpacaBaseModel):
             self.encoders = None
             return False
 
-        self.encoders = encoder_class(
-                                res_alt=encoders_profile.alt_resolution,
-                                res_az=encoders_profile.az_resolution,
+        # reuse the connection from a previous connect if settings unchanged
+        self.encoders = shared_encoder_pool().acquire(
+                                encoder_class,
+                                encoders_profile.serial_port,
+                                encoders_profile.serial_speed,
+                                encoders_profile.alt_resolution,
+                                encoders_profile.az_resolution,
                                 reverse_alt=encoders_profile.alt_reverse,
                                 reverse_az=encoders_profile.az_reverse)
-        if not self.encoders.connect(encoders_profile.serial_port,
-                                     speed=encoders_profile.serial_speed):
-            self.encoders = None
+        if self.encoders is None:
             logging.info('Failed to connect to encoders on port '
                          f'{encoders_profile.serial_port}')
             return False
@@ -330,6 +398,42 @@ class AlpacaAltAzTelescopeModel(AlpacaBaseModel):
         logging.info(f'Connected to encoders.')
         return True
 
+    def start_sampler(self, sampler_profile):
+        """
+        Start background encoder sampler if enabled in profile.
+
+        :param sampler_profile: Profile section containing sampler parameters
+        """
+
+        rate = sampler_profile.get('rate', 0)
+        if not rate or rate <= 0:
+            logging.debug('Background encoder sampler disabled.')
+            return
+
+        if sampler_profile.get('io_loop', False):
+            if isinstance(self.encoders, EncodersSerial):
+                self.sampler = shared_io_loop().add(self.encoders, rate)
+                return
+            logging.warning('Encoders driver cannot be polled by the shared '
+                            'I/O loop - using sampler thread')
+
+        depth = sampler_profile.get('pipeline_depth', 1)
+        if depth > 1 and not self.encoders.set_pipeline_depth(depth):
+            logging.warning(f'Encoders driver does not support pipelining!')
+
+        self.sampler = EncoderSampler(self.encoders, rate=rate)
+        self.sampler.start()
+
+    def stop_sampler(self):
+        """
+        Stop background encoder sampler if running.
+        """
+
+        if self.sampler is not None:
+            self.sampler.stop()
+            self.sampler = None
+            self.encoders.set_pipeline_depth(1)
+
     # FIXME connect/disconnect does not distiguish between clients - is this
     #       even addressed by the Alpaca standard?  Need to investigate.
     def connect(self):
@@ -352,6 +456,14 @@ class AlpacaAltAzTelescopeModel(AlpacaBaseModel):
             # FIXME Raise exception?
             return False
 
+        self.start_sampler(self.profile.sampler)
+
+        self.snapshot_window = self.profile.pointing.get('snapshot_window', 0.1)
+        self._snapshot = None
+
+        self.read_deadline = self.profile.encoders.get('read_deadline', 0.2)
+        self._last_sample = None
+
         self.connected = True
         return True
 
@@ -367,12 +479,17 @@ class AlpacaAltAzTelescopeModel(AlpacaBaseModel):
             logging.error('disconnect called but not connected!')
             return False
 
-        # disconnect from encoders
-        self.encoders.disconnect()
+        # stop sampler before releasing encoders it is reading
+        self.stop_sampler()
+
+        # keep encoders connected for the next connect
+        shared_encoder_pool().release(self.encoders)
 
         # clear out profile
         self.unload_current_profile()
 
+        self._snapshot = None
+
         self.connected = False
         return True
 
@@ -431,36 +548,211 @@ class AlpacaAltAzTelescopeModel(AlpacaBaseModel):
 
         return cur_alt, cur_az
 
+    def read_encoder_position(self, priority=PRIORITY_POLL):
+        """
+        Returns raw encoder position.  If the background sampler is running
+        the latest sample is used instead of reading the encoders.  Callers
+        arriving while a read is in progress get the result of that read.
+
+        A read which does not complete within read_deadline seconds or
+        fails returns the last sample read instead so requests never wait on
+        a serial port timeout and positions are still available while the
+        encoders driver reestablishes a lost link.  The timestamp of the
+        sample shows how old it is.
+
+        Reads with PRIORITY_SYNC always read the encoders so the position
+        used for synchronizing is current and are handled by the encoders
+        driver ahead of routine polls.  They never return an old sample.
+
+        :param priority: Priority of read, defaults to PRIORITY_POLL
+        :type priority: int, optional
+
+        :returns:
+            (EncoderSample) Raw encoder alt/az counts and time they were read
+                            or None if not available
+        """
+
+        if self.encoders is None:
+            return None
+
+        if priority == PRIORITY_SYNC:
+            try:
+                pos = self.encoders.get_encoder_position(priority=PRIORITY_SYNC,
+                                                         timeout=self.read_deadline)
+            except (TimeoutError, EncoderLinkDown) as e:
+                self._log_read_failure(e)
+                return None
+            return self._new_sample(pos)
+
+        if self.sampler is not None:
+            return self.sampler.latest
+
+        try:
+            timed = self._encoder_reads.do(self.encoders.get_timed_encoder_position,
+                                           timeout=self.read_deadline)
+        except (TimeoutError, EncoderLinkDown) as e:
+            self._log_read_failure(e)
+            return self._last_sample
+
+        if timed is None:
+            return self._last_sample
+
+        return self._new_sample(*timed)
+
+    def _new_sample(self, pos, timestamp=None):
+        """
+        Record position just read as the last sample.  The timestamp
+        defaults to now.
+        """
+
+        if pos is None:
+            return None
+
+        if timestamp is None:
+            timestamp = time.time()
+
+        sample = EncoderSample(pos[0], pos[1], timestamp)
+        self._last_sample = sample
+        return sample
+
+    def _log_read_failure(self, error):
+        """ Log encoder reads failing at most every few seconds. """
+
+        self._read_failures += 1
+
+        now = time.monotonic()
+        if self._read_failure_logged is not None and \
+           now - self._read_failure_logged < READ_FAILURE_LOG_INTERVAL:
+            return
+
+        logging.warning(f'{self._read_failures} encoder reads failed '
+                        f'({error}) - using last position read')
+        self._read_failures = 0
+        self._read_failure_logged = now
+
+    def is_synchronized(self):
+        """
+        Returns whether driver has been synchronized to the sky.
+
+        :rtype: bool
+        """
+        return None not in [self.enc_alt0, self.enc_az0,
+                            self.syncpos_alt, self.syncpos_az]
+
+    def convert_altaz_to_radec(self, alt, az, obstime):
+        """
+        Converts sky alt/az to RA/DEC.
+
+        :param alt: Altitude in degrees
+        :param az: Azimuth in degrees
+        :param obstime: Time of observation as a unix timestamp
+
+        :returns:
+            (float, float) RA/DEC position in degrees
+        """
+
+        ra, dec = self.transform.altaz_to_radec(alt, az, obstime)
+        logging.debug(f'current ra/dec = {ra} {dec}')
+
+        return ra, dec
+
+    def compute_pointing_snapshot(self):
+        """
+        Read encoders once and compute all coordinates derived from them.
+
+        :returns:
+            (PointingSnapshot) Current pointing or None if the encoders
+                               could not be read.  The alt/az and ra/dec
+                               fields are None if not synchronized yet.
+        """
+
+        sample = self.read_encoder_position()
+        if sample is None:
+            logging.error('compute_pointing_snapshot: Unable to read encoder position!')
+            return None
+
+        enc_alt, enc_az = sample.alt, sample.az
+        timestamp = time.time()
+
+        alt = az = ra = dec = None
+        if self.is_synchronized():
+            alt, az = self.convert_encoder_position_to_altaz(enc_alt, enc_az)
+            alt = float(alt)
+            az = float(az)
+            ra, dec = self.convert_altaz_to_radec(alt, az, timestamp)
+
+        return PointingSnapshot(timestamp, enc_alt, enc_az, alt, az, ra, dec,
+                                timestamp - sample.timestamp)
+
+    def get_pointing_snapshot(self, max_age=None):
+        """
+        Returns current pointing snapshot.  A snapshot computed less than
+        max_age seconds ago is reused so all properties requested by a
+        client poll cycle come from the same encoder read.
+
+        :param max_age: Maximum age in seconds of a reused snapshot, defaults
+                        to the snapshot window from the profile.
+        :type max_age: float, optional
+
+        :returns:
+            (PointingSnapshot) Current pointing or None if not available
+        """
+
+        snapshot = self.cached_pointing_snapshot(max_age)
+        if snapshot is not None:
+            return snapshot
+
+        snapshot = self.compute_pointing_snapshot()
+        self._snapshot = snapshot
+        return snapshot
+
+    def cached_pointing_snapshot(self, max_age=None):
+        """
+        Returns pointing snapshot computed less than max_age seconds ago
+        without reading the encoders.
+
+        :param max_age: Maximum age in seconds of snapshot, defaults
+                        to the snapshot window from the profile.
+        :type max_age: float, optional
+
+        :returns:
+            (PointingSnapshot) Recent pointing or None if there is none
+        """
+
+        if max_age is None:
+            max_age = self.snapshot_window
+
+        snapshot = self._snapshot
+        if snapshot is not None and time.time() - snapshot.timestamp < max_age:
+            return snapshot
+
+        return None
+
+    def invalidate_pointing_snapshot(self):
+        """ Make the next request for a pointing snapshot read the encoders. """
+        self._snapshot = None
+
     def get_current_altaz(self):
         """
-        Returns current RA/ALT/AZ of where device is pointing.
+        Returns current ALT/AZ of where device is pointing.
 
         *note* Driver must be synchronized or value will be meaningless.
 
         :returns:
-            (float, float) RA/DEC position or None if device is
+            (float, float) ALT/AZ position or None if device is
                            not synchronized yet
         """
-        if None in [self.enc_alt0, self.enc_az0, self.syncpos_alt, self.syncpos_az]:
+        if not self.is_synchronized():
             logging.error('get_current_altaz: No transformation setup!')
             return None
 
-        # get encoders
-        enc_pos = self.encoders.get_encoder_position()
-        if enc_pos is None:
+        snapshot = self.get_pointing_snapshot()
+        if snapshot is None:
             logging.error('get_current_altaz: Unable to read encoder position!')
             return None
 
-        enc_alt, enc_az = enc_pos
-
-        skyaltaz = self.convert_encoder_position_to_altaz(enc_alt, enc_az)
-
-        if skyaltaz is None:
-            logging.error('get_current_altaz: Unable to convert encoder position!')
-            return None
-
-        logging.debug(f'current alt/az = {skyaltaz}')
-        return skyaltaz
+        logging.debug(f'current alt/az = {snapshot.alt}, {snapshot.az}')
+        return snapshot.alt, snapshot.az
 
     def get_current_radec(self):
         """
@@ -469,27 +761,66 @@ class AlpacaAltAzTelescopeModel(AlpacaBaseModel):
         *note* Driver must be synchronized or value will be meaningless.
 
         :returns:
-            (float, float) RA/DEC position or None if device is
+            (float, float) RA/DEC position in degrees or None if device is
                            not synchronized yet
         """
 
-        altaz = self.get_current_altaz()
-        if not altaz:
+        snapshot = self.get_pointing_snapshot()
+        if snapshot is None or snapshot.ra is None:
             logging.error('get_current_radec: Unable to get alt/az position!')
             return None
 
-        sky_alt, sky_az = altaz
+        return snapshot.ra, snapshot.dec
 
-        # create SkyCoord and convert to RA/DEC
-        obs_time = Time.now()
+    def get_sidereal_time(self, obstime=None):
+        """
+        Returns local sidereal time at the site.
 
-        newaltaz = SkyCoord(alt=sky_alt*u.deg, az=sky_az*u.deg, obstime=obs_time,
-                            frame='altaz', location=self.earth_location)
+        :param obstime: Time as a unix timestamp, defaults to now
+        :type obstime: float, optional
 
-        cur_radec = newaltaz.transform_to('icrs')
-        logging.debug(f'current ra/dec = {cur_radec.to_string("hmsdms", sep=":")}')
+        :returns:
+            (float) Local sidereal time in hours or None if no profile loaded
+        """
+
+        if self.transform is None:
+            return None
+
+        if obstime is None:
+            obstime = time.time()
+
+        return self.transform.sidereal_time(obstime)
+
+    def get_telescope_state(self):
+        """
+        Returns all dynamic telescope properties computed from a single
+        pointing snapshot so they are consistent with each other.
 
-        return cur_radec
+        :returns:
+            (dict) Telescope state - positions are None if not available
+        """
+
+        snapshot = None
+        if self.connected:
+            snapshot = self.get_pointing_snapshot()
+
+        if snapshot is None:
+            timestamp = time.time()
+            enc_alt = enc_az = alt = az = ra = dec = age = None
+        else:
+            timestamp, enc_alt, enc_az, alt, az, ra, dec, age = snapshot
+
+        return {'Timestamp': timestamp,
+                'Connected': self.connected,
+                'Synchronized': self.is_synchronized(),
+                'Altitude': alt,
+                'Azimuth': az,
+                'RightAscension': None if ra is None else ra / 15,
+                'Declination': dec,
+                'SiderealTime': self.get_sidereal_time(timestamp),
+                'EncoderAltitude': enc_alt,
+                'EncoderAzimuth': enc_az,
+                'EncoderAge': age}
 
     def sync_to_coordinates(self, ra, dec):
         """
@@ -506,29 +837,24 @@ class AlpacaAltAzTelescopeModel(AlpacaBaseModel):
         # alt/az values from this
         logging.debug(f'syncing ra:{ra} dec:{dec}')
 
-        obs_time = Time.now()
-
-        aa = AltAz(location=self.earth_location, obstime=obs_time)
-
         # convert RA to degrees
-        radec = SkyCoord(ra*15, dec, unit='deg', frame='icrs')
-
-        sync_altaz = radec.transform_to(aa)
+        sync_alt, sync_az = self.transform.radec_to_altaz(ra*15, dec, time.time())
 
-        logging.debug(f'sync alt/az = {sync_altaz.alt}/{sync_altaz.az}')
+        logging.debug(f'sync alt/az = {sync_alt}/{sync_az}')
 
         # get encoders
-        enc_pos = self.encoders.get_encoder_position()
+        enc_pos = self.read_encoder_position(priority=PRIORITY_SYNC)
         logging.debug(f'enc_pos ALT/AZ = {enc_pos}')
 
         if enc_pos is None:
             return False
 
-        enc_alt, enc_az = enc_pos
+        self.enc_alt0 = enc_pos.alt
+        self.enc_az0 = enc_pos.az
+        self.syncpos_alt = sync_alt
+        self.syncpos_az = sync_az
 
-        self.enc_alt0 = enc_alt
-        self.enc_az0 = enc_az
-        self.syncpos_alt = sync_altaz.alt.degree
-        self.syncpos_az = sync_altaz.az.degree
+        # force next snapshot to use the new synchronization
+        self.invalidate_pointing_snapshot()
 
         return True
@@ -0,0 +1,177 @@
+#
+# Registry mapping Alpaca REST API actions to how they are handled
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import logging
+from operator import attrgetter
+
+from .alpaca_service import AlpacaBaseService, AlpacaTelescopeService
+
+# telescope properties which never change while the service is running
+TELESCOPE_STATIC_PROPERTIES = [
+    'alignmentmode', 'aperturearea', 'aperturediameter', 'axisrates',
+    'canfindhome', 'canmoveaxis', 'canpark', 'canpulseguide', 'cansetpark',
+    'cansetpierside', 'cansetrightascensionrate', 'cansettracking',
+    'canslew', 'canslewaltaz', 'canslewaltazasync', 'canslewasync',
+    'cansync', 'cansyncaltaz', 'description', 'doesrefraction',
+    'driverinfo', 'driverversion', 'equatorialsystem', 'focallength',
+    'interfaceversion', 'name']
+
+# telescope properties which can change so are read on each request
+TELESCOPE_DYNAMIC_PROPERTIES = [
+    'athome', 'atpark', 'connected', 'destinationsideofpier',
+    'guideratedeclination', 'guideraterightascension', 'ispulseguiding',
+    'sideofpier', 'siteelevation', 'sitelatitude', 'sitelongitude',
+    'slewing', 'slewsettletime', 'targetdeclination',
+    'targetrightascension', 'tracking', 'trackingrate', 'utcdate']
+
+# telescope properties computed from the current pointing
+TELESCOPE_POINTING_PROPERTIES = ['altitude', 'azimuth',
+                                 'rightascension', 'declination']
+
+
+class AlpacaActionRegistry:
+    """
+    Lookup table of the actions supported by a device built once when the
+    service starts.
+
+    GET actions are either a static value, whose complete JSON response
+    body is serialized up front, or a getter called on each request.
+    PUT actions map to the service object which validates and handles them.
+    """
+
+    def __init__(self):
+        self.static_responses = {}
+        self.getters = {}
+        self.put_services = {}
+
+    def add_static(self, action, value):
+        """
+        Add a GET action with a value which never changes.
+
+        :param action: Name of action
+        :type action: str
+        :param value: Value returned for action
+        """
+
+        self.static_responses[action] = json.dumps({'ErrorNumber': 0,
+                                                    'ErrorString': '',
+                                                    'Value': value})
+
+    def add_getter(self, action, getter):
+        """
+        Add a GET action whose value is computed on each request.
+
+        :param action: Name of action
+        :type action: str
+        :param getter: Function with no arguments returning the value
+        :type getter: callable
+        """
+
+        self.getters[action] = getter
+
+    def add_service(self, service):
+        """
+        Add all PUT actions handled by a service.  Actions already handled
+        by a previously added service are not replaced.
+
+        :param service: Service handling PUT actions
+        :type service: AlpacaService
+        """
+
+        for action in service.put_actions:
+            self.put_services.setdefault(action, service)
+
+    def get_static_response(self, action):
+        """
+        Returns pre-serialized JSON response for static action.
+
+        :param action: Name of action
+        :type action: str
+        :returns: JSON response body or None if not a static action
+        :rtype: str
+        """
+
+        return self.static_responses.get(action)
+
+    def get_getter(self, action):
+        """
+        Returns getter for dynamic action.
+
+        :param action: Name of action
+        :type action: str
+        :returns: Getter or None if not a dynamic action
+        :rtype: callable
+        """
+
+        return self.getters.get(action)
+
+    def handle_put(self, action, form):
+        """
+        Validate form data and call the handler for a PUT action.
+
+        :param action: Name of action
+        :type action: str
+        :param form: PUT form data as a dict
+        :type form: dict
+        :return: Success code - True means success or None if action is not
+                 implemented.
+        :rtype: bool
+        """
+
+        service = self.put_services.get(action)
+        if service is None:
+            return None
+
+        return service.handle_put(action, form)
+
+
+def create_telescope_registry(driver):
+    """
+    Build action registry for a telescope driver.
+
+    :param driver: Telescope model
+    :type driver: AlpacaAltAzTelescopeModel
+    :returns: Action registry
+    :rtype: AlpacaActionRegistry
+    """
+
+    registry = AlpacaActionRegistry()
+
+    for action in TELESCOPE_STATIC_PROPERTIES:
+        registry.add_static(action, getattr(driver, action))
+
+    for action in TELESCOPE_POINTING_PROPERTIES:
+        registry.add_getter(action,
+                            lambda attr=action: driver.get_pointing_value(attr))
+
+    registry.add_getter('siderealtime', driver.get_sidereal_time)
+
+    for action in TELESCOPE_DYNAMIC_PROPERTIES:
+        registry.add_getter(action, lambda getter=attrgetter(action): getter(driver))
+
+    registry.add_service(AlpacaTelescopeService(driver))
+    registry.add_service(AlpacaBaseService(driver))
+
+    logging.debug(f'Telescope registry has {len(registry.static_responses)} '
+                  f'static, {len(registry.getters)} dynamic and '
+                  f'{len(registry.put_services)} PUT actions')
+
+    return registry
@@ -56,26 +56,22 @@ def field_latitude(*args, **kwargs):
                                        max=90, max_inclusive=True))
 
 
-def _put_handler(arglist, form):
+def build_put_schema(arglist):
     """
-    Create a handler dynamically for a field.
+    Create a marshmallow schema class for the fields of a PUT request.
 
     Expects a dictionary containing of the form:
 
         {form_id: field}
 
     Where form_id is the field id in the form data and field is the
-    the marshmallow field validator for that data.
-
-    Returns a dict using the lower case version of form_id as the key
-    and the value is the matching data from the form data.
+    the marshmallow field validator for that data.  The ClientID and
+    ClientTransactionID fields common to all requests are added.
 
     :param arglist: Dictionary containing descriptors of field
     :type arglist: dict
-    :param form: Request form data
-    :type form: dict
-    :return: Dictionary containing values extracted from form data
-    :rtype: dict
+    :return: Schema class
+    :rtype: Schema
 
     """
 
@@ -86,117 +82,186 @@ def _put_handler(arglist, form):
     d['ClientID'] = fields.Integer(required=True)
     d['ClientTransactionID'] = fields.Integer(required=True)
 
-    schema = Schema.from_dict(d)
+    return Schema.from_dict(d)
+
+
+def put_action(arglist):
+    """
+    Decorator declaring a method handles the PUT action of the same name.
+
+    The schema for the form fields given in arglist (see build_put_schema())
+    is built once when the decorated method is defined instead of on each
+    request.  The method is called with the dictionary of validated values
+    returned by _put_handler().
+
+    :param arglist: Dictionary containing descriptors of field
+    :type arglist: dict
+
+    """
+
+    schema = build_put_schema(arglist)()
+
+    def decorator(method):
+        method.put_schema = schema
+        return method
+
+    return decorator
+
+
+def _put_handler(schema, form):
+    """
+    Validate form data for a PUT request against a schema.
+
+    Returns a dict using the lower case version of form_id as the key
+    and the value is the matching data from the form data.
+
+    :param schema: Schema object created with build_put_schema()
+    :type schema: Schema
+    :param form: Request form data
+    :type form: dict
+    :return: Dictionary containing values extracted from form data or None
+             if validation failed.
+    :rtype: dict
+
+    """
 
     result = None
     try:
-        try_result = schema().load(form)
+        result = schema.load(form)
     except ValidationError:
         logging.error('_put_handler: failed to validate', exc_info=True)
     except ValueError:
         logging.error('_put_handler: invalid values', exc_info=True)
-    else:
-        result = {}
-        for key in arglist:
-            result[key.lower()] = try_result[key.lower()]
 
     return result
 
 
-class AlpacaBaseService():
-    """ Handle PUT REST API methods common to all Alpaca devices """
+class AlpacaService():
+    """
+    Base class for services handling PUT REST API methods.
+
+    Methods decorated with put_action() are collected when the class is
+    defined into the put_actions dispatch table which maps the action name
+    to the (schema, handler) used for it.
+    """
+
+    #: Dispatch table of action name to (schema, handler)
+    put_actions = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        cls.put_actions = {name: (method.put_schema, method)
+                           for name, method in vars(cls).items()
+                           if hasattr(method, 'put_schema')}
 
     def __init__(self, driver):
         self.driver = driver
 
-    def connected(self, form):
+    def handle_put(self, action, form):
         """
-        Handle request to connect/disconnect the driver from hardware.
+        Validate form data and call the handler for a PUT action.
 
+        :param action: Name of action
+        :type action: str
         :param form: PUT form data as a dict
         :type form: dict
+        :return: Success code - True means success or None if action is not
+                 handled by this service.
+        :rtype: bool
+
+        """
+
+        entry = self.put_actions.get(action)
+        if entry is None:
+            return None
+
+        schema, handler = entry
+
+        value = _put_handler(schema, form)
+        if value is None:
+            return False
+
+        return handler(self, value)
+
+
+class AlpacaBaseService(AlpacaService):
+    """ Handle PUT REST API methods common to all Alpaca devices """
+
+    @put_action({'Connected': fields.Boolean})
+    def connected(self, value):
+        """
+        Handle request to connect/disconnect the driver from hardware.
+
+        :param value: Validated PUT form data
+        :type value: dict
         :return: Success code - True means success.
         :rtype: bool
 
         """
 
-        value = _put_handler({'Connected': fields.Boolean}, form)
-        if value is not None:
-            if value['connected']:
-                rc = self.driver.connect()
-            else:
-                rc = self.driver.disconnect()
-            return rc
+        if value['connected']:
+            rc = self.driver.connect()
         else:
-            return False
+            rc = self.driver.disconnect()
+        return rc
 
 
-class AlpacaTelescopeService():
+class AlpacaTelescopeService(AlpacaService):
     """ Handle PUT REST API command for the Alpaca telescope driver. """
 
-    def __init__(self, driver):
-        self.driver = driver
-
-    def siteelevation(self, form):
+    @put_action({'SiteElevation': fields.Float})
+    def siteelevation(self, value):
         """
         Handle request to set site elevation.
 
-        :param form: PUT form data as a dict
-        :type form: dict
+        :param value: Validated PUT form data
+        :type value: dict
         :return: Success code - True means success.
         :rtype: bool
 
         """
 
-        value = _put_handler({'SiteElevation': fields.Float}, form)
-        if value is not None:
-            self.driver.sitelevation = value['siteelevation']
-            return True
-        else:
-            return False
+        self.driver.sitelevation = value['siteelevation']
+        return True
 
-    def sitelatitude(self, form):
+    @put_action({'SiteLatitude': field_latitude})
+    def sitelatitude(self, value):
         """
         Handle request to set site latitude.
 
-        :param form: PUT form data as a dict
-        :type form: dict
+        :param value: Validated PUT form data
+        :type value: dict
         :return: Success code - True means success.
         :rtype: bool
 
         """
 
-        value = _put_handler({'SiteLatitude': field_latitude}, form)
-        if value is not None:
-            self.driver.sitelatitude = value['sitelatitude']
-            return True
-        else:
-            return False
+        self.driver.sitelatitude = value['sitelatitude']
+        return True
 
-    def sitelongitude(self, form):
+    @put_action({'SiteLongitude': field_longitude})
+    def sitelongitude(self, value):
         """
         Handle request to set site longitude.
 
-        :param form: PUT form data as a dict
-        :type form: dict
+        :param value: Validated PUT form data
+        :type value: dict
         :return: Success code - True means success.
         :rtype: bool
 
         """
 
-        value = _put_handler({'SiteLongitude': field_longitude}, form)
-        if value is not None:
-            self.driver.sitelongitude = value['sitelongitude']
-            return True
-        else:
-            return False
+        self.driver.sitelongitude = value['sitelongitude']
+        return True
 
-    def synctoaltaz(self, form):
+    @put_action({'Altitude': fields.Float, 'Azimuth': fields.Float})
+    def synctoaltaz(self, value):
         """
         Handle request to sync mount to an alt/az position.
 
-        :param form: PUT form data as a dict
-        :type form: dict
+        :param value: Validated PUT form data
+        :type value: dict
         :return: Success code - True means success.
         :rtype: bool
 
@@ -206,22 +271,19 @@ class AlpacaTelescopeService():
         logging.warning('AlpacaTelescopeServer.synctoaltaz() not implemented!')
         return False
 
-    def synctocoordinates(self, form):
+    @put_action({'RightAscension': field_right_ascension,
+                 'Declination': field_declination})
+    def synctocoordinates(self, value):
         """
         Handle request to sync mount to a ra/dec position.
 
-        :param form: PUT form data as a dict
-        :type form: dict
+        :param value: Validated PUT form data
+        :type value: dict
         :return: Success code - True means success.
         :rtype: bool
 
         """
 
-        value = _put_handler({'RightAscension': field_right_ascension,
-                              'Declination': field_declination}, form)
-        if value is not None:
-            rc = self.driver.sync_to_coordinates(value['rightascension'],
-                                                 value['declination'])
-            return rc
-        else:
-            return False
+        rc = self.driver.sync_to_coordinates(value['rightascension'],
+                                             value['declination'])
+        return rc
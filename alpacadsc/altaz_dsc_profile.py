@@ -54,12 +54,34 @@ class AltAzSettingCirclesProfile(Profile):
         alt_reverse: bool = False
         #: Reverse AZ?
         az_reverse: bool = False
+        #: Seconds a request waits for an encoder read
+        read_deadline: float = 0.2
+
+    @dataclass
+    class Sampler(ProfileSection):
+        _sectionname: str = 'sampler'
+        #: Background encoder sampling rate in Hz - 0 disables sampler
+        rate: float = 0.0
+        #: Position requests kept outstanding by sampler - 1 disables pipelining
+        pipeline_depth: int = 1
+        #: Poll encoders from the shared EncoderIOLoop instead of a thread
+        io_loop: bool = False
+
+    @dataclass
+    class Pointing(ProfileSection):
+        _sectionname: str = 'pointing'
+        #: Seconds a pointing snapshot is reused between requests
+        snapshot_window: float = 0.1
+        #: Coordinate transform engine - see transforms.TRANSFORM_ENGINES
+        engine: str = 'astropy'
 
     def __init__(self, reldir, name=None):
         super().__init__(reldir, name)
 
         self.add_section(self.Location)
         self.add_section(self.Encoders)
+        self.add_section(self.Sampler)
+        self.add_section(self.Pointing)
 
     def read(self):
         # load in profile
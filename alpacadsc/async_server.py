@@ -0,0 +1,439 @@
+#
+# asyncio front end serving the Alpaca REST API from one event loop
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import asyncio
+import logging
+from http import HTTPStatus
+from collections import namedtuple
+from urllib.parse import parse_qsl
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.test import EnvironBuilder
+from werkzeug.datastructures import MultiDict
+
+from .alpaca_controller import ALPACA_ERROR_NOTIMPLEMENTED
+from .alpaca_controller import ALPACA_ERROR_UNSPECIFIEDERRROR
+from .alpaca_controller import ALPACA_ERROR_STRINGS
+from .alpaca_registry import TELESCOPE_POINTING_PROPERTIES
+from .pointing_stream import PointingStream
+
+ALPACA_TELESCOPE_PREFIX = '/api/v1/telescope/0/'
+ALPACA_TELESCOPE_STREAM = ALPACA_TELESCOPE_PREFIX + 'stream'
+
+# parsed HTTP request - headers has lower case names
+HTTPRequest = namedtuple('HTTPRequest', ['method', 'path', 'query', 'version',
+                                         'headers', 'body', 'keep_alive'])
+
+
+class BadRequest(Exception):
+    """ Request could not be parsed. """
+
+
+class AsyncAlpacaServer:
+    """
+    Serve the Alpaca service from a single asyncio event loop.
+
+    Each client connection is a coroutine instead of a server thread so
+    hundreds of idle or polling keep-alive connections cost little memory.
+    Alpaca GET and PUT requests for the telescope are handled directly
+    from the action registry.  A pointing request which needs a new
+    encoder read awaits one shared read run in a small thread pool, so
+    concurrent clients never block the loop and share the same read.
+    The state stream is sent by the event loop from the shared
+    PointingBroadcaster.  All other pages such as /setup and /encoders
+    are rendered by the Flask app in the thread pool.
+    """
+
+    #: longest request line or header line accepted
+    MAX_LINE = 16384
+
+    #: largest request body accepted
+    MAX_BODY = 1024*1024
+
+    def __init__(self, app, host='127.0.0.1', port=8000, idle_timeout=300.0,
+                 threads=4):
+        """
+        :param app: App from create_app()
+        :type app: Flask
+        :param host: Address to listen on, defaults to '127.0.0.1'
+        :type host: str, optional
+        :param port: Port to listen on, defaults to 8000
+        :type port: int, optional
+        :param idle_timeout: Seconds an idle keep-alive connection is kept
+                             open, defaults to 300.0
+        :type idle_timeout: float, optional
+        :param threads: Threads for encoder reads, PUT actions and Flask
+                        pages, defaults to 4
+        :type threads: int, optional
+
+        """
+
+        self.app = app
+        self.driver = app.extensions['alpacadsc']['driver']
+        self.registry = app.extensions['alpacadsc']['registry']
+        self.broadcaster = app.extensions['alpacadsc']['broadcaster']
+        self.host = host
+        self.port = port
+        self.idle_timeout = idle_timeout
+
+        #: number of open client connections
+        self.connections = 0
+
+        self._executor = ThreadPoolExecutor(max_workers=threads,
+                                            thread_name_prefix='AsyncAlpaca')
+        self._server = None
+        self._snapshot_future = None
+
+    async def start(self):
+        """ Start listening.  The port is updated if 0 was requested. """
+
+        self._server = await asyncio.start_server(self._serve_connection,
+                                                  self.host, self.port,
+                                                  limit=self.MAX_LINE)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info(f'AsyncAlpacaServer: serving on {self.host}:{self.port}')
+
+    async def serve_forever(self):
+        """ Serve requests until cancelled. """
+
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.close()
+
+    async def close(self):
+        """ Stop listening and release the thread pool. """
+
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        self._executor.shutdown(wait=False)
+
+    def run(self):
+        """ Start and serve requests until interrupted. """
+
+        async def main():
+            await self.start()
+            await self.serve_forever()
+
+        try:
+            asyncio.run(main())
+        except KeyboardInterrupt:
+            pass
+
+    async def _serve_connection(self, reader, writer):
+        self.connections += 1
+        peer = writer.get_extra_info('peername')
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader),
+                                                     self.idle_timeout)
+                except BadRequest as e:
+                    logging.debug(f'AsyncAlpacaServer: bad request from {peer}: {e}')
+                    await self._write_response(writer, HTTPStatus.BAD_REQUEST,
+                                               [('Content-Type', 'text/plain')],
+                                               str(e).encode(), False)
+                    break
+
+                if request is None:
+                    break
+
+                if request.method == 'GET' and request.path == ALPACA_TELESCOPE_STREAM:
+                    # stream ends when client disconnects
+                    await self._serve_stream(request, reader, writer)
+                    break
+
+                status, headers, body = await self._dispatch(request, peer)
+                await self._write_response(writer, status, headers, body,
+                                           request.keep_alive)
+                if not request.keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                ConnectionError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def _read_request(self, reader):
+        """
+        Read one request from a connection.
+
+        :returns:
+            (HTTPRequest) Request or None if the client closed the connection
+        :raises BadRequest: If the request is invalid
+        """
+
+        try:
+            line = await reader.readline()
+            if not line:
+                return None
+
+            try:
+                method, target, version = line.decode('latin-1').split()
+            except ValueError:
+                raise BadRequest('Invalid request line')
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, sep, value = line.decode('latin-1').partition(':')
+                if not sep:
+                    raise BadRequest('Invalid header')
+                headers[name.strip().lower()] = value.strip()
+        except ValueError:
+            # line longer than limit
+            raise BadRequest('Request line or header too long')
+
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise BadRequest('Chunked requests not supported')
+
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise BadRequest('Invalid Content-Length')
+        if length < 0 or length > self.MAX_BODY:
+            raise BadRequest('Invalid Content-Length')
+
+        body = await reader.readexactly(length) if length else b''
+
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.1':
+            keep_alive = connection != 'close'
+        else:
+            keep_alive = connection == 'keep-alive'
+
+        path, _, query = target.partition('?')
+        return HTTPRequest(method.upper(), path, query, version, headers,
+                           body, keep_alive)
+
+    async def _write_response(self, writer, status, headers, body, keep_alive):
+        if not isinstance(status, str):
+            status = f'{status.value} {status.phrase}'
+
+        lines = [f'HTTP/1.1 {status}']
+        lines += [f'{k}: {v}' for k, v in headers
+                  if k.lower() not in ('content-length', 'connection')]
+        lines.append(f'Content-Length: {len(body)}')
+        lines.append('Connection: ' + ('keep-alive' if keep_alive else 'close'))
+
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+    async def _serve_stream(self, request, reader, writer):
+        """ Send state events until the client disconnects. """
+
+        rate = dict(parse_qsl(request.query)).get('rate')
+        try:
+            stream = PointingStream(self.broadcaster.latest, rate)
+        except ValueError as e:
+            await self._write_response(writer, HTTPStatus.BAD_REQUEST,
+                                       [('Content-Type', 'text/plain')],
+                                       str(e).encode(), False)
+            return
+
+        # no Content-Length - the body ends when the connection closes
+        writer.write(b'HTTP/1.1 200 OK\r\n'
+                     b'Content-Type: text/event-stream\r\n'
+                     b'Cache-Control: no-cache\r\n'
+                     b'Connection: close\r\n\r\n')
+
+        # clients send nothing more so any read completing means it closed
+        closed = asyncio.ensure_future(reader.read(1))
+        try:
+            while True:
+                event = stream.next_event()
+                if event is not None:
+                    writer.write(event.encode())
+                    await writer.drain()
+                done, _ = await asyncio.wait({closed}, timeout=stream.period)
+                if done:
+                    break
+        finally:
+            closed.cancel()
+
+    async def _dispatch(self, request, peer):
+        """
+        Handle request.
+
+        :returns:
+            (HTTPStatus or str, list, bytes) Status, headers and body
+        """
+
+        if request.path.startswith(ALPACA_TELESCOPE_PREFIX):
+            action = request.path[len(ALPACA_TELESCOPE_PREFIX):]
+            if action and '/' not in action:
+                if request.method == 'GET':
+                    resp = await self._alpaca_get(action)
+                    return self._json_response(resp)
+                elif request.method == 'PUT':
+                    resp = await self._alpaca_put(action, request.body)
+                    return self._json_response(resp)
+
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._call_app, request, peer)
+
+    def _json_response(self, resp):
+        if not isinstance(resp, str):
+            resp = json.dumps(resp)
+        return (HTTPStatus.OK, [('Content-Type', 'application/json')],
+                resp.encode())
+
+    async def _alpaca_get(self, action):
+        """
+        Handle GET for telescope action.
+
+        :returns:
+            (dict or str) Response or pre-serialized response
+        """
+
+        body = self.registry.get_static_response(action)
+        if body is not None:
+            return body
+
+        resp = {'ErrorNumber': 0, 'ErrorString': '', 'Value': ''}
+
+        if action == 'state':
+            getter = self.driver.get_telescope_state
+        else:
+            getter = self.registry.get_getter(action)
+
+        if getter is None:
+            resp['ErrorNumber'] = ALPACA_ERROR_NOTIMPLEMENTED
+            resp['ErrorString'] = ALPACA_ERROR_STRINGS[resp['ErrorNumber']]
+            return resp
+
+        pointing = action == 'state' or action in TELESCOPE_POINTING_PROPERTIES
+        try:
+            if pointing and not await self._refresh_snapshot():
+                # no usable snapshot so the getter may read the encoders
+                loop = asyncio.get_running_loop()
+                resp['Value'] = await loop.run_in_executor(self._executor, getter)
+            else:
+                resp['Value'] = getter()
+        except Exception:
+            logging.error(f'AsyncAlpacaServer: GET {action} failed', exc_info=True)
+            resp['ErrorNumber'] = ALPACA_ERROR_UNSPECIFIEDERRROR
+            resp['ErrorString'] = ALPACA_ERROR_STRINGS[resp['ErrorNumber']]
+
+        return resp
+
+    async def _alpaca_put(self, action, body):
+        """
+        Handle PUT for telescope action.
+
+        :returns:
+            (dict) Response
+        """
+
+        resp = {'ErrorNumber': 0, 'ErrorString': ''}
+
+        form = MultiDict(parse_qsl(body.decode('utf-8', errors='replace'),
+                                   keep_blank_values=True))
+        logging.debug(f'AsyncAlpacaServer: PUT {action} {form}')
+
+        loop = asyncio.get_running_loop()
+        try:
+            rc = await loop.run_in_executor(self._executor,
+                                            self.registry.handle_put,
+                                            action, form)
+        except Exception:
+            logging.error(f'AsyncAlpacaServer: PUT {action} failed', exc_info=True)
+            rc = False
+
+        if rc is None:
+            resp['ErrorNumber'] = ALPACA_ERROR_NOTIMPLEMENTED
+            resp['ErrorString'] = ALPACA_ERROR_STRINGS[resp['ErrorNumber']]
+        elif not rc:
+            resp['ErrorNumber'] = ALPACA_ERROR_UNSPECIFIEDERRROR
+            resp['ErrorString'] = ALPACA_ERROR_STRINGS[resp['ErrorNumber']]
+
+        return resp
+
+    async def _refresh_snapshot(self):
+        """
+        Make sure the driver has a recent pointing snapshot.  Concurrent
+        callers await the same encoder read.
+
+        :returns:
+            (bool) True if getters can be called without reading encoders
+        """
+
+        if not self.driver.connected:
+            return True
+
+        # with no snapshot window the getter reads the encoders itself so
+        # reading them here as well would double the reads
+        if self.driver.snapshot_window <= 0:
+            return False
+
+        if self.driver.cached_pointing_snapshot() is not None:
+            return True
+
+        if self._snapshot_future is None or self._snapshot_future.done():
+            loop = asyncio.get_running_loop()
+            self._snapshot_future = loop.run_in_executor(
+                self._executor, self.driver.get_pointing_snapshot)
+
+        try:
+            await asyncio.shield(self._snapshot_future)
+        except Exception:
+            logging.error('AsyncAlpacaServer: pointing snapshot failed',
+                          exc_info=True)
+
+        return self.driver.cached_pointing_snapshot() is not None
+
+    def _call_app(self, request, peer):
+        """ Run request through the Flask app - called in thread pool. """
+
+        headers = [(k, v) for k, v in request.headers.items()
+                   if k != 'content-length']
+        builder = EnvironBuilder(path=request.path,
+                                 query_string=request.query,
+                                 method=request.method,
+                                 headers=headers,
+                                 data=request.body)
+        try:
+            environ = builder.get_environ()
+        finally:
+            builder.close()
+
+        if peer:
+            environ['REMOTE_ADDR'] = peer[0]
+        environ['SERVER_PROTOCOL'] = request.version
+
+        response = []
+
+        def start_response(status, response_headers, exc_info=None):
+            response[:] = [status, response_headers]
+
+        result = self.app(environ, start_response)
+        try:
+            body = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+        return response[0], response[1], body
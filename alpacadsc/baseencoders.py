@@ -19,8 +19,23 @@
 #
 
 
+import time
 from abc import ABCMeta, abstractmethod
 
+# priorities of encoder transactions - lower values are handled first
+PRIORITY_SYNC = 0
+PRIORITY_CONFIG = 1
+PRIORITY_POLL = 2
+
+
+class EncoderLinkDown(ConnectionError):
+    """
+    Raised by drivers when the link to the hardware has been lost and
+    is being reestablished.
+    """
+    pass
+
+
 class EncodersBase(metaclass=ABCMeta):
     """ Base class for all encoder drivers. """
 
@@ -64,10 +79,16 @@ class EncodersBase(metaclass=ABCMeta):
         pass
 
     @abstractmethod
-    def get_encoder_position(self):
+    def get_encoder_position(self, priority=PRIORITY_POLL, timeout=None):
         """
         Read the encoders resolution from the digital setting circles hardware.
 
+        :param priority: Priority of read, PRIORITY_SYNC for reads used to
+                         synchronize, defaults to PRIORITY_POLL
+        :type priority: int, optional
+        :param timeout: Seconds to wait for the read, defaults to no limit
+        :type timeout: float, optional
+        :raises TimeoutError: If read did not complete within timeout
         :returns:
             (tuple)  The position of the altitude and azimuth encoders.
 
@@ -86,3 +107,57 @@ class EncodersBase(metaclass=ABCMeta):
 
         """
         pass
+
+    def get_timed_encoder_position(self, priority=PRIORITY_POLL, timeout=None):
+        """
+        Read the encoder position with the time it was measured.  Drivers
+        which return positions requested earlier, like pipelined serial
+        drivers, return the time the request was sent.
+
+        :param priority: Priority of read, defaults to PRIORITY_POLL
+        :type priority: int, optional
+        :param timeout: Seconds to wait for the read, defaults to no limit
+        :type timeout: float, optional
+        :returns:
+            (tuple, float) Position of the altitude and azimuth encoders
+            and time.time() it was measured or None if the read failed.
+        """
+
+        pos = self.get_encoder_position(priority=priority, timeout=timeout)
+        if pos is None:
+            return None
+        return pos, time.time()
+
+    def get_cached_resolution(self):
+        """
+        Returns the encoders resolution last set without communicating
+        with the hardware for drivers which keep it.
+
+        :returns:
+            (tuple) The resolution of the altitude and azimuth encoders or
+            None if not known.
+        """
+        return None
+
+    def set_pipeline_depth(self, depth):
+        """
+        Set number of position requests kept outstanding by routine polls
+        for drivers which support pipelining.
+
+        :param depth: Pipeline depth - 1 disables pipelining
+        :type depth: int
+        :returns:
+            (bool) True if supported by driver
+        """
+        return False
+
+    def get_command_stats(self):
+        """
+        Returns statistics of the command queue for drivers which queue
+        transactions with the hardware.
+
+        :returns:
+            (dict) Statistics from CommandQueue.stats() or None if the
+            driver does not queue transactions.
+        """
+        return None
@@ -19,19 +19,78 @@
 
 import time
 import logging
-import serial
+import threading
+import collections
 
-from .baseencoders import EncodersBase
+from .baseencoders import EncodersBase, EncoderLinkDown
+from .baseencoders import PRIORITY_CONFIG, PRIORITY_POLL
+from .command_queue import CommandQueue
+from .encoder_codecs import FramingError
+from .transports import open_transport
+from .reconnect import ReconnectSupervisor
 
 
 class EncodersSerial(EncodersBase):
-    """ Base class for all DSC drivers using a serial port. """
+    """
+    Base class for all DSC drivers using a serial port or another
+    Transport carrying the same byte stream such as a TCP connection.
+
+    All transactions with the hardware are run by a CommandQueue owned by
+    the driver so commands from different threads never interleave on the
+    transport.  Drivers set codec_class to the EncoderCodec for the protocol
+    spoken by the hardware.  The transactions are only ever run from the
+    command queue thread.
+
+    Reads use a short inter-byte timeout so a response which lost a byte
+    is detected quickly.  A response which fails validation by the codec
+    fails only that read - the input buffer is flushed so the next request
+    starts on a frame boundary.  Bytes waiting before a request is sent
+    with no response outstanding are discarded for the same reason.
+
+    Routine position polls can be pipelined by setting a pipeline depth
+    greater than 1 with set_pipeline_depth().  That many position requests
+    are kept outstanding so the link is not idle waiting for each response
+    and responses are matched to requests in order.  A pipelined poll
+    returns the response to the request sent by an earlier poll so it is
+    older by up to the time between polls.  All other transactions first
+    wait for the outstanding responses so they never interleave with them.
+
+    Routine polls can instead be made by an EncoderIOLoop which services
+    many drivers from one thread using start_poll(), poll_response() and
+    finish_poll().  The transport is reserved for the loop from sending
+    the request until the response arrives and command queue transactions
+    wait for it to be released.
+
+    The link is considered lost if the transport reports an error or
+    MAX_FAILURES position reads in a row fail.  The port is then closed
+    and reopened in the background by a ReconnectSupervisor with the
+    encoder resolution restored once it is open again.  Until then
+    transactions raise EncoderLinkDown immediately.
+    """
 
     # set to false so scan for drivers will skip over this one
     # as it is also a subclass for EncodersBase but is not
     # a fully implemented driver
     _is_plugin = False
 
+    #: consecutive failed position reads before the link is reopened
+    MAX_FAILURES = 3
+
+    #: seconds to wait for a response to start
+    SERIAL_TIMEOUT = 5
+
+    #: seconds without a byte before a partial response is abandoned
+    INTER_BYTE_TIMEOUT = 0.1
+
+    #: seconds to wait for each readiness probe to be answered
+    PROBE_TIMEOUT = 0.1
+
+    #: seconds to keep probing a newly opened link before giving up
+    READY_TIMEOUT = 3.0
+
+    #: EncoderCodec subclass for the protocol spoken by the hardware
+    codec_class = None
+
     def __init__(self, res_alt=4000, res_az=4000,
                  reverse_alt=False, reverse_az=False):
         """
@@ -50,7 +109,26 @@ class EncodersSerial(EncodersBase):
         self.res_alt = res_alt
         self.reverse_az = reverse_az
         self.reverse_alt = reverse_alt
-        self.serial = None
+        self.transport = None
+        self.codec = self.codec_class() if self.codec_class else None
+        self.command_queue = None
+        self.supervisor = None
+        self.link_up = False
+        self._failures = 0
+
+        # held while a transaction or an event loop poll uses the transport
+        self._io_lock = threading.Lock()
+
+        #: number of invalid responses and unexpected bytes discarded
+        self.framing_errors = 0
+
+        # number of position requests kept outstanding by polls
+        self.pipeline_depth = 1
+        # time each outstanding position request was sent - oldest first
+        self._outstanding = collections.deque()
+
+        #: LoopSampler polling this driver from an EncoderIOLoop if any
+        self.loop_sampler = None
 
     def name(self):
         raise NotImplementedError
@@ -60,7 +138,9 @@ class EncodersSerial(EncodersBase):
         The driver should connect to the digital setting circles hardware
         when this method is called.
 
-        :param port: Serial device to which digital setting circles is connected.
+        :param port: Serial device to which digital setting circles is
+                     connected or a transport URL like tcp://host:port -
+                     see open_transport().
         :type action: str
         :param res_alt: Speed for serial connection.
         :type action: int
@@ -69,24 +149,42 @@ class EncodersSerial(EncodersBase):
 
         """
 
-        if self.serial is not None:
-            logging.warning('AltAzEncoders: self.serial is not None and connecting!')
+        if self.transport is not None:
+            logging.warning('AltAzEncoders: self.transport is not None and connecting!')
 
         logging.info(f'Connecting to f{self.name} style DSC '
                      f' on port {port} at speed {speed}.')
 
         self.port = port
-        self.serial = serial.Serial(port, speed, timeout=5)
+        self.speed = speed
+        self.transport = self._open_port()
+        self.link_up = True
+        self._failures = 0
+
+        self.command_queue = CommandQueue(name=f'CommandQueue-{port}')
+        self.command_queue.start()
+        self._outstanding.clear()
 
-        # give a little time after open before sending encoder resolution
-        # for an arduino based board that may reset when opened it will
-        # require a hw modification to prevent this
-        time.sleep(0.5)
+        self.supervisor = ReconnectSupervisor(self._reconnect,
+                                              name=f'Reconnect-{port}')
+
+        # wait until the hardware answers before sending encoder resolution
+        # as an arduino based board may reset when opened
+        self.command_queue.submit(self._transaction, self._probe_ready,
+                                  priority=PRIORITY_CONFIG)
 
         # set resolution
         self.set_encoder_resolution(self.res_alt, self.res_az)
         return True
 
+    def _open_port(self):
+        """
+        Open the transport to the hardware.  Each read of the transport
+        waits at most INTER_BYTE_TIMEOUT and the codec keeps reading for up
+        to SERIAL_TIMEOUT while waiting for a response to start.
+        """
+        return open_transport(self.port, self.speed, self.INTER_BYTE_TIMEOUT)
+
     def disconnect(self):
         """
         Disconnect.
@@ -96,9 +194,38 @@ class EncodersSerial(EncodersBase):
 
         """
 
-        if self.serial is not None:
-            self.serial.close()
-        self.serial = None
+        if self.supervisor is not None:
+            self.supervisor.stop()
+        self.supervisor = None
+
+        # let transaction in progress finish before closing port
+        if self.command_queue is not None:
+            self.command_queue.stop()
+        self.command_queue = None
+
+        if self.transport is not None:
+            self.transport.close()
+        self.transport = None
+        self.link_up = False
+        self._outstanding.clear()
+
+    def get_command_stats(self):
+        """
+        Returns statistics of the command queue and link.
+
+        :returns:
+            (dict) Statistics from CommandQueue.stats() plus keys 'link_up',
+            'reconnects' and 'framing_errors' or None if not connected.
+        """
+
+        if self.command_queue is None:
+            return None
+
+        stats = self.command_queue.stats()
+        stats['link_up'] = self.link_up
+        stats['reconnects'] = self.supervisor.reconnects
+        stats['framing_errors'] = self.framing_errors
+        return stats
 
     def get_encoder_resolution(self):
         """
@@ -108,17 +235,93 @@ class EncodersSerial(EncodersBase):
             (tuple)  The resolution of the altitude and azimuth encoders.
 
         """
-        raise NotImplementedError
 
-    def get_encoder_position(self):
+        if self.command_queue is None:
+            logging.error('get_encoder_resolution: not connected!')
+            return None
+
+        try:
+            return self.command_queue.submit(self._transaction, self._exclusive,
+                                             self._read_resolution,
+                                             priority=PRIORITY_CONFIG)
+        except EncoderLinkDown:
+            logging.debug('get_encoder_resolution: link down', exc_info=True)
+            return None
+
+    def get_cached_resolution(self):
+        """
+        Returns the encoders resolution last set without communicating
+        with the hardware.
+
+        :returns:
+            (tuple) The resolution of the altitude and azimuth encoders.
+        """
+        return self.res_alt, self.res_az
+
+    def get_encoder_position(self, priority=PRIORITY_POLL, timeout=None):
         """
         Read the encoders resolution from the digital setting circles hardware.
 
+        A read which misses its timeout raises CommandTimeout without
+        waiting for the serial port timeout.  Reads while the link is being
+        reestablished raise EncoderLinkDown.
+
+        :param priority: Priority of read, PRIORITY_SYNC for reads used to
+                         synchronize, defaults to PRIORITY_POLL
+        :type priority: int, optional
+        :param timeout: Seconds to wait for the read, defaults to no limit
+        :type timeout: float, optional
         :returns:
             (ttuple)  The position of the altitude and azimuth encoders.
 
         """
-        raise NotImplementedError
+
+        if self.command_queue is None:
+            logging.error('get_encoder_position: not connected!')
+            return None
+
+        if not self.link_up:
+            raise EncoderLinkDown(f'Link to encoders on {self.port} is down')
+
+        if priority == PRIORITY_POLL:
+            timed = self.get_timed_encoder_position(timeout=timeout)
+            return None if timed is None else timed[0]
+
+        return self.command_queue.submit(self._read_transaction,
+                                         self._exclusive, self._read_position,
+                                         priority=priority, timeout=timeout)
+
+    def get_timed_encoder_position(self, priority=PRIORITY_POLL, timeout=None):
+        """
+        Read the encoder position with the time the request it answers was
+        sent.  With pipelining a routine poll returns the response to a
+        request sent by an earlier poll so this is older than the time
+        the response arrived.
+
+        :param priority: Priority of read, defaults to PRIORITY_POLL
+        :type priority: int, optional
+        :param timeout: Seconds to wait for the read, defaults to no limit
+        :type timeout: float, optional
+        :returns:
+            (tuple, float) Position of the altitude and azimuth encoders
+            and time.time() the request was sent or None if the read
+            failed.
+        """
+
+        if priority != PRIORITY_POLL:
+            return super().get_timed_encoder_position(priority, timeout)
+
+        if self.command_queue is None:
+            logging.error('get_timed_encoder_position: not connected!')
+            return None
+
+        if not self.link_up:
+            raise EncoderLinkDown(f'Link to encoders on {self.port} is down')
+
+        return self.command_queue.submit(self._read_transaction,
+                                         self._poll_position,
+                                         priority=priority,
+                                         timeout=timeout)
 
     def set_encoder_resolution(self, res_alt, res_az):
         """
@@ -130,4 +333,469 @@ class EncodersSerial(EncodersBase):
         :type action: int
 
         """
-        raise NotImplementedError
+
+        if self.command_queue is None:
+            logging.error('set_encoder_resolution: not connected!')
+            return None
+
+        try:
+            return self.command_queue.submit(self._transaction, self._exclusive,
+                                             self._write_resolution,
+                                             res_alt, res_az,
+                                             priority=PRIORITY_CONFIG)
+        except EncoderLinkDown:
+            # will be sent when link is restored
+            logging.warning('set_encoder_resolution: link down - '
+                            'resolution will be set on reconnect')
+            self.res_alt = res_alt
+            self.res_az = res_az
+            return None
+
+    def set_pipeline_depth(self, depth):
+        """
+        Set number of position requests kept outstanding by routine polls.
+
+        :param depth: Pipeline depth - 1 disables pipelining
+        :type depth: int
+        :returns: True is successful.
+        :rtype: bool
+
+        """
+
+        if depth < 1:
+            raise ValueError('set_pipeline_depth: depth must be at least 1!')
+
+        if self.command_queue is None or not self.link_up:
+            self.pipeline_depth = depth
+            return True
+
+        return self.command_queue.submit(self._transaction, self._exclusive,
+                                         self._set_pipeline_depth, depth,
+                                         priority=PRIORITY_CONFIG)
+
+    def fileno(self):
+        """
+        File descriptor of the transport for an event loop to wait on.
+
+        :returns:
+            (int) File descriptor
+        """
+        return self.transport.fileno()
+
+    def start_poll(self):
+        """
+        Send a position request for an event loop without waiting for the
+        response.  Must not be used with pipelining.
+
+        If the request is sent the transport stays reserved so no other
+        transaction can use it until finish_poll() is called.
+
+        :returns: True if the request was sent.
+        :rtype: bool
+        """
+
+        if not self.link_up or not self._io_lock.acquire(blocking=False):
+            return False
+
+        if not self.link_up:
+            # link lost while acquiring
+            self._io_lock.release()
+            return False
+
+        try:
+            self._discard_stale_input()
+            self._send_position_request()
+        except OSError as e:
+            self._io_lock.release()
+            self._link_down(f'{e}')
+            return False
+
+        return True
+
+    def poll_response(self):
+        """
+        Read the bytes of the response to start_poll() which have arrived
+        without waiting for more.  Call when the transport is readable.
+
+        :returns:
+            (tuple)  The position of the altitude and azimuth encoders or
+            None if the response is not complete yet.
+        :raises FramingError: If the response is invalid
+        :raises OSError: If the transport failed
+        """
+
+        self.codec.feed(self.transport)
+        return self.codec.next_position(self.res_alt, self.res_az)
+
+    def finish_poll(self, pos, error=None):
+        """
+        End a poll started with start_poll() and release the transport.
+
+        :param pos: Position received or None if the poll failed
+        :type pos: tuple
+        :param error: Exception raised by poll_response() if any,
+                      defaults to None
+        :type error: Exception, optional
+        """
+
+        link_lost = isinstance(error, (OSError, EncoderLinkDown))
+        try:
+            if pos is None and not link_lost:
+                if error is not None:
+                    logging.warning(f'get_encoder_position: {error}')
+                self._resync()
+        finally:
+            self._io_lock.release()
+
+        # _link_down() takes the transport so it is released first
+        if link_lost:
+            self._link_down(f'{error}')
+        else:
+            self._count_read(pos)
+
+    def _set_pipeline_depth(self, depth):
+        self.pipeline_depth = depth
+        logging.info(f'Encoder pipeline depth set to {depth}')
+        return True
+
+    def _transaction(self, func, *args):
+        """
+        Run transaction marking the link lost if the serial port fails.
+        """
+
+        if not self.link_up:
+            raise EncoderLinkDown(f'Link to encoders on {self.port} is down')
+
+        try:
+            with self._io_lock:
+                return func(*args)
+        except OSError as e:
+            self._link_down(f'{e}')
+            raise EncoderLinkDown(f'Link to encoders on {self.port} lost') from e
+
+    def _read_transaction(self, func, *args):
+        """
+        Run position read transaction marking the link lost after
+        MAX_FAILURES reads in a row fail.
+
+        :returns:
+            (tuple)  The position of the altitude and azimuth encoders or
+            None if the read failed.
+        """
+
+        pos = None
+        try:
+            pos = self._transaction(func, *args)
+        except EncoderLinkDown:
+            raise
+        except Exception:
+            logging.debug('Invalid encoder position response', exc_info=True)
+
+        return self._count_read(pos)
+
+    def _count_read(self, pos):
+        """
+        Mark the link lost after MAX_FAILURES position reads in a row fail.
+
+        :param pos: Result of read - None if it failed
+        :type pos: tuple
+        :returns: pos
+        """
+
+        if pos is not None:
+            self._failures = 0
+            return pos
+
+        self._failures += 1
+        if self._failures >= self.MAX_FAILURES:
+            self._link_down(f'{self._failures} position reads failed')
+
+        return None
+
+    def _link_down(self, reason):
+        """
+        Close the failed port and start reopening it in the background.
+        """
+
+        if not self.link_up:
+            return
+
+        logging.error(f'Link to encoders on {self.port} lost ({reason}) - '
+                      'reconnecting')
+
+        self.link_up = False
+
+        # an event loop poll in progress holds the transport and has its
+        # fd registered - have the loop end it before closing
+        if self.loop_sampler is not None:
+            self.loop_sampler.abort_poll()
+
+        with self._io_lock:
+            self._failures = 0
+            self._outstanding.clear()
+            try:
+                self.transport.close()
+            except Exception:
+                logging.debug('Error closing serial port', exc_info=True)
+
+        self.supervisor.trigger()
+
+    def _reconnect(self):
+        """
+        Reopen the transport.  Called by the supervisor thread.
+
+        :returns: True is successful.
+        :rtype: bool
+        """
+
+        new_transport = self._open_port()
+
+        try:
+            return self.command_queue.submit(self._restore_link, new_transport,
+                                             priority=PRIORITY_CONFIG)
+        except Exception:
+            new_transport.close()
+            raise
+
+    def _restore_link(self, new_transport):
+        """
+        Transaction switching to the reopened port and restoring the
+        encoder resolution.
+
+        :returns: True if the encoders answered on the reopened port.
+        :rtype: bool
+        """
+
+        with self._io_lock:
+            self.transport = new_transport
+            self.codec.reset()
+            self._outstanding.clear()
+            self._failures = 0
+
+            try:
+                # same probe as connect() for boards which reset when opened
+                if not self._probe_ready():
+                    # port opened but nothing answers - keep backing off
+                    new_transport.close()
+                    return False
+                self._write_resolution(self.res_alt, self.res_az)
+            except OSError:
+                new_transport.close()
+                raise
+
+        self.link_up = True
+        logging.info(f'Link to encoders on {self.port} restored')
+        return True
+
+    def _probe_ready(self):
+        """
+        Transaction waiting for newly opened hardware to answer.
+
+        Resolution queries are sent until one is answered correctly so
+        hardware which answers at once is used at once, while a board
+        which resets when the port is opened is given up to READY_TIMEOUT
+        seconds to start.
+
+        :returns: True if the hardware answered.
+        :rtype: bool
+        """
+
+        deadline = time.monotonic() + self.READY_TIMEOUT
+        probes = 0
+        while True:
+            probes += 1
+            self._discard_stale_input()
+            self.transport.write(self.codec.resolution_request)
+            try:
+                self.codec.read_counts(self.transport, self.PROBE_TIMEOUT)
+            except FramingError:
+                self.codec.reset()
+            else:
+                logging.debug(f'Encoders ready after {probes} probes')
+                return True
+
+            if time.monotonic() >= deadline:
+                logging.warning(f'Encoders on {self.port} did not answer '
+                                f'within {self.READY_TIMEOUT} s')
+                return False
+
+    def _exclusive(self, func, *args):
+        """
+        Run transaction after receiving any outstanding position responses.
+        """
+        self._drain_pipeline()
+        return func(*args)
+
+    def _drain_pipeline(self):
+        """ Receive and discard responses to outstanding position requests. """
+
+        try:
+            while self._outstanding:
+                self._outstanding.popleft()
+                if self._receive_position() is None:
+                    self._reset_pipeline()
+        except Exception:
+            self._reset_pipeline()
+            raise
+
+    def _reset_pipeline(self):
+        """
+        Forget outstanding position requests after a failed response as
+        responses can no longer be matched to requests.
+        """
+
+        logging.warning(f'Resetting pipeline with {len(self._outstanding)} '
+                        'requests outstanding')
+        self._outstanding.clear()
+        self.codec.reset()
+        try:
+            self.transport.reset_input_buffer()
+        except OSError:
+            logging.debug('Error flushing serial port', exc_info=True)
+
+    def _poll_position(self):
+        """
+        Transaction for routine position polls keeping pipeline_depth
+        requests outstanding.
+
+        :returns:
+            (tuple)  The position of the altitude and azimuth encoders and
+            the time the request it answers was sent or None if the read
+            failed.
+
+        """
+
+        try:
+            self._discard_stale_input()
+            while len(self._outstanding) < self.pipeline_depth:
+                self._send_position_request()
+                self._outstanding.append(time.time())
+
+            sent = self._outstanding.popleft()
+            pos = self._receive_position()
+        except Exception:
+            self._reset_pipeline()
+            raise
+
+        if pos is None:
+            self._reset_pipeline()
+            return None
+
+        return pos, sent
+
+    def _read_position(self):
+        """
+        Transaction reading the encoder position from the hardware.
+
+        :returns:
+            (tuple)  The position of the altitude and azimuth encoders.
+
+        """
+        self._discard_stale_input()
+        self._send_position_request()
+        return self._receive_position()
+
+    def _discard_stale_input(self):
+        """
+        Discard bytes received when no response is expected such as the
+        tail of a response with an extra byte so it cannot misalign the
+        response to the next request.
+        """
+
+        if not self._outstanding and (self.codec.buffered or
+                                       self.transport.in_waiting):
+            logging.warning('Discarding unexpected bytes from encoders')
+            self._resync()
+
+    def _resync(self):
+        """
+        Recover from a framing error by flushing the input buffer so the
+        next transaction starts on a frame boundary.
+        """
+
+        self.framing_errors += 1
+        self.codec.reset()
+        try:
+            self.transport.reset_input_buffer()
+        except OSError:
+            logging.debug('Error flushing serial port', exc_info=True)
+
+    def _read_resolution(self):
+        """
+        Transaction reading the encoder resolution from the hardware.
+
+        :returns:
+            (tuple)  The resolution of the altitude and azimuth encoders.
+
+        """
+
+        self._discard_stale_input()
+        self.transport.write(self.codec.resolution_request)
+
+        try:
+            alt_steps, az_steps = self.codec.read_counts(self.transport,
+                                                         self.SERIAL_TIMEOUT)
+        except FramingError as e:
+            logging.error(f'get_encoder_resolution: {e}')
+            self._resync()
+            return None
+
+        logging.debug(f'get_encoder_resolution:  alt_res={alt_steps}, '
+                      f'az_res={az_steps}')
+        return alt_steps, az_steps
+
+    def _send_position_request(self):
+        """
+        Send request for the encoder position to the hardware.
+
+        """
+        self.transport.write(self.codec.position_request)
+
+    def _receive_position(self):
+        """
+        Read response to a position request from the hardware.
+
+        An invalid response flushes the input buffer so only this read
+        fails.
+
+        :returns:
+            (tuple)  The position of the altitude and azimuth encoders or
+            None if the response was invalid.
+
+        """
+
+        try:
+            return self.codec.read_position(self.transport, self.SERIAL_TIMEOUT,
+                                            self.res_alt, self.res_az)
+        except FramingError as e:
+            logging.warning(f'get_encoder_position: {e}')
+            self._resync()
+            return None
+
+    def _write_resolution(self, res_alt, res_az):
+        """
+        Transaction setting the encoder resolution of the hardware.
+
+        :param res_alt: Resolution (steps/rev) of altitude encoder.
+        :type action: int
+        :param res_alt: Resolution (steps/rev) of azimuth encoder.
+        :type action: int
+        :returns: True is successful.
+        :rtype: bool
+
+        """
+
+        logging.debug('set_encoder_resolution:  setting resolution to '
+                      f'res_alt={res_alt}, '
+                      f'res_az={res_az}')
+        self._discard_stale_input()
+        self.transport.write(self.codec.encode_set_resolution(res_alt, res_az))
+
+        if not self.codec.read_ack(self.transport, self.SERIAL_TIMEOUT):
+            logging.error('Set resolution failed!')
+            self._resync()
+            return False
+
+        self.res_alt = res_alt
+        self.res_az = res_az
+        return True
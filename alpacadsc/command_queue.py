@@ -0,0 +1,226 @@
+#
+# Prioritized queue of transactions for a device which can only handle
+# one command at a time
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import time
+import queue
+import logging
+import threading
+import itertools
+
+from .baseencoders import PRIORITY_SYNC, PRIORITY_CONFIG, PRIORITY_POLL
+
+PRIORITY_NAMES = {PRIORITY_SYNC: 'sync',
+                  PRIORITY_CONFIG: 'config',
+                  PRIORITY_POLL: 'poll'}
+
+
+class CommandQueueStopped(Exception):
+    """ Raised for commands submitted to or pending in a stopped queue. """
+    pass
+
+
+class CommandTimeout(TimeoutError):
+    """ Raised when a transaction does not complete before its deadline. """
+    pass
+
+
+class _Command:
+    """ Transaction waiting in the queue. """
+
+    def __init__(self, func, args, priority):
+        self.func = func
+        self.args = args
+        self.priority = priority
+        self.submitted = time.monotonic()
+        self.done = threading.Event()
+        self.cancelled = False
+        self.result = None
+        self.error = None
+
+
+class CommandQueue:
+    """
+    Serialize transactions with a device from a single worker thread.
+
+    Each transaction is a function which writes a command and reads the
+    response.  Callers block in submit() until their transaction has run.
+    Pending transactions run in priority order (lower value first) and in
+    submission order for the same priority.
+
+    A caller can give up waiting after a timeout.  A transaction which
+    has not started by then is skipped and one already running is left to
+    complete with its result discarded.
+
+    Statistics of the queue depth and the time transactions waited before
+    running are kept to show contention for the device.
+    """
+
+    def __init__(self, name='CommandQueue'):
+        """
+        :param name: Name for worker thread and log messages,
+                     defaults to 'CommandQueue'
+        :type name: str, optional
+
+        """
+
+        self.name = name
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def running(self):
+        """ True if worker thread is running. """
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """ Start worker thread. """
+
+        if self.running:
+            logging.warning(f'{self.name}: already running!')
+            return
+
+        self._thread = threading.Thread(target=self._run, name=self.name,
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop worker thread after the transaction in progress completes.
+        Pending transactions fail with CommandQueueStopped.
+        """
+
+        if self._thread is None:
+            return
+
+        # sorts ahead of all commands
+        self._queue.put((-1, next(self._seq), None))
+        self._thread.join()
+        self._thread = None
+
+        while True:
+            try:
+                _, _, cmd = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if cmd is not None:
+                cmd.error = CommandQueueStopped(f'{self.name}: stopped')
+                cmd.done.set()
+
+    def submit(self, func, *args, priority=PRIORITY_POLL, timeout=None):
+        """
+        Run transaction on worker thread and wait for it to complete.
+
+        :param func: Function performing the transaction
+        :type func: callable
+        :param priority: One of PRIORITY_SYNC, PRIORITY_CONFIG or
+                         PRIORITY_POLL, defaults to PRIORITY_POLL
+        :type priority: int, optional
+        :param timeout: Seconds to wait for transaction to complete,
+                        defaults to waiting forever
+        :type timeout: float, optional
+        :returns: Result of func
+        :raises CommandTimeout: If the transaction did not complete in time
+        """
+
+        if not self.running:
+            raise CommandQueueStopped(f'{self.name}: not running')
+
+        cmd = _Command(func, args, priority)
+        self._queue.put((priority, next(self._seq), cmd))
+
+        with self._stats_lock:
+            depth = self._queue.qsize()
+            if depth > self._max_depth:
+                self._max_depth = depth
+
+        if not cmd.done.wait(timeout):
+            cmd.cancelled = True
+            with self._stats_lock:
+                self._timeouts += 1
+            raise CommandTimeout(f'{self.name}: transaction timed out '
+                                 f'after {timeout} s')
+
+        if cmd.error is not None:
+            raise cmd.error
+        return cmd.result
+
+    def reset_stats(self):
+        """ Clear statistics. """
+
+        with self._stats_lock:
+            self._max_depth = 0
+            self._timeouts = 0
+            self._count = {p: 0 for p in PRIORITY_NAMES}
+            self._total_wait = {p: 0.0 for p in PRIORITY_NAMES}
+            self._max_wait = {p: 0.0 for p in PRIORITY_NAMES}
+
+    def stats(self):
+        """
+        Returns queue statistics.
+
+        Wait times are in seconds from submitting a transaction until it
+        starts running and are kept separately for each priority.
+
+        :returns:
+            (dict) Keys 'depth', 'max_depth', 'timeouts' and 'wait' which is
+            a dict by priority name of dicts with keys 'count', 'mean' and
+            'max'
+        """
+
+        with self._stats_lock:
+            wait = {}
+            for p, pname in PRIORITY_NAMES.items():
+                count = self._count[p]
+                mean = self._total_wait[p]/count if count > 0 else 0.0
+                wait[pname] = {'count': count, 'mean': mean,
+                               'max': self._max_wait[p]}
+
+            return {'depth': self._queue.qsize(),
+                    'max_depth': self._max_depth,
+                    'timeouts': self._timeouts,
+                    'wait': wait}
+
+    def _run(self):
+        while True:
+            _, _, cmd = self._queue.get()
+            if cmd is None:
+                break
+
+            # caller already gave up
+            if cmd.cancelled:
+                continue
+
+            waited = time.monotonic() - cmd.submitted
+            with self._stats_lock:
+                self._count[cmd.priority] += 1
+                self._total_wait[cmd.priority] += waited
+                if waited > self._max_wait[cmd.priority]:
+                    self._max_wait[cmd.priority] = waited
+
+            try:
+                cmd.result = cmd.func(*cmd.args)
+            except Exception as e:
+                logging.debug(f'{self.name}: transaction failed', exc_info=True)
+                cmd.error = e
+            cmd.done.set()
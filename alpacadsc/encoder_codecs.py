@@ -0,0 +1,343 @@
+#
+# Framing and validation of the serial protocols spoken by DSC hardware
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import re
+import time
+import struct
+
+
+class FramingError(ValueError):
+    """ Raised when a response from the hardware is not a valid frame. """
+    pass
+
+
+class EncoderCodec:
+    """
+    Base class for encoding commands and decoding responses of a DSC
+    serial protocol.
+
+    A protocol is described by class attributes - the request commands
+    and either the fixed FRAME_LENGTH or the TERMINATOR ending each
+    response.  Subclasses implement decode_counts() using a precompiled
+    format.
+
+    Each driver owns a codec instance as responses are read into a
+    receive buffer kept by the codec and reused for every read so reading
+    and decoding a position allocates little more than the two counts.
+    Bytes read past the end of a frame are kept for the next read.
+
+    Codecs find the frame boundaries and validate frames - recovering
+    from framing errors is left to EncodersSerial which must call reset()
+    whenever it flushes the port.
+    """
+
+    #: bytes sent to request the encoder position
+    position_request = b''
+    #: bytes sent to request the encoder resolution
+    resolution_request = b''
+    #: bytes returned after setting resolution or None if no response
+    set_resolution_ack = None
+
+    #: length of frames for protocols with fixed length responses
+    FRAME_LENGTH = None
+    #: byte ending frames for protocols with variable length responses
+    TERMINATOR = None
+    #: longest valid frame - a frame this long without a terminator is
+    #: abandoned rather than read until the terminator of the next one
+    MAX_FRAME_LENGTH = 24
+
+    def __init__(self):
+        # sized so compacting the buffer never moves overlapping bytes
+        self._buf = bytearray(4*self.MAX_FRAME_LENGTH)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+
+    @property
+    def buffered(self):
+        """ Number of bytes received but not yet part of a frame. """
+        return self._end - self._start
+
+    def reset(self):
+        """ Discard buffered bytes. """
+        self._start = 0
+        self._end = 0
+
+    def read_counts(self, port, timeout):
+        """
+        Read and decode one position or resolution response.
+
+        Waits up to timeout seconds for the frame to start and then only
+        as long as bytes keep arriving within the read timeout of the port
+        so a frame which lost a byte fails without waiting the full
+        timeout.
+
+        :param port: Open serial port
+        :type port: serial.Serial
+        :param timeout: Seconds to wait for the frame to start
+        :type timeout: float
+        :returns:
+            (int, int) Altitude and azimuth values
+        :raises FramingError: If no valid frame was received
+        """
+
+        start = self._start
+        end = self._receive(port, timeout, self.FRAME_LENGTH)
+        self._consume(end)
+        return self.decode_counts(self._buf, start, end)
+
+    def read_position(self, port, timeout, res_alt, res_az):
+        """
+        Read and decode one position response checking the counts are
+        possible for the encoder resolution.
+
+        :param port: Open serial port
+        :type port: serial.Serial
+        :param timeout: Seconds to wait for the frame to start
+        :type timeout: float
+        :param res_alt: Resolution (steps/rev) of altitude encoder.
+        :type res_alt: int
+        :param res_az: Resolution (steps/rev) of azimuth encoder.
+        :type res_az: int
+        :returns:
+            (int, int) Altitude and azimuth counts
+        :raises FramingError: If no valid frame was received
+        """
+
+        return self._check_range(self.read_counts(port, timeout),
+                                 res_alt, res_az)
+
+    def read_ack(self, port, timeout):
+        """
+        Read the response to setting the resolution.
+
+        :param port: Open serial port
+        :type port: serial.Serial
+        :param timeout: Seconds to wait for the response to start
+        :type timeout: float
+        :returns: True if the expected acknowledgement was received.
+        :rtype: bool
+        """
+
+        if self.set_resolution_ack is None:
+            return True
+
+        start = self._start
+        try:
+            end = self._receive(port, timeout, len(self.set_resolution_ack))
+        except FramingError:
+            return False
+        self._consume(end)
+        return self._view[start:end] == self.set_resolution_ack
+
+    def feed(self, port):
+        """
+        Read the bytes waiting on port into the receive buffer without
+        waiting for more so responses can be read incrementally by an
+        event loop.
+
+        :param port: Open serial port
+        :type port: serial.Serial
+        :returns:
+            (int) Number of bytes read
+        """
+
+        waiting = port.in_waiting
+        if not waiting:
+            return 0
+        n = port.readinto(self._space(min(waiting, self.MAX_FRAME_LENGTH)))
+        self._end += n
+        return n
+
+    def next_position(self, res_alt, res_az):
+        """
+        Decode the next position response in the receive buffer.
+
+        :param res_alt: Resolution (steps/rev) of altitude encoder.
+        :type res_alt: int
+        :param res_az: Resolution (steps/rev) of azimuth encoder.
+        :type res_az: int
+        :returns:
+            (int, int) Altitude and azimuth counts or None if a complete
+            frame has not been received yet
+        :raises FramingError: If the frame is not valid
+        """
+
+        end = self._frame_end(self.FRAME_LENGTH)
+        if end < 0:
+            return None
+
+        start = self._start
+        self._consume(end)
+        return self._check_range(self.decode_counts(self._buf, start, end),
+                                 res_alt, res_az)
+
+    def decode_counts(self, buf, start, end):
+        """
+        Decode the two counts in a position or resolution response.
+
+        :param buf: Buffer containing frame
+        :type buf: bytearray
+        :param start: Index of first byte of frame
+        :type start: int
+        :param end: Index after last byte of frame
+        :type end: int
+        :returns:
+            (int, int) Altitude and azimuth values
+        :raises FramingError: If frame is not valid
+        """
+        raise NotImplementedError
+
+    def encode_set_resolution(self, res_alt, res_az):
+        """
+        Returns command setting encoder resolution.
+
+        :param res_alt: Resolution (steps/rev) of altitude encoder.
+        :type res_alt: int
+        :param res_az: Resolution (steps/rev) of azimuth encoder.
+        :type res_az: int
+        :returns:
+            (bytes) Command to send
+        """
+        raise NotImplementedError
+
+    def _receive(self, port, timeout, length):
+        """
+        Read from port until a frame of length bytes (or ending with
+        TERMINATOR if length is None) is buffered.
+
+        :returns:
+            (int) Index after last byte of frame
+        :raises FramingError: If the frame did not arrive
+        """
+
+        deadline = None
+        while True:
+            end = self._frame_end(length)
+            if end >= 0:
+                return end
+
+            nbuf = self._end - self._start
+            if length is not None:
+                wanted = length - nbuf
+            else:
+                # read what has arrived without reading past the room
+                # left for this frame
+                wanted = min(port.in_waiting or 1, self.MAX_FRAME_LENGTH - nbuf)
+
+            n = port.readinto(self._space(wanted))
+            if n:
+                self._end += n
+                continue
+
+            if nbuf:
+                raise self._frame_error('incomplete')
+            if deadline is None:
+                deadline = time.monotonic() + timeout
+            elif time.monotonic() >= deadline:
+                raise FramingError('no response')
+
+    def _frame_end(self, length):
+        """
+        Returns index after last byte of the first buffered frame or -1 if
+        the frame is not complete.
+        """
+
+        if length is not None:
+            if self._end - self._start >= length:
+                return self._start + length
+            return -1
+
+        end = self._buf.find(self.TERMINATOR, self._start, self._end)
+        if end >= 0:
+            return end + 1
+        if self._end - self._start >= self.MAX_FRAME_LENGTH:
+            raise self._frame_error('no terminator in')
+        return -1
+
+    def _space(self, size):
+        """ Returns view of free space in buffer for size bytes. """
+
+        if self._end + size > len(self._buf):
+            nbuf = self._end - self._start
+            self._buf[0:nbuf] = self._view[self._start:self._end]
+            self._start = 0
+            self._end = nbuf
+        return self._view[self._end:self._end + size]
+
+    def _check_range(self, counts, res_alt, res_az):
+        alt, az = counts
+        if abs(alt) > res_alt or abs(az) > res_az:
+            raise FramingError(f'counts {alt} {az} exceed resolution')
+        return counts
+
+    def _consume(self, end):
+        if end == self._end:
+            self._start = 0
+            self._end = 0
+        else:
+            self._start = end
+
+    def _frame_error(self, reason):
+        frame = bytes(self._view[self._start:self._end])
+        self.reset()
+        return FramingError(f'{reason} frame {frame!r}')
+
+
+class DaveEkCodec(EncoderCodec):
+    """
+    Binary "Dave Ek" protocol - responses are two little endian 16 bit
+    values with no delimiter.
+    """
+
+    position_request = b'y'
+    resolution_request = b'h'
+
+    FRAME_LENGTH = 4
+    FRAME = struct.Struct('<HH')
+
+    def decode_counts(self, buf, start, end):
+        return self.FRAME.unpack_from(buf, start)
+
+    def encode_set_resolution(self, res_alt, res_az):
+        return b'z' + self.FRAME.pack(res_alt, res_az)
+
+
+class GenericCodec(EncoderCodec):
+    """
+    Text protocol used by many DSC boxes - responses are two signed
+    decimal values separated by a tab and terminated by a carriage return.
+    """
+
+    position_request = b'Q\r\n'
+    resolution_request = b'H\r\n'
+    set_resolution_ack = b'*'
+
+    TERMINATOR = b'\r'
+    FRAME = re.compile(rb'([+-]?\d+)\t([+-]?\d+)\r')
+
+    def decode_counts(self, buf, start, end):
+        match = self.FRAME.fullmatch(buf, start, end)
+        if match is None:
+            raise FramingError(f'malformed frame {bytes(buf[start:end])!r}')
+        return int(match[1]), int(match[2])
+
+    def encode_set_resolution(self, res_alt, res_az):
+        return f'Z{res_alt:+d} {res_az:+d}\r\n'.encode('utf-8')
@@ -0,0 +1,414 @@
+#
+# Event loop polling many encoder drivers from one thread
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import time
+import socket
+import logging
+import selectors
+import threading
+
+from .baseencoders import EncoderLinkDown
+from .encoder_codecs import FramingError
+from .encoder_sampler import EncoderSample
+
+
+class LoopSampler:
+    """
+    Encoders driver polled by an EncoderIOLoop.
+
+    Has the same latest, running and stop() interface as EncoderSampler
+    so it can be used in its place.
+    """
+
+    def __init__(self, loop, encoders, rate):
+        self.loop = loop
+        self.encoders = encoders
+        self.period = 1.0 / rate
+
+        #: number of samples published
+        self.samples = 0
+
+        self._latest = None
+        self._next_poll = time.monotonic()
+        self._deadline = None
+        self._fd = None
+        self._removing = False
+        self._aborting = False
+        self._removed = threading.Event()
+
+    @property
+    def latest(self):
+        """
+        Most recent encoder sample or None if no sample available.
+
+        :rtype: EncoderSample
+        """
+        return self._latest
+
+    @property
+    def running(self):
+        """ True if encoders are being polled. """
+        return not self._removed.is_set()
+
+    def sample(self):
+        """
+        Read encoders once from the calling thread and publish the result.
+
+        :returns: New sample or None if read failed.
+        :rtype: EncoderSample
+        """
+
+        try:
+            timed = self.encoders.get_timed_encoder_position()
+        except EncoderLinkDown:
+            # driver is reconnecting and has already logged the failure
+            timed = None
+        except Exception:
+            logging.error('LoopSampler: error reading encoders', exc_info=True)
+            timed = None
+
+        if timed is None:
+            return None
+
+        # time the request was sent as a pipelined response is older
+        (alt, az), timestamp = timed
+        sample = EncoderSample(alt, az, timestamp)
+        self._latest = sample
+        self.samples += 1
+        return sample
+
+    def stop(self):
+        """ Stop polling and wait for any poll in progress to finish. """
+        self.loop.remove(self)
+
+    def abort_poll(self):
+        """
+        Have the loop end a poll in progress without waiting for the
+        response so it stops waiting on the transport.  Called by the
+        driver when its link is lost before it closes the transport.
+        """
+        self._aborting = True
+        self.loop._wake()
+
+
+class EncoderIOLoop:
+    """
+    Poll encoders drivers at fixed rates from a single thread.
+
+    Instead of a thread blocked reading each driver the loop sends a
+    position request to each driver when its next sample is due and waits
+    for any transport to become readable with a selector.  Responses are
+    decoded incrementally as bytes arrive and published as EncoderSample
+    objects.  A dozen DSC devices can be served by one thread with the
+    latency of each limited only by its own link.
+
+    Drivers must support start_poll(), poll_response(), finish_poll() and
+    fileno() like EncodersSerial and their transport must work with the
+    selector - on Windows only TCP transports do.
+    """
+
+    def __init__(self, response_timeout=1.0, name='EncoderIOLoop'):
+        """
+        :param response_timeout: Seconds to wait for a response,
+                                 defaults to 1.0
+        :type response_timeout: float, optional
+        :param name: Name for thread and log messages,
+                     defaults to 'EncoderIOLoop'
+        :type name: str, optional
+
+        """
+
+        self.response_timeout = response_timeout
+        self.name = name
+
+        self._samplers = []
+        self._pending = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = False
+        self._selector = None
+        self._wake_r = None
+        self._wake_w = None
+
+    @property
+    def running(self):
+        """ True if loop thread is running. """
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """ Start loop thread. """
+
+        if self.running:
+            logging.warning(f'{self.name}: already running!')
+            return
+
+        self._selector = selectors.DefaultSelector()
+        # socket pair so other threads can wake the loop on any platform
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name=self.name,
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop polling all drivers and wait for thread to exit. """
+
+        if self._thread is None:
+            return
+
+        self._stop = True
+        self._wake()
+        self._thread.join()
+        self._thread = None
+
+        self._selector.close()
+        self._wake_r.close()
+        self._wake_w.close()
+
+    def add(self, encoders, rate):
+        """
+        Start polling a connected encoders driver.  One sample is taken
+        before returning so the latest sample is available as soon as
+        this returns.
+
+        :param encoders: Connected encoders driver object.
+        :type encoders: EncodersSerial
+        :param rate: Sampling rate in Hz
+        :type rate: float
+        :returns:
+            (LoopSampler) Handle with the latest sample
+        """
+
+        if rate <= 0:
+            raise ValueError(f'{self.name}: rate must be positive!')
+
+        sampler = LoopSampler(self, encoders, rate)
+        encoders.loop_sampler = sampler
+        sampler.sample()
+        with self._lock:
+            self._pending.append(sampler)
+        self._wake()
+        logging.info(f'{self.name}: polling {encoders.name()} encoders with '
+                     f'period {sampler.period:.3f} s')
+        return sampler
+
+    def remove(self, sampler):
+        """
+        Stop polling a driver.  Waits for a poll in progress to finish so
+        the driver can be disconnected when this returns.
+
+        :param sampler: Handle returned by add()
+        :type sampler: LoopSampler
+        """
+
+        if sampler._removed.is_set():
+            return
+
+        sampler._removing = True
+        if self.running:
+            self._wake()
+            sampler._removed.wait()
+        else:
+            sampler._removed.set()
+
+        if sampler.encoders.loop_sampler is sampler:
+            sampler.encoders.loop_sampler = None
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b'\0')
+        except (AttributeError, OSError):
+            pass
+
+    def _run(self):
+        while not self._stop:
+            with self._lock:
+                self._samplers.extend(self._pending)
+                self._pending.clear()
+
+            now = time.monotonic()
+            for sampler in list(self._samplers):
+                try:
+                    self._service(sampler, now)
+                except Exception as e:
+                    logging.error(f'{self.name}: error polling '
+                                  f'{sampler.encoders.name()} encoders',
+                                  exc_info=True)
+                    self._drop_poll(sampler, e)
+
+            timeout = self._next_timeout(time.monotonic())
+            try:
+                events = self._selector.select(timeout)
+            except (OSError, ValueError) as e:
+                # a transport was closed under a poll - end all polls in
+                # progress so each is started again on a valid transport
+                logging.error(f'{self.name}: select failed', exc_info=True)
+                for sampler in self._samplers:
+                    self._drop_poll(sampler, e)
+                continue
+
+            for key, _ in events:
+                if key.data is None:
+                    try:
+                        while self._wake_r.recv(64):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+
+                try:
+                    self._receive(key.data)
+                except Exception as e:
+                    logging.error(f'{self.name}: error reading '
+                                  f'{key.data.encoders.name()} encoders',
+                                  exc_info=True)
+                    self._drop_poll(key.data, e)
+
+        for sampler in self._samplers + self._pending:
+            if sampler._fd is not None:
+                self._finish(sampler, None)
+            sampler._removed.set()
+        self._samplers.clear()
+        self._pending.clear()
+
+    def _service(self, sampler, now):
+        """ Start, time out, abort or remove the poll of one driver. """
+
+        aborting, sampler._aborting = sampler._aborting, False
+        if sampler._fd is not None:
+            if aborting:
+                self._finish(sampler, None,
+                             EncoderLinkDown('poll aborted - link lost'))
+            elif now >= sampler._deadline:
+                logging.warning(f'{self.name}: no response from '
+                                f'{sampler.encoders.name()} encoders')
+                self._finish(sampler, None)
+        elif sampler._removing:
+            self._samplers.remove(sampler)
+            sampler._removed.set()
+        elif now >= sampler._next_poll:
+            self._start_poll(sampler, now)
+
+    def _drop_poll(self, sampler, error):
+        """
+        End a poll in progress after an unexpected error so one driver
+        cannot stop the loop serving the others.
+        """
+
+        if sampler._fd is None:
+            return
+
+        try:
+            self._finish(sampler, None, error)
+        except Exception:
+            logging.error(f'{self.name}: error ending poll of '
+                          f'{sampler.encoders.name()} encoders', exc_info=True)
+
+    def _next_timeout(self, now):
+        wakeup = None
+        for sampler in self._samplers:
+            if sampler._fd is not None:
+                t = sampler._deadline
+            elif sampler._removing:
+                t = now
+            else:
+                t = sampler._next_poll
+            if wakeup is None or t < wakeup:
+                wakeup = t
+
+        if wakeup is None:
+            return None
+        return max(0, wakeup - now)
+
+    def _start_poll(self, sampler, now):
+        sampler._next_poll += sampler.period
+        # if we fell behind (slow link) do not try to catch up
+        if sampler._next_poll < now:
+            sampler._next_poll = now + sampler.period
+
+        encoders = sampler.encoders
+        try:
+            # skipped while the driver is busy with another transaction
+            # or its link is down
+            if not encoders.start_poll():
+                return
+        except Exception:
+            logging.error(f'{self.name}: error polling encoders', exc_info=True)
+            return
+
+        try:
+            fd = encoders.fileno()
+            self._selector.register(fd, selectors.EVENT_READ, sampler)
+        except Exception:
+            logging.error(f'{self.name}: cannot wait on {encoders.name()} '
+                          'encoders transport - removing', exc_info=True)
+            encoders.finish_poll(None)
+            sampler._removing = True
+            return
+
+        sampler._fd = fd
+        sampler._deadline = now + self.response_timeout
+
+    def _receive(self, sampler):
+        try:
+            pos = sampler.encoders.poll_response()
+        except (FramingError, OSError) as e:
+            self._finish(sampler, None, e)
+            return
+
+        if pos is not None:
+            self._finish(sampler, pos)
+
+    def _finish(self, sampler, pos, error=None):
+        try:
+            self._selector.unregister(sampler._fd)
+        except (KeyError, ValueError, OSError):
+            logging.debug(f'{self.name}: fd {sampler._fd} already gone',
+                          exc_info=True)
+        sampler._fd = None
+        sampler.encoders.finish_poll(pos, error)
+
+        if pos is not None:
+            sampler._latest = EncoderSample(pos[0], pos[1], time.time())
+            sampler.samples += 1
+
+
+_shared_loop = None
+_shared_loop_lock = threading.Lock()
+
+
+def shared_io_loop():
+    """
+    Returns the EncoderIOLoop shared by all drivers in this process
+    starting it on first use.
+
+    :rtype: EncoderIOLoop
+    """
+
+    global _shared_loop
+
+    with _shared_loop_lock:
+        if _shared_loop is None or not _shared_loop.running:
+            _shared_loop = EncoderIOLoop()
+            _shared_loop.start()
+        return _shared_loop
@@ -0,0 +1,191 @@
+#
+# Pool keeping encoder connections open across Alpaca connect/disconnect
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import logging
+import threading
+
+
+class _Idle:
+    """ Connected driver waiting in the pool. """
+
+    def __init__(self, encoders, timer):
+        self.encoders = encoders
+        self.timer = timer
+
+
+class EncoderPool:
+    """
+    Keep encoders drivers connected after they are released so a client
+    which toggles Connected reuses the open link instead of reopening the
+    port and resending the resolution.
+
+    Drivers are pooled by (driver, port, speed, resolution) so any change
+    to these in the profile opens a new connection.  An idle driver is
+    disconnected after idle_timeout seconds or as soon as a driver with a
+    different key is acquired for the same port.
+    """
+
+    def __init__(self, idle_timeout=300.0):
+        """
+        :param idle_timeout: Seconds a released driver is kept connected,
+                             defaults to 300.0
+        :type idle_timeout: float, optional
+
+        """
+
+        self.idle_timeout = idle_timeout
+
+        #: number of acquires which reused a connected driver
+        self.reuses = 0
+
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._in_use = {}
+
+    def acquire(self, encoder_class, port, speed, res_alt, res_az,
+                reverse_alt=False, reverse_az=False):
+        """
+        Returns a connected encoders driver reusing an idle one if possible.
+
+        :param encoder_class: Encoders driver class
+        :type encoder_class: type
+        :param port: Serial port or transport URL
+        :type port: str
+        :param speed: Serial port speed
+        :type speed: int
+        :param res_alt: Altitude encoder resolution
+        :type res_alt: int
+        :param res_az: Azimuth encoder resolution
+        :type res_az: int
+        :param reverse_alt: Reverse altitude axis, defaults to False
+        :type reverse_alt: bool, optional
+        :param reverse_az: Reverse azimuth axis, defaults to False
+        :type reverse_az: bool, optional
+        :returns:
+            (EncodersBase) Connected driver or None if connecting failed
+        """
+
+        key = (encoder_class, port, speed, res_alt, res_az)
+
+        with self._lock:
+            idle = self._idle.pop(key, None)
+            # a driver for the same port with other settings holds the port
+            stale = [k for k in self._idle if k[1] == port]
+            stale = [self._idle.pop(k) for k in stale]
+
+        for entry in stale:
+            self._close(entry)
+
+        if idle is not None:
+            idle.timer.cancel()
+            if getattr(idle.encoders, 'link_up', True):
+                encoders = idle.encoders
+                encoders.reverse_alt = reverse_alt
+                encoders.reverse_az = reverse_az
+                with self._lock:
+                    self._in_use[id(encoders)] = key
+                    self.reuses += 1
+                logging.info(f'Reusing connection to encoders on {port}')
+                return encoders
+            self._close(idle)
+
+        encoders = encoder_class(res_alt=res_alt, res_az=res_az,
+                                 reverse_alt=reverse_alt,
+                                 reverse_az=reverse_az)
+        if not encoders.connect(port, speed=speed):
+            return None
+
+        with self._lock:
+            self._in_use[id(encoders)] = key
+        return encoders
+
+    def release(self, encoders):
+        """
+        Return a driver to the pool keeping it connected.
+
+        :param encoders: Driver returned by acquire()
+        :type encoders: EncodersBase
+        """
+
+        with self._lock:
+            key = self._in_use.pop(id(encoders), None)
+
+        if key is None:
+            logging.warning('EncoderPool: releasing driver not in pool')
+            encoders.disconnect()
+            return
+
+        timer = threading.Timer(self.idle_timeout, self._expire,
+                                args=(key, encoders))
+        timer.daemon = True
+        with self._lock:
+            old = self._idle.pop(key, None)
+            self._idle[key] = _Idle(encoders, timer)
+        timer.start()
+
+        if old is not None:
+            self._close(old)
+
+    def close(self):
+        """ Disconnect all idle drivers. """
+
+        with self._lock:
+            idle = list(self._idle.values())
+            self._idle.clear()
+
+        for entry in idle:
+            self._close(entry)
+
+    def _expire(self, key, encoders):
+        with self._lock:
+            entry = self._idle.get(key)
+            if entry is None or entry.encoders is not encoders:
+                return
+            del self._idle[key]
+
+        logging.info(f'Closing idle connection to encoders on {key[1]}')
+        self._close(entry)
+
+    def _close(self, entry):
+        entry.timer.cancel()
+        try:
+            entry.encoders.disconnect()
+        except Exception:
+            logging.error('EncoderPool: error disconnecting encoders',
+                          exc_info=True)
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def shared_encoder_pool():
+    """
+    Returns the EncoderPool shared by all devices in this process.
+
+    :rtype: EncoderPool
+    """
+
+    global _shared_pool
+
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = EncoderPool()
+        return _shared_pool
@@ -0,0 +1,140 @@
+#
+# Background sampler which owns the encoders and publishes the latest position
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import time
+import logging
+import threading
+from collections import namedtuple
+
+from .baseencoders import EncoderLinkDown
+
+
+# immutable encoder reading - timestamp is from time.time()
+EncoderSample = namedtuple('EncoderSample', ['alt', 'az', 'timestamp'])
+
+
+class EncoderSampler:
+    """
+    Poll encoders from a background thread at a fixed rate.
+
+    The most recent reading is published as an immutable EncoderSample
+    so request handlers can read it without touching the encoders.
+    Replacing the reference to the sample is atomic so no lock is
+    needed by readers.
+    """
+
+    def __init__(self, encoders, rate=10.0):
+        """
+        :param encoders: Connected encoders driver object.
+        :type encoders: EncodersBase
+        :param rate: Sampling rate in Hz, defaults to 10.0
+        :type rate: float, optional
+
+        """
+
+        if rate <= 0:
+            raise ValueError('EncoderSampler: rate must be positive!')
+
+        self.encoders = encoders
+        self.period = 1.0 / rate
+        self._latest = None
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    @property
+    def latest(self):
+        """
+        Most recent encoder sample or None if no sample available.
+
+        :rtype: EncoderSample
+        """
+        return self._latest
+
+    @property
+    def running(self):
+        """ True if sampler thread is running. """
+        return self._thread is not None and self._thread.is_alive()
+
+    def sample(self):
+        """
+        Read encoders once and publish the result.
+
+        :returns: New sample or None if read failed.
+        :rtype: EncoderSample
+        """
+
+        try:
+            timed = self.encoders.get_timed_encoder_position()
+        except EncoderLinkDown:
+            # driver is reconnecting and has already logged the failure
+            timed = None
+        except Exception:
+            logging.error('EncoderSampler: error reading encoders', exc_info=True)
+            timed = None
+
+        if timed is None:
+            return None
+
+        # time the request was sent as a pipelined response is older
+        (alt, az), timestamp = timed
+        sample = EncoderSample(alt, az, timestamp)
+        self._latest = sample
+        return sample
+
+    def start(self):
+        """
+        Start sampling.  One sample is taken before returning so
+        the latest sample is available as soon as this returns.
+        """
+
+        if self.running:
+            logging.warning('EncoderSampler: already running!')
+            return
+
+        self.sample()
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='EncoderSampler',
+                                        daemon=True)
+        self._thread.start()
+        logging.info(f'EncoderSampler: started with period {self.period:.3f} s')
+
+    def stop(self):
+        """ Stop sampling and wait for thread to exit. """
+
+        if self._thread is None:
+            return
+
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        logging.info('EncoderSampler: stopped')
+
+    def _run(self):
+        next_time = time.monotonic() + self.period
+        while not self._stop_event.wait(max(0, next_time - time.monotonic())):
+            self.sample()
+
+            next_time += self.period
+            # if we fell behind (slow link) do not try to catch up
+            now = time.monotonic()
+            if next_time < now:
+                next_time = now + self.period
@@ -20,7 +20,7 @@
 
 import logging
 
-from .baseencoders import EncodersBase
+from .baseencoders import EncodersBase, PRIORITY_POLL
 
 
 class EncodersAltAzSimulator(EncodersBase):
@@ -78,10 +78,24 @@ class EncodersAltAzSimulator(EncodersBase):
                       f'az_steps={self.res_az}')
         return self.res_alt, self.res_az
 
-    def get_encoder_position(self):
+    def get_cached_resolution(self):
+        """
+        Returns the encoders resolution last set without communicating
+        with the hardware.
+
+        :returns:
+            (tuple) The resolution of the altitude and azimuth encoders.
+        """
+        return self.res_alt, self.res_az
+
+    def get_encoder_position(self, priority=PRIORITY_POLL, timeout=None):
         """
         Read the encoders resolution from the digital setting circles hardware.
 
+        :param priority: Ignored by simulator, defaults to PRIORITY_POLL
+        :type priority: int, optional
+        :param timeout: Ignored by simulator, defaults to None
+        :type timeout: float, optional
         :returns:
             (ttuple)  The position of the altitude and azimuth encoders.
 
@@ -0,0 +1,168 @@
+#
+# Offline handling of the IERS Earth orientation tables used by astropy
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import time
+import shutil
+import logging
+import threading
+
+from .profiles import get_base_config_dir
+from .alpaca_models import PROFILE_BASENAME
+
+# name of locally cached IERS-A table stored with the profiles
+IERS_CACHE_FILENAME = 'finals2000A.all'
+
+# warn if the predictions in the table are older than this many days
+IERS_MAX_AGE_WARN = 30
+
+# MJD of the unix epoch
+UNIX_EPOCH_MJD = 40587.0
+
+# table in use after configure_iers() has been called
+_iers_table = None
+_iers_lock = threading.Lock()
+
+
+def get_iers_cache_file():
+    """
+    Returns location of the locally cached IERS-A table.
+
+    :returns:
+        (Path) Path of cached table file
+    """
+    return get_base_config_dir() / PROFILE_BASENAME / IERS_CACHE_FILENAME
+
+
+def _table_age(table):
+    """ Days since the predictions in the IERS table start. """
+    now_mjd = UNIX_EPOCH_MJD + time.time()/86400.0
+    return float(now_mjd - table.meta['predictive_mjd'])
+
+
+def configure_iers():
+    """
+    Configure astropy so Earth orientation data never requires the network.
+
+    Automatic downloads are disabled and the newest of the locally cached
+    table (see update_iers_cache()) and the table bundled with astropy is
+    loaded up front so no request waits on reading or fetching a table.
+    Using predictions from an old table is allowed with a warning logged
+    here instead of astropy raising an error during a request.
+
+    :returns:
+        (IERS_Auto) Table in use
+    """
+
+    global _iers_table
+
+    from astropy.utils import iers
+
+    iers.conf.auto_download = False
+    iers.conf.auto_max_age = None
+    # option only exists in astropy 4.3 and later
+    if hasattr(iers.conf, 'iers_degraded_accuracy'):
+        iers.conf.iers_degraded_accuracy = 'warn'
+
+    table = iers.IERS_Auto.read()
+    logging.debug(f'Bundled IERS table {table.meta["data_path"]}')
+
+    cache_file = get_iers_cache_file()
+    if cache_file.exists():
+        try:
+            cached_table = iers.IERS_Auto.read(str(cache_file))
+        except Exception:
+            logging.error(f'Unable to read cached IERS table {cache_file}',
+                          exc_info=True)
+        else:
+            if cached_table.meta['predictive_mjd'] >= table.meta['predictive_mjd']:
+                table = cached_table
+
+    iers.earth_orientation_table.set(table)
+    _iers_table = table
+
+    age = _table_age(table)
+    logging.info(f'Using IERS table {table.meta["data_path"]} '
+                 f'which is {age:.1f} days old.')
+    if age > IERS_MAX_AGE_WARN:
+        logging.warning(f'IERS table is {age:.1f} days old - run '
+                        'alpacadsc --update-iers when a network is available.')
+
+    return table
+
+
+def ensure_iers_configured():
+    """
+    Call configure_iers() unless it has already been called.
+
+    Used by the transform engines which need Earth orientation data so
+    astropy is only loaded when one of them is selected.
+
+    :returns:
+        (IERS_Auto) Table in use
+    """
+
+    with _iers_lock:
+        if _iers_table is None:
+            configure_iers()
+        return _iers_table
+
+
+def iers_table_age():
+    """
+    Returns age in days of the IERS table in use.
+
+    :returns:
+        (float) Age in days or None if configure_iers() has not been called
+    """
+
+    if _iers_table is None:
+        return None
+
+    return _table_age(_iers_table)
+
+
+def update_iers_cache():
+    """
+    Download current IERS-A table and store it in the local cache.
+
+    Intended to be run ahead of time while a network is available.
+
+    :returns:
+        (Path) Path of cached table file
+    """
+
+    from astropy.utils import iers
+    from astropy.utils.data import download_file
+
+    urls = (iers.conf.iers_auto_url, iers.conf.iers_auto_url_mirror)
+    logging.info(f'Downloading IERS table from {urls[0]}')
+    filename = download_file(urls[0], sources=urls, cache=False)
+
+    # make sure it is usable before replacing any existing cache
+    table = iers.IERS_Auto.read(filename)
+
+    cache_file = get_iers_cache_file()
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(filename, cache_file)
+
+    logging.info(f'Stored IERS table in {cache_file} which is '
+                 f'{_table_age(table):.1f} days old.')
+
+    return cache_file
@@ -0,0 +1,361 @@
+#
+# LX200 protocol TCP server for planetarium programs like SkySafari
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import re
+import asyncio
+import logging
+import threading
+
+# reply to ACK byte - telescope is in alt/az mode
+LX200_ACK = b'\x06'
+LX200_ALIGNMENT_ALTAZ = b'A'
+
+LX200_SYNC_REPLY = b'Coordinates     matched.        #'
+LX200_SYNC_FAILED_REPLY = b'Sync failed#'
+
+# longest incomplete command kept waiting for its terminating #
+LX200_MAX_COMMAND = 64
+
+# HH:MM:SS or HH:MM.T
+RA_PATTERN = re.compile(r'\s*(\d{1,2}):(\d{1,2})(?::(\d{1,2}(?:\.\d*)?)|\.(\d))?\s*$')
+
+# sDD*MM:SS or sDD*MM with * or the degree sign sent by some programs
+DEC_PATTERN = re.compile(r'\s*([+-]?)(\d{1,2})[*:\xdf\xb0](\d{1,2})'
+                         r'(?:[:\'](\d{1,2}(?:\.\d*)?))?\s*$')
+
+
+def format_ra(hours, high_precision=True):
+    """
+    Format RA as LX200 reply.
+
+    :param hours: RA in hours or None
+    :type hours: float
+    :param high_precision: HH:MM:SS if True else HH:MM.T,
+                           defaults to True
+    :type high_precision: bool, optional
+    :returns:
+        (str) RA terminated by #
+    """
+
+    hours = hours or 0.0
+    if high_precision:
+        total = round(hours*3600) % (24*3600)
+        return f'{total // 3600:02d}:{total // 60 % 60:02d}:{total % 60:02d}#'
+
+    total = round(hours*600) % (24*600)
+    return f'{total // 600:02d}:{total // 10 % 60:02d}.{total % 10}#'
+
+
+def format_degrees(degrees, high_precision=True, signed=True):
+    """
+    Format declination, altitude or azimuth as LX200 reply.
+
+    :param degrees: Angle in degrees or None
+    :type degrees: float
+    :param high_precision: sDD*MM'SS if True else sDD*MM, defaults to True
+    :type high_precision: bool, optional
+    :param signed: Angle from -90 to 90 with sign else azimuth from 0 to
+                   360 as DDD, defaults to True
+    :type signed: bool, optional
+    :returns:
+        (str) Angle terminated by #
+    """
+
+    degrees = degrees or 0.0
+    if signed:
+        sign = '-' if degrees < 0 else '+'
+        degrees = min(abs(degrees), 90.0)
+        width = 2
+    else:
+        sign = ''
+        degrees = degrees % 360
+        width = 3
+
+    if high_precision:
+        total = round(degrees*3600)
+        if not signed:
+            total %= 360*3600
+        return (f"{sign}{total // 3600:0{width}d}*"
+                f"{total // 60 % 60:02d}'{total % 60:02d}#")
+
+    total = round(degrees*60)
+    if not signed:
+        total %= 360*60
+    return f'{sign}{total // 60:0{width}d}*{total % 60:02d}#'
+
+
+def parse_ra(text):
+    """
+    Parse RA argument of :Sr command.
+
+    :param text: RA as HH:MM:SS or HH:MM.T
+    :type text: str
+    :returns:
+        (float) RA in hours or None if invalid
+    """
+
+    m = RA_PATTERN.match(text)
+    if m is None:
+        return None
+
+    hours, minutes, seconds, tenths = m.groups()
+    minutes = int(minutes)
+    if seconds is not None:
+        minutes += float(seconds)/60
+    elif tenths is not None:
+        minutes += int(tenths)/10
+
+    ra = int(hours) + minutes/60
+    if minutes >= 60 or ra >= 24:
+        return None
+    return ra
+
+
+def parse_dec(text):
+    """
+    Parse declination argument of :Sd command.
+
+    :param text: Declination as sDD*MM:SS or sDD*MM
+    :type text: str
+    :returns:
+        (float) Declination in degrees or None if invalid
+    """
+
+    m = DEC_PATTERN.match(text)
+    if m is None:
+        return None
+
+    sign, degrees, minutes, seconds = m.groups()
+    minutes = int(minutes)
+    if seconds is not None:
+        minutes += float(seconds)/60
+
+    dec = int(degrees) + minutes/60
+    if minutes >= 60 or dec > 90:
+        return None
+    return -dec if sign == '-' else dec
+
+
+class LX200Server:
+    """
+    Serve the telescope position to LX200 protocol clients over TCP.
+
+    Position queries are answered from the state sampled by the shared
+    PointingBroadcaster so any number of clients polling several times a
+    second cause no encoder reads beyond its sampling.  All clients are
+    served by one asyncio event loop.  A sync (:Sr, :Sd then :CM) calls
+    sync_to_coordinates() of the telescope model in a thread.
+    """
+
+    #: seconds to wait for first sampled state
+    STATE_WAIT = 1.0
+
+    def __init__(self, driver, broadcaster, host='127.0.0.1', port=4030):
+        """
+        :param driver: Telescope model
+        :type driver: AlpacaAltAzTelescopeModel
+        :param broadcaster: Sampler of telescope state
+        :type broadcaster: PointingBroadcaster
+        :param host: Address to listen on, defaults to '127.0.0.1'
+        :type host: str, optional
+        :param port: Port to listen on, defaults to 4030
+        :type port: int, optional
+
+        """
+
+        self.driver = driver
+        self.broadcaster = broadcaster
+        self.host = host
+        self.port = port
+
+        #: number of open client connections
+        self.connections = 0
+
+        self._server = None
+        self._loop = None
+        self._thread = None
+
+    async def start(self):
+        """ Start listening.  The port is updated if 0 was requested. """
+
+        self._server = await asyncio.start_server(self._serve_connection,
+                                                  self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info(f'LX200Server: serving on {self.host}:{self.port}')
+
+    async def close(self):
+        """ Stop listening. """
+
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def start_thread(self):
+        """
+        Serve from an event loop in a background thread so it can run
+        beside any HTTP server.  Returns once listening.
+        """
+
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self.start())
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        name='LX200Server', daemon=True)
+        self._thread.start()
+
+    def stop_thread(self):
+        """ Stop server started with start_thread(). """
+
+        if self._thread is None:
+            return
+
+        asyncio.run_coroutine_threadsafe(self.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._thread = None
+
+    async def _serve_connection(self, reader, writer):
+        self.connections += 1
+        peer = writer.get_extra_info('peername')
+        logging.debug(f'LX200Server: client {peer} connected')
+
+        session = {'high_precision': True, 'ra': None, 'dec': None}
+        buf = b''
+        try:
+            while True:
+                data = await reader.read(256)
+                if not data:
+                    break
+
+                buf += data
+                buf = await self._process(buf, session, writer)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+            logging.debug(f'LX200Server: client {peer} disconnected')
+
+    async def _process(self, buf, session, writer):
+        """
+        Handle complete commands in buf.
+
+        :returns:
+            (bytes) Incomplete command remaining
+        """
+
+        while buf:
+            if buf[:1] == LX200_ACK:
+                writer.write(LX200_ALIGNMENT_ALTAZ)
+                buf = buf[1:]
+                continue
+
+            start = buf.find(b':')
+            if start < 0:
+                # stray '#' or noise between commands
+                return b''
+
+            end = buf.find(b'#', start)
+            if end < 0:
+                if len(buf) - start > LX200_MAX_COMMAND:
+                    logging.debug('LX200Server: discarding unterminated command')
+                    return b''
+                return buf[start:]
+
+            command = buf[start+1:end].decode('latin-1')
+            buf = buf[end+1:]
+
+            reply = await self._command(command, session)
+            if reply is not None:
+                writer.write(reply)
+
+        return buf
+
+    async def _command(self, command, session):
+        """
+        Handle one command without the leading : and trailing #.
+
+        :returns:
+            (bytes) Reply or None if command has no reply
+        """
+
+        if command in ('GR', 'GD', 'GA', 'GZ'):
+            state = await self._latest_state()
+            high = session['high_precision']
+            if command == 'GR':
+                reply = format_ra(state.get('RightAscension'), high)
+            elif command == 'GD':
+                reply = format_degrees(state.get('Declination'), high)
+            elif command == 'GA':
+                reply = format_degrees(state.get('Altitude'), high)
+            else:
+                reply = format_degrees(state.get('Azimuth'), high, signed=False)
+            return reply.encode()
+
+        if command == 'U':
+            session['high_precision'] = not session['high_precision']
+            return None
+
+        if command.startswith('Sr'):
+            session['ra'] = parse_ra(command[2:])
+            return b'1' if session['ra'] is not None else b'0'
+
+        if command.startswith('Sd'):
+            session['dec'] = parse_dec(command[2:])
+            return b'1' if session['dec'] is not None else b'0'
+
+        if command == 'CM':
+            return await self._sync(session)
+
+        if command == 'GVP':
+            return b'AlpacaDSC#'
+
+        logging.debug(f'LX200Server: ignoring command {command}')
+        return None
+
+    async def _latest_state(self):
+        """ Returns latest sampled state waiting briefly for the first. """
+
+        state = self.broadcaster.latest()
+        waited = 0.0
+        while state is None and waited < self.STATE_WAIT:
+            await asyncio.sleep(self.broadcaster.period)
+            waited += self.broadcaster.period
+            state = self.broadcaster.latest()
+
+        return state or {}
+
+    async def _sync(self, session):
+        ra, dec = session['ra'], session['dec']
+        if ra is None or dec is None or not self.driver.connected:
+            logging.warning(f'LX200Server: cannot sync to ra={ra} dec={dec}')
+            return LX200_SYNC_FAILED_REPLY
+
+        loop = asyncio.get_running_loop()
+        try:
+            rc = await loop.run_in_executor(None, self.driver.sync_to_coordinates,
+                                            ra, dec)
+        except Exception:
+            logging.error('LX200Server: sync failed', exc_info=True)
+            rc = False
+
+        return LX200_SYNC_REPLY if rc else LX200_SYNC_FAILED_REPLY
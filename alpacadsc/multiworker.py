@@ -0,0 +1,371 @@
+#
+# Multi-process serving - HTTP worker processes answer pointing requests
+# from shared memory and pass everything else to the process owning the
+# encoders
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import time
+import socket
+import logging
+import threading
+import http.client
+import multiprocessing
+
+from werkzeug.serving import make_server
+from werkzeug.wrappers import Request, Response
+
+from .shared_pointing import SharedPointing, StatePublisher
+from .pointing_stream import PointingStream
+
+ALPACA_TELESCOPE_PREFIX = '/api/v1/telescope/0/'
+
+# headers which only apply to one connection and are not forwarded
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-authenticate',
+                      'proxy-authorization', 'te', 'trailers',
+                      'transfer-encoding', 'upgrade'}
+
+
+class WorkerApp:
+    """
+    WSGI application run by each HTTP worker process.
+
+    GET requests for static properties, the pointing properties, the
+    state endpoint and the state stream are answered from the shared
+    memory state without touching the encoders or computing transforms.
+    All other requests and any the shared state cannot answer (the device
+    is not connected or the state is stale) are passed to the owner
+    process over a keep-alive HTTP connection so behaviour is the same as
+    the single process server.
+    """
+
+    #: pointing properties answered from shared state and their state keys
+    POINTING_KEYS = {'altitude': 'Altitude',
+                     'azimuth': 'Azimuth',
+                     'rightascension': 'RightAscension',
+                     'declination': 'Declination',
+                     'siderealtime': 'SiderealTime'}
+
+    def __init__(self, shared, owner_address, static_responses,
+                 max_state_age=1.0):
+        """
+        :param shared: Shared state published by owner
+        :type shared: SharedPointing
+        :param owner_address: (host, port) of owner HTTP server
+        :type owner_address: tuple
+        :param static_responses: Pre-serialized responses by action from
+                                 AlpacaActionRegistry.static_responses
+        :type static_responses: dict
+        :param max_state_age: Seconds after which shared state is stale,
+                              defaults to 1.0
+        :type max_state_age: float, optional
+
+        """
+
+        self.shared = shared
+        self.owner_address = owner_address
+        self.static_responses = static_responses
+        self.max_state_age = max_state_age
+        self._local = threading.local()
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+
+        response = None
+        if request.method == 'GET' and request.path.startswith(ALPACA_TELESCOPE_PREFIX):
+            action = request.path[len(ALPACA_TELESCOPE_PREFIX):]
+            if action == 'stream':
+                response = self.stream_response(request.args.get('rate'))
+            else:
+                response = self.local_response(action)
+
+        if response is None:
+            response = self.proxy(request)
+
+        return response(environ, start_response)
+
+    def local_response(self, action):
+        """
+        Answer GET request for action without the owner if possible.
+
+        :param action: Alpaca action
+        :type action: str
+        :returns:
+            (Response) Response or None if owner must answer
+        """
+
+        body = self.static_responses.get(action)
+        if body is not None:
+            return Response(body, mimetype='application/json')
+
+        if (action not in ('state', 'connected') and
+                action not in self.POINTING_KEYS):
+            return None
+
+        published, state = self.shared.read()
+        if published is None or time.time() - published > self.max_state_age:
+            return None
+
+        if action == 'state':
+            value = state
+        elif action == 'connected':
+            value = state['Connected']
+        elif not state['Connected']:
+            return None
+        else:
+            value = state[self.POINTING_KEYS[action]]
+            if value is None:
+                if action == 'siderealtime':
+                    return None
+                # same as owner when not synchronized
+                value = 0
+
+        return Response(json.dumps({'ErrorNumber': 0, 'ErrorString': '',
+                                    'Value': value}),
+                        mimetype='application/json')
+
+    def stream_response(self, rate):
+        """
+        Stream state from shared memory as Server-Sent Events.
+
+        :param rate: Rate from query or None
+        :type rate: str
+        :returns:
+            (Response) Streaming response
+        """
+
+        def source():
+            published, state = self.shared.read()
+            if published is None or time.time() - published > self.max_state_age:
+                return None
+            return state
+
+        try:
+            stream = PointingStream(source, rate)
+        except ValueError as e:
+            return Response(str(e), status=400, mimetype='text/plain')
+
+        return Response(iter(stream), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache'})
+
+    def proxy(self, request):
+        """
+        Pass request to owner process.
+
+        :param request: Request
+        :type request: werkzeug.wrappers.Request
+        :returns:
+            (Response) Response from owner
+        """
+
+        path = request.path
+        if request.query_string:
+            path += '?' + request.query_string.decode('latin-1')
+
+        body = request.get_data()
+        headers = {k: v for k, v in request.headers.items()
+                   if k.lower() not in HOP_BY_HOP_HEADERS}
+
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(request.method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+                data = resp.read()
+                break
+            except (OSError, http.client.HTTPException):
+                # owner closed the keep-alive connection - retry on a new one
+                conn.close()
+                self._local.conn = None
+                if attempt > 0:
+                    logging.error('WorkerApp: owner not responding', exc_info=True)
+                    return Response('Owner process not responding', status=502)
+
+        headers = [(k, v) for k, v in resp.getheaders()
+                   if k.lower() not in HOP_BY_HOP_HEADERS and
+                   k.lower() != 'content-length']
+        return Response(data, status=resp.status, headers=headers)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = http.client.HTTPConnection(*self.owner_address)
+            self._local.conn = conn
+        return conn
+
+
+class PublishAfterWrite:
+    """
+    WSGI middleware for the owner app publishing the telescope state after
+    each request which may change it (anything but GET and HEAD) and before
+    its response is returned.  A client which has seen the reply to a PUT
+    such as connected or synctocoordinates therefore never reads older
+    state from a worker.
+    """
+
+    def __init__(self, app, publisher):
+        """
+        :param app: Owner WSGI app
+        :type app: Flask
+        :param publisher: Publisher of the shared state
+        :type publisher: StatePublisher
+
+        """
+
+        self.app = app
+        self.publisher = publisher
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] in ('GET', 'HEAD'):
+            return self.app(environ, start_response)
+
+        # headers are only sent once the server iterates the body
+        result = self.app(environ, start_response)
+        try:
+            body = list(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+        self.publisher.publish()
+        return body
+
+
+def worker_main(listener, shared_name, owner_address, static_responses):
+    """
+    Entry point of HTTP worker process.
+
+    :param listener: Listening socket shared by all workers
+    :type listener: socket.socket
+    :param shared_name: Name of SharedPointing block
+    :type shared_name: str
+    :param owner_address: (host, port) of owner HTTP server
+    :type owner_address: tuple
+    :param static_responses: Pre-serialized static responses by action
+    :type static_responses: dict
+    """
+
+    shared = SharedPointing(shared_name)
+    app = WorkerApp(shared, owner_address, static_responses)
+
+    host, port = listener.getsockname()[:2]
+    server = make_server(host, port, app, threaded=True, fd=listener.fileno())
+    try:
+        server.serve_forever()
+    finally:
+        shared.close()
+
+
+class MultiWorkerServer:
+    """
+    Serve the Alpaca service from several HTTP worker processes.
+
+    The calling process owns the telescope model and the encoders.  It
+    serves the full Flask app on a loopback port for the workers and
+    publishes the telescope state to shared memory.  Worker processes
+    accept connections on the public port so pointing requests are served
+    in parallel without being limited by the owner's GIL.
+    """
+
+    def __init__(self, app, host='127.0.0.1', port=8000, workers=2,
+                 publish_rate=20.0):
+        """
+        :param app: App from create_app()
+        :type app: Flask
+        :param host: Address to listen on, defaults to '127.0.0.1'
+        :type host: str, optional
+        :param port: Port to listen on, defaults to 8000
+        :type port: int, optional
+        :param workers: Number of worker processes, defaults to 2
+        :type workers: int, optional
+        :param publish_rate: Shared state updates per second,
+                             defaults to 20.0
+        :type publish_rate: float, optional
+
+        """
+
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.publish_rate = publish_rate
+
+        self.shared = None
+        self.listener = None
+        self._owner_server = None
+        self._publisher = None
+        self._processes = []
+
+    def start(self):
+        """ Start worker processes and publishing. """
+
+        driver = self.app.extensions['alpacadsc']['driver']
+        registry = self.app.extensions['alpacadsc']['registry']
+
+        self.shared = SharedPointing()
+        self._publisher = StatePublisher(driver, self.shared, self.publish_rate)
+        self._owner_server = make_server('127.0.0.1', 0,
+                                         PublishAfterWrite(self.app, self._publisher),
+                                         threaded=True)
+        owner_address = ('127.0.0.1', self._owner_server.server_port)
+
+        family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+        self.listener = socket.socket(family, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((self.host, self.port))
+        self.listener.listen(128)
+        self.port = self.listener.getsockname()[1]
+
+        # spawn so workers do not inherit the owner's threads
+        ctx = multiprocessing.get_context('spawn')
+        for i in range(self.workers):
+            p = ctx.Process(target=worker_main, name=f'AlpacaWorker-{i}',
+                            args=(self.listener, self.shared.name,
+                                  owner_address,
+                                  dict(registry.static_responses)),
+                            daemon=True)
+            p.start()
+            self._processes.append(p)
+
+        self._publisher.start()
+
+        logging.info(f'Serving on {self.host}:{self.port} with '
+                     f'{self.workers} worker processes')
+
+    def serve_forever(self):
+        """ Serve requests passed by workers until shutdown() is called. """
+        try:
+            self._owner_server.serve_forever()
+        finally:
+            self._cleanup()
+
+    def shutdown(self):
+        """ Stop serve_forever() from another thread. """
+        self._owner_server.shutdown()
+
+    def _cleanup(self):
+        self._publisher.stop()
+        for p in self._processes:
+            p.terminate()
+        for p in self._processes:
+            p.join()
+        self._processes = []
+        self.listener.close()
+        self._owner_server.server_close()
+        self.shared.close()
@@ -0,0 +1,186 @@
+#
+# Server-Sent Events stream of the telescope state
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import time
+import logging
+import threading
+
+# events per second sent if the client does not choose a rate
+STREAM_DEFAULT_RATE = 2.0
+
+# highest rate a client may choose - also the rate the state is sampled
+STREAM_MAX_RATE = 10.0
+
+# seconds after which the state is sent even if the position is unchanged
+STREAM_HEARTBEAT = 15.0
+
+# state keys which change when the telescope moves or its status changes
+STREAM_CHANGE_KEYS = ('Connected', 'Synchronized',
+                      'EncoderAltitude', 'EncoderAzimuth')
+
+
+class PointingBroadcaster:
+    """
+    Sample the telescope state for all stream clients.
+
+    One thread samples the state at STREAM_MAX_RATE while any client is
+    streaming, so the encoders are read at the same rate whether one or
+    fifty clients are connected.  The thread exits when no client has
+    asked for the state for idle_timeout seconds.
+    """
+
+    def __init__(self, get_state, rate=STREAM_MAX_RATE, idle_timeout=5.0):
+        """
+        :param get_state: Returns telescope state like
+                          get_telescope_state()
+        :type get_state: callable
+        :param rate: Sampling rate in Hz, defaults to STREAM_MAX_RATE
+        :type rate: float, optional
+        :param idle_timeout: Seconds without clients before sampling
+                             stops, defaults to 5.0
+        :type idle_timeout: float, optional
+
+        """
+
+        self.get_state = get_state
+        self.period = 1.0 / rate
+        self.idle_timeout = idle_timeout
+
+        #: number of times state was sampled
+        self.samples = 0
+
+        self._state = None
+        self._last_access = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        """ True if the state is being sampled. """
+        return self._thread is not None
+
+    def latest(self):
+        """
+        Returns the most recently sampled state starting sampling if needed.
+
+        :returns:
+            (dict) Telescope state or None if not sampled yet
+        """
+
+        with self._lock:
+            self._last_access = time.monotonic()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='PointingBroadcaster',
+                                                daemon=True)
+                self._thread.start()
+        return self._state
+
+    def _run(self):
+        logging.debug('PointingBroadcaster: started')
+        while True:
+            try:
+                self._state = self.get_state()
+                self.samples += 1
+            except Exception:
+                logging.error('PointingBroadcaster: unable to get state',
+                              exc_info=True)
+
+            time.sleep(self.period)
+
+            with self._lock:
+                if time.monotonic() - self._last_access > self.idle_timeout:
+                    self._thread = None
+                    self._state = None
+                    break
+        logging.debug('PointingBroadcaster: stopped - no clients')
+
+
+class PointingStream:
+    """
+    Server-Sent Events for one client.
+
+    The state is checked at the rate the client chose and an event is
+    only sent when the encoder position or connection status changed or
+    STREAM_HEARTBEAT seconds passed since the last event.  The heartbeat
+    keeps the connection alive and refreshes the RA/DEC of a telescope
+    which is not moving.
+    """
+
+    def __init__(self, source, rate=None, heartbeat=STREAM_HEARTBEAT):
+        """
+        :param source: Returns latest state or None if not available
+        :type source: callable
+        :param rate: Events per second requested by client - a string is
+                     accepted as sent in a query, defaults to
+                     STREAM_DEFAULT_RATE.  Limited to STREAM_MAX_RATE.
+        :type rate: float or str, optional
+        :param heartbeat: Seconds after which an unchanged state is sent,
+                          defaults to STREAM_HEARTBEAT
+        :type heartbeat: float, optional
+        :raises ValueError: If rate is not a positive number
+
+        """
+
+        rate = STREAM_DEFAULT_RATE if rate is None else float(rate)
+        if not rate > 0:
+            raise ValueError(f'Stream rate {rate} must be positive')
+
+        self.source = source
+        self.period = 1.0 / min(rate, STREAM_MAX_RATE)
+        self.heartbeat = heartbeat
+
+        #: number of events sent
+        self.events = 0
+
+        self._last_key = None
+        self._last_sent = None
+
+    def next_event(self):
+        """
+        Returns the event to send now.
+
+        :returns:
+            (str) Event or None if nothing needs to be sent
+        """
+
+        state = self.source()
+        if state is None:
+            return None
+
+        now = time.monotonic()
+        key = tuple(state.get(k) for k in STREAM_CHANGE_KEYS)
+        if key == self._last_key and now - self._last_sent < self.heartbeat:
+            return None
+
+        self._last_key = key
+        self._last_sent = now
+        self.events += 1
+        return f'id: {self.events}\ndata: {json.dumps(state)}\n\n'
+
+    def __iter__(self):
+        """ Blocking generator of events for a WSGI response. """
+
+        while True:
+            event = self.next_event()
+            if event is not None:
+                yield event
+            time.sleep(self.period)
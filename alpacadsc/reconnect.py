@@ -0,0 +1,106 @@
+#
+# Background reconnection with exponential backoff
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import logging
+import threading
+
+
+class ReconnectSupervisor:
+    """
+    Retry reconnecting a lost link from a background thread.
+
+    After trigger() is called the reconnect function is called after
+    min_delay seconds and then with the delay doubling after each failed
+    attempt up to max_delay seconds until it succeeds or stop() is called.
+    """
+
+    def __init__(self, reconnect, name='ReconnectSupervisor',
+                 min_delay=0.5, max_delay=30.0):
+        """
+        :param reconnect: Function called to reconnect returning True
+                          on success
+        :type reconnect: callable
+        :param name: Name for thread and log messages,
+                     defaults to 'ReconnectSupervisor'
+        :type name: str, optional
+        :param min_delay: Seconds before first attempt, defaults to 0.5
+        :type min_delay: float, optional
+        :param max_delay: Maximum seconds between attempts, defaults to 30.0
+        :type max_delay: float, optional
+
+        """
+
+        self.reconnect = reconnect
+        self.name = name
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+
+        #: number of successful reconnects
+        self.reconnects = 0
+
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    @property
+    def running(self):
+        """ True if reconnect attempts are in progress. """
+        return self._thread is not None and self._thread.is_alive()
+
+    def trigger(self):
+        """ Start reconnect attempts unless already in progress. """
+
+        if self.running:
+            return
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name,
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop reconnect attempts and wait for thread to exit. """
+
+        if self._thread is None:
+            return
+
+        self._stop_event.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        delay = self.min_delay
+        attempts = 0
+        while not self._stop_event.wait(delay):
+            attempts += 1
+            try:
+                ok = self.reconnect()
+            except Exception:
+                logging.debug(f'{self.name}: reconnect failed', exc_info=True)
+                ok = False
+
+            if ok:
+                self.reconnects += 1
+                logging.info(f'{self.name}: reconnected after {attempts} attempts')
+                return
+
+            logging.info(f'{self.name}: reconnect attempt {attempts} failed - '
+                         f'retrying in {delay} s')
+            delay = min(delay*2, self.max_delay)
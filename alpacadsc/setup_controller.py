@@ -24,12 +24,14 @@ from pathlib import Path
 
 import serial.tools.list_ports as list_serial_ports
 
-from flask import render_template, make_response, request
+from flask import render_template, make_response, request, jsonify
 from flask_restx import Resource
 
 from .profiles import find_profiles, set_current_profile
 from .profiles import get_current_profile, Profile
 from .alpaca_models import PROFILE_BASENAME
+from .transforms import TRANSFORM_ENGINES
+from .iers_tables import iers_table_age
 
 
 def render_response(template, **kwargs):
@@ -53,7 +55,45 @@ class About(Resource):
           (str) Rendered Flask template HTML output.
         """
 
-        return render_response('about.html', driver=self.driver)
+        return render_response('about.html', driver=self.driver,
+                               iers_age=iers_table_age())
+
+
+def encoders_report(driver):
+    """
+    Collect the values shown by the /encoders page.  Positions come from
+    one pointing snapshot, shared with Alpaca requests within the snapshot
+    window, and the resolution is the value last set so at most one
+    encoder read is made.
+
+    :param driver: Telescope model
+    :type driver: AlpacaAltAzTelescopeModel
+    :returns:
+        (dict) Report - only 'Connected' is present if not connected
+    """
+
+    report = {'Connected': driver.connected}
+    if not driver.connected or driver.encoders is None:
+        return report
+
+    report['Resolution'] = driver.encoders.get_cached_resolution()
+
+    snapshot = driver.get_pointing_snapshot()
+    if snapshot is None:
+        timestamp = enc_alt = enc_az = alt = az = ra = dec = age = None
+    else:
+        timestamp, enc_alt, enc_az, alt, az, ra, dec, age = snapshot
+
+    report.update({'Timestamp': timestamp,
+                   'EncoderAltitude': enc_alt,
+                   'EncoderAzimuth': enc_az,
+                   'EncoderAge': age,
+                   'Altitude': alt,
+                   'Azimuth': az,
+                   'RightAscensionDegrees': ra,
+                   'Declination': dec,
+                   'Stats': driver.encoders.get_command_stats()})
+    return report
 
 
 class MonitorEncoders(Resource):
@@ -67,10 +107,18 @@ class MonitorEncoders(Resource):
         """
         Handle reading encoders positions requests (/encoders endpoint).
 
+        With the query argument format=json the values are returned as
+        JSON for the page to update itself.
+
         :returns:
-          (str) Rendered Flask template HTML output.
+          (str) Rendered Flask template HTML output or JSON.
         """
 
+        report = encoders_report(self.driver)
+
+        if request.args.get('format') == 'json':
+            return jsonify(report)
+
         # see if encoders configured?
         if self.driver.encoders is None:
             logging.error('Encoders not configured.'
@@ -79,7 +127,7 @@ class MonitorEncoders(Resource):
             logging.error('Not connected to encoders.'
                           'Unable to read encoder position!')
 
-        return render_response('report_encoders.html', driver=self.driver)
+        return render_response('report_encoders.html', report=report)
 
 
 class GlobalSetup(Resource):
@@ -138,6 +186,7 @@ class DeviceSetup(Resource):
 
         return render_response('device_setup_base.html', driver=self.driver,
                                encoder_plugins=[n for n, m, c in self.driver.encoders_plugins],
+                               transform_engines=list(TRANSFORM_ENGINES),
                                profile=profile,
                                profile_name=profile_name,
                                profile_list=find_profiles(PROFILE_BASENAME),
@@ -202,6 +251,14 @@ class DeviceSetup(Resource):
             resp = self.location_modify_handler(profile)
             if resp is not None:
                 return resp
+        elif form_id == 'sampler_modify_form':
+            resp = self.sampler_modify_handler(profile)
+            if resp is not None:
+                return resp
+        elif form_id == 'pointing_modify_form':
+            resp = self.pointing_modify_handler(profile)
+            if resp is not None:
+                return resp
         else:
             return self.unknown_form_handler()
 
@@ -321,6 +378,7 @@ class DeviceSetup(Resource):
         az_resolution = request.form.get('az_resolution')
         alt_reverse = request.form.get('alt_reverse', 'false').lower() != 'false'
         az_reverse = request.form.get('az_reverse', 'false').lower() != 'false'
+        read_deadline = request.form.get('read_deadline')
 
         # FIXME Better way than special casing the Simulator driver?
         if encoder_driver == 'Simulator':
@@ -333,7 +391,7 @@ class DeviceSetup(Resource):
 
         if None in [encoder_driver, serial_port, serial_speed,
                     alt_resolution, az_resolution, alt_reverse,
-                    az_reverse]:
+                    az_reverse, read_deadline]:
             logging.error('Encoder missing required fields!')
             return render_response('modify_profile.html',
                                    body_html='Encoder missing required fields!')
@@ -353,6 +411,14 @@ class DeviceSetup(Resource):
             error_resp += '<br>Error - alt_resolution, az_resolution and '
             error_resp += 'serial_speed require integer values!'
 
+        try:
+            read_deadline_value = float(read_deadline)
+        except ValueError:
+            error_resp += '<br>Error - read_deadline requires a float value!'
+        else:
+            if read_deadline_value <= 0:
+                error_resp += '<br>Error - read_deadline must be positive!'
+
         if len(error_resp) > 0:
             logging.error(f'{error_resp}')
             return render_response('modify_profile.html', body_html=error_resp)
@@ -364,6 +430,7 @@ class DeviceSetup(Resource):
         profile.encoders.az_resolution = az_resolution_value
         profile.encoders.alt_reverse = alt_reverse
         profile.encoders.az_reverse = az_reverse
+        profile.encoders.read_deadline = read_deadline_value
 
         profile.write()
 
@@ -411,3 +478,91 @@ class DeviceSetup(Resource):
         profile.write()
 
         return None
+
+    def sampler_modify_handler(self, profile):
+        """
+        Handle request to modify profile parameters for encoder sampler.
+
+        :return: Rendered output from handling request.
+        :rtype: str
+        """
+
+        sample_rate = request.form.get('sample_rate')
+        pipeline_depth = request.form.get('pipeline_depth')
+        io_loop = request.form.get('io_loop', 'false').lower() != 'false'
+
+        if None in [sample_rate, pipeline_depth]:
+            logging.error('Sampler missing required fields!')
+            return render_response('modify_profile.html',
+                                   body_html='Sampler missing required fields!')
+
+        error_resp = ''
+
+        try:
+            sample_rate_value = float(sample_rate)
+        except ValueError:
+            error_resp += '<br>Error - sample_rate requires a float value!'
+        else:
+            if sample_rate_value < 0:
+                error_resp += '<br>Error - sample_rate cannot be negative!'
+
+        try:
+            pipeline_depth_value = int(pipeline_depth)
+        except ValueError:
+            error_resp += '<br>Error - pipeline_depth requires an int value!'
+        else:
+            if pipeline_depth_value < 1:
+                error_resp += '<br>Error - pipeline_depth must be at least 1!'
+
+        if len(error_resp) > 0:
+            logging.error(f'{error_resp}')
+            return render_response('modify_profile.html', body_html=error_resp)
+
+        profile.sampler.rate = sample_rate_value
+        profile.sampler.pipeline_depth = pipeline_depth_value
+        profile.sampler.io_loop = io_loop
+
+        profile.write()
+
+        return None
+
+    def pointing_modify_handler(self, profile):
+        """
+        Handle request to modify profile parameters for pointing.
+
+        :return: Rendered output from handling request.
+        :rtype: str
+        """
+
+        snapshot_window = request.form.get('snapshot_window')
+        transform_engine = request.form.get('transform_engine')
+
+        if None in [snapshot_window, transform_engine]:
+            logging.error('Pointing missing required fields!')
+            return render_response('modify_profile.html',
+                                   body_html='Pointing missing required fields!')
+
+        error_resp = ''
+
+        if transform_engine not in TRANSFORM_ENGINES:
+            error_resp += f'<br>Transform engine {transform_engine} is not valid.<br>'
+            error_resp += f'Valid choices are {" ".join(TRANSFORM_ENGINES)}.'
+
+        try:
+            snapshot_window_value = float(snapshot_window)
+        except ValueError:
+            error_resp += '<br>Error - snapshot_window requires a float value!'
+        else:
+            if snapshot_window_value < 0:
+                error_resp += '<br>Error - snapshot_window cannot be negative!'
+
+        if len(error_resp) > 0:
+            logging.error(f'{error_resp}')
+            return render_response('modify_profile.html', body_html=error_resp)
+
+        profile.pointing.snapshot_window = snapshot_window_value
+        profile.pointing.engine = transform_engine
+
+        profile.write()
+
+        return None
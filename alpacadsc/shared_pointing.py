@@ -0,0 +1,198 @@
+#
+# Telescope state published in shared memory for HTTP worker processes
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import math
+import time
+import struct
+import logging
+import threading
+from multiprocessing import shared_memory, resource_tracker
+
+
+class SharedPointing:
+    """
+    Telescope state from get_telescope_state() in a shared memory block
+    written by one process and read by many.
+
+    The block is protected by a sequence lock.  The writer makes the
+    sequence number odd while it writes and even again when done.  A
+    reader retries if the sequence number was odd or changed while it
+    read so it never sees a partly written state and never blocks the
+    writer.
+    """
+
+    #: keys of the state stored - all are stored as doubles with None as NaN
+    FIELDS = ['Timestamp', 'Connected', 'Synchronized', 'Altitude',
+              'Azimuth', 'RightAscension', 'Declination', 'SiderealTime',
+              'EncoderAltitude', 'EncoderAzimuth', 'EncoderAge']
+
+    _SEQ = struct.Struct('<Q')
+    # time published followed by FIELDS
+    _DATA = struct.Struct('<' + 'd'*(len(FIELDS) + 1))
+
+    SIZE = _SEQ.size + _DATA.size
+
+    def __init__(self, name=None):
+        """
+        :param name: Name of block to attach to, defaults to creating a
+                     new block
+        :type name: str, optional
+
+        """
+
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.SIZE)
+            self.shm.buf[:self.SIZE] = bytes(self.SIZE)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # only the creating process should unlink the block
+            try:
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+            except Exception:
+                logging.debug('Unable to unregister shared memory', exc_info=True)
+
+        self.name = self.shm.name
+        self._buf = self.shm.buf
+
+    def publish(self, state, published=None):
+        """
+        Write new state.  Only one thread in one process may write.
+
+        :param state: State from get_telescope_state()
+        :type state: dict
+        :param published: Time state published, defaults to time.time()
+        :type published: float, optional
+        """
+
+        if published is None:
+            published = time.time()
+
+        values = [math.nan if state.get(k) is None else float(state[k])
+                  for k in self.FIELDS]
+
+        seq = self._SEQ.unpack_from(self._buf, 0)[0]
+        self._SEQ.pack_into(self._buf, 0, seq + 1)
+        self._DATA.pack_into(self._buf, self._SEQ.size, published, *values)
+        self._SEQ.pack_into(self._buf, 0, seq + 2)
+
+    def read(self, retries=100):
+        """
+        Read latest state.
+
+        :param retries: Attempts before giving up if the writer is busy,
+                        defaults to 100
+        :type retries: int, optional
+        :returns:
+            (float, dict) Time published and state or (None, None) if
+            nothing has been published
+        """
+
+        for i in range(retries):
+            seq = self._SEQ.unpack_from(self._buf, 0)[0]
+            if seq & 1:
+                continue
+
+            values = self._DATA.unpack_from(self._buf, self._SEQ.size)
+            if self._SEQ.unpack_from(self._buf, 0)[0] != seq:
+                continue
+
+            if seq == 0:
+                break
+
+            state = {k: None if math.isnan(v) else v
+                     for k, v in zip(self.FIELDS, values[1:])}
+            state['Connected'] = bool(state['Connected'])
+            state['Synchronized'] = bool(state['Synchronized'])
+            for k in ('EncoderAltitude', 'EncoderAzimuth'):
+                if state[k] is not None:
+                    state[k] = int(state[k])
+            return values[0], state
+
+        return None, None
+
+    def close(self):
+        """ Detach from block and remove it if this process created it. """
+
+        self._buf.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class StatePublisher:
+    """
+    Publish telescope state to a SharedPointing block at a fixed rate
+    from a background thread.
+    """
+
+    def __init__(self, driver, shared, rate=20.0):
+        """
+        :param driver: Telescope model
+        :type driver: AlpacaAltAzTelescopeModel
+        :param shared: Block to publish to
+        :type shared: SharedPointing
+        :param rate: Publish rate in Hz, defaults to 20.0
+        :type rate: float, optional
+
+        """
+
+        self.driver = driver
+        self.shared = shared
+        self.period = 1.0 / rate
+        self._thread = None
+        self._stop_event = threading.Event()
+        # publish() is also called from request threads
+        self._lock = threading.Lock()
+
+    def publish(self):
+        """ Publish current state once.  Safe to call from any thread. """
+
+        with self._lock:
+            try:
+                state = self.driver.get_telescope_state()
+            except Exception:
+                logging.debug('StatePublisher: unable to get state', exc_info=True)
+                state = {'Timestamp': time.time(),
+                         'Connected': self.driver.connected}
+            self.shared.publish(state)
+
+    def start(self):
+        """ Start publishing. """
+
+        self.publish()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='StatePublisher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop publishing and wait for thread to exit. """
+
+        if self._thread is None:
+            return
+
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.period):
+            self.publish()
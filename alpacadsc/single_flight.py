@@ -0,0 +1,87 @@
+#
+# Coalesce concurrent calls of the same operation into a single call
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import threading
+
+
+class _Call:
+    """ State of a call in flight. """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Run at most one call of an operation at a time.
+
+    A thread calling do() while another thread's call is in flight does
+    not make its own call but waits for and returns the result (or raises
+    the exception) of the call in flight.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._call = None
+
+        #: number of calls actually made
+        self.calls = 0
+        #: number of callers which were given the result of another call
+        self.shared = 0
+
+    def do(self, func, *args, **kwargs):
+        """
+        Call func or wait for the call already in flight.
+
+        :param func: Function to call
+        :type func: callable
+        :returns: Result of the call
+        """
+
+        with self._lock:
+            call = self._call
+            if call is not None:
+                self.shared += 1
+                leader = False
+            else:
+                call = _Call()
+                self._call = call
+                self.calls += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._call = None
+            call.done.set()
+
+        return call.result
@@ -19,6 +19,8 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import os
+import sys
 import logging
 import argparse
 from datetime import datetime
@@ -27,9 +29,16 @@ from flask import Flask, redirect
 from flask_restx import Api
 
 from . import __version__ as version
-from .alpaca_controller import AlpacaTelescope
+from .alpaca_controller import AlpacaTelescope, AlpacaTelescopeState
+from .alpaca_controller import AlpacaTelescopeStream
+from .pointing_stream import PointingBroadcaster
+from .alpaca_registry import create_telescope_registry
 from .alpaca_models import AlpacaAltAzTelescopeModel as TelescopeModel
 from .setup_controller import About, MonitorEncoders, GlobalSetup, DeviceSetup
+from .iers_tables import update_iers_cache
+from .warmup import warm_up
+from .async_server import AsyncAlpacaServer
+from .lx200_server import LX200Server
 
 
 def parse_command_line():
@@ -39,14 +48,41 @@ def parse_command_line():
                         help='List known profiles')
     parser.add_argument('--port', type=int, default=8000,
                         help='TCP Port Alpaca server will listen on.')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='Address Alpaca server will listen on.')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Serve requests from this many worker '
+                        'processes with pointing shared from the process '
+                        'owning the encoders.')
+    parser.add_argument('--lx200-port', type=int, default=None,
+                        help='Also serve the position to LX200 protocol '
+                        'clients like SkySafari on this TCP port.')
+    parser.add_argument('--server', choices=['flask', 'asyncio'],
+                        default='flask',
+                        help='HTTP server - the Flask server (default) or '
+                        'one asyncio event loop for many clients.')
     parser.add_argument('--debug', action='store_true',
                         help='Set log level DEBUG')
     parser.add_argument('--quiet', action='store_true',
                         help='Hide most output except warnings and error messages.')
     parser.add_argument('--simul', action='store_true',
                         help='Run as simulation')
+    parser.add_argument('--no-warmup', action='store_true',
+                        help='Skip warm-up of transforms, templates and '
+                        'schemas before serving requests.')
+    parser.add_argument('--update-iers', action='store_true',
+                        help='Download current IERS Earth orientation table '
+                        'for offline use and exit.')
 
     args = parser.parse_args()
+
+    # worker processes share state with multiprocessing.shared_memory
+    if args.workers > 0 and sys.version_info < (3, 8):
+        parser.error('--workers requires Python 3.8 or later')
+
+    if args.workers > 0 and args.server != 'flask':
+        parser.error(f'--workers cannot be used with --server {args.server}')
+
     logging.debug(f'cmd args = {args}')
     return args
 
@@ -55,12 +91,16 @@ def redirect_root():
     print("HERE")
     return redirect('/setup')
 
-def create_app(port=8000):
+def create_app(port=8000, warmup=True, host='127.0.0.1'):
     """
     Create Flask app object.
 
     :param port: TCP port for service to use.
     :type port: int
+    :param warmup: Warm-up code paths used by requests before returning.
+    :type warmup: bool
+    :param host: Address service listens on shown on the setup page.
+    :type host: str
     :return: Flask app object
     :rtype: Flask()
 
@@ -77,11 +117,22 @@ def create_app(port=8000):
     api = Api(app, doc='/apidoc/')
 
     driver = TelescopeModel()
+    registry = create_telescope_registry(driver)
+    broadcaster = PointingBroadcaster(driver.get_telescope_state)
 
     api.add_resource(AlpacaTelescope, '/api/v1/telescope/0/<string:action>',
                       endpoint='Alpaca',
+                      resource_class_kwargs={'driver': driver,
+                                             'registry': registry})
+
+    api.add_resource(AlpacaTelescopeState, '/api/v1/telescope/0/state',
+                      endpoint='AlpacaState',
                       resource_class_kwargs={'driver': driver})
 
+    api.add_resource(AlpacaTelescopeStream, '/api/v1/telescope/0/stream',
+                      endpoint='AlpacaStream',
+                      resource_class_kwargs={'broadcaster': broadcaster})
+
     api.add_resource(About, '/about', endpoint='About',
                       resource_class_kwargs={'driver': driver})
 
@@ -90,13 +141,20 @@ def create_app(port=8000):
 
     api.add_resource(GlobalSetup, '/setup', endpoint='GlobalSetup',
                       resource_class_kwargs={'driver': driver,
-                                            'server_ip': '127.0.0.1',
+                                            'server_ip': host,
                                             'server_port': port})
 
     api.add_resource(DeviceSetup, '/setup/v1/telescope/0/setup',
                       endpoint='DeviceSetup',
                       resource_class_kwargs={'driver': driver})
 
+    # for servers which need the model, e.g. MultiWorkerServer
+    app.extensions['alpacadsc'] = {'driver': driver, 'registry': registry,
+                                   'broadcaster': broadcaster}
+
+    if warmup:
+        warm_up(app, driver)
+
     return app
 
 
@@ -104,9 +162,30 @@ def run_app(args):
 
     logging.info(f'Alpaca DSC Driver version {version} starting...')
 
-    app = create_app(args.port)
+    app = create_app(args.port, warmup=not args.no_warmup, host=args.host)
+
+    # with --debug the Flask server reloader runs this again in a child
+    # process which serves requests so only listen for LX200 there
+    reloader = args.debug and args.workers == 0 and args.server == 'flask'
+    reloader_parent = reloader and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
+
+    if args.lx200_port is not None and not reloader_parent:
+        LX200Server(app.extensions['alpacadsc']['driver'],
+                    app.extensions['alpacadsc']['broadcaster'],
+                    host=args.host, port=args.lx200_port).start_thread()
 
-    app.run(host='127.0.0.1', port=args.port, debug=args.debug)
+    if args.workers > 0:
+        # only imported when used as it needs Python 3.8
+        from .multiworker import MultiWorkerServer
+
+        server = MultiWorkerServer(app, host=args.host, port=args.port,
+                                   workers=args.workers)
+        server.start()
+        server.serve_forever()
+    elif args.server == 'asyncio':
+        AsyncAlpacaServer(app, host=args.host, port=args.port).run()
+    else:
+        app.run(host=args.host, port=args.port, debug=args.debug)
 
 
 def main():
@@ -145,6 +224,10 @@ def main():
 
     LOG.addHandler(CH)
 
+    if cmd_args.update_iers:
+        update_iers_cache()
+        return
+
     run_app(cmd_args)
 
 
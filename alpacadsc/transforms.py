@@ -0,0 +1,563 @@
+#
+# Coordinate transform engines converting between sky alt/az and RA/DEC
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import math
+import logging
+from abc import ABCMeta, abstractmethod
+
+# julian date of the unix epoch
+UNIX_EPOCH_JD = 2440587.5
+
+SECONDS_PER_DAY = 86400.0
+
+
+def mean_sidereal_angle(obstime):
+    """
+    Greenwich mean sidereal time (Meeus 12.4).
+
+    :param obstime: Time as a unix timestamp
+    :type obstime: float
+    :returns:
+        (float) GMST in degrees, not normalized
+    """
+
+    d = UNIX_EPOCH_JD + obstime/SECONDS_PER_DAY - 2451545.0
+    t = d/36525.0
+
+    return 280.46061837 + 360.98564736629*d + 0.000387933*t*t - t*t*t/38710000.0
+
+
+class TransformEngine(metaclass=ABCMeta):
+    """
+    Base class for engines converting between observed alt/az and ICRS
+    RA/DEC for an observer at a fixed location.
+
+    All angles are in decimal degrees and times are unix timestamps as
+    returned by time.time().  Refraction is not applied to match the
+    driver reporting doesrefraction as False.
+    """
+
+    def __init__(self, latitude, longitude, elevation):
+        """
+        :param latitude: Site latitude in degrees
+        :type latitude: float
+        :param longitude: Site longitude in degrees, east positive
+        :type longitude: float
+        :param elevation: Site elevation in meters
+        :type elevation: float
+
+        """
+        self.latitude = latitude
+        self.longitude = longitude
+        self.elevation = elevation
+
+    @abstractmethod
+    def name(self):
+        """
+        Returns the name used to select this engine in the profile.
+
+        """
+        pass
+
+    @abstractmethod
+    def altaz_to_radec(self, alt, az, obstime):
+        """
+        Convert observed alt/az to ICRS RA/DEC.
+
+        :param alt: Altitude in degrees
+        :type alt: float
+        :param az: Azimuth in degrees (N=0, E=90)
+        :type az: float
+        :param obstime: Time of observation as a unix timestamp
+        :type obstime: float
+        :returns:
+            (float, float) RA/DEC in degrees
+        """
+        pass
+
+    @abstractmethod
+    def radec_to_altaz(self, ra, dec, obstime):
+        """
+        Convert ICRS RA/DEC to observed alt/az.
+
+        :param ra: Right ascension in degrees
+        :type ra: float
+        :param dec: Declination in degrees
+        :type dec: float
+        :param obstime: Time of observation as a unix timestamp
+        :type obstime: float
+        :returns:
+            (float, float) Alt/az in degrees
+        """
+        pass
+
+    def sidereal_time(self, obstime):
+        """
+        Returns local mean sidereal time for the site.
+
+        Uses the IAU 1982 GMST expression with UTC in place of UT1 which
+        is accurate to about a second of time.
+
+        :param obstime: Time as a unix timestamp
+        :type obstime: float
+        :returns:
+            (float) Local sidereal time in hours
+        """
+
+        return ((mean_sidereal_angle(obstime) + self.longitude) % 360.0) / 15.0
+
+
+class AstropyTransformEngine(TransformEngine):
+    """ Reference engine using the astropy SkyCoord frame transforms. """
+
+    def __init__(self, latitude, longitude, elevation):
+        super().__init__(latitude, longitude, elevation)
+
+        from .iers_tables import ensure_iers_configured
+        ensure_iers_configured()
+
+        from astropy.coordinates import EarthLocation
+        from astropy import units as u
+
+        self.earth_location = EarthLocation(lat=latitude, lon=longitude,
+                                            height=elevation*u.m)
+
+    def name(self):
+        return 'astropy'
+
+    def altaz_to_radec(self, alt, az, obstime):
+        from astropy.coordinates import SkyCoord
+        from astropy.time import Time
+        from astropy import units as u
+
+        altaz = SkyCoord(alt=alt*u.deg, az=az*u.deg,
+                         obstime=Time(obstime, format='unix'),
+                         frame='altaz', location=self.earth_location)
+
+        radec = altaz.transform_to('icrs')
+        return float(radec.ra.degree), float(radec.dec.degree)
+
+    def radec_to_altaz(self, ra, dec, obstime):
+        from astropy.coordinates import SkyCoord, AltAz
+        from astropy.time import Time
+
+        aa = AltAz(location=self.earth_location,
+                   obstime=Time(obstime, format='unix'))
+
+        altaz = SkyCoord(ra, dec, unit='deg', frame='icrs').transform_to(aa)
+        return float(altaz.alt.degree), float(altaz.az.degree)
+
+
+class ErfaTransformEngine(TransformEngine):
+    """
+    Engine calling the ERFA routines astropy uses internally directly
+    instead of going through the astropy frame graph.
+
+    The site is converted to radians once and the Earth orientation
+    parameters (UT1-UTC and polar motion) are looked up from the astropy
+    IERS table at most once every eop_interval seconds as they change
+    very slowly.
+    """
+
+    def __init__(self, latitude, longitude, elevation, eop_interval=3600.0):
+        """
+        :param eop_interval: Seconds between Earth orientation lookups,
+                             defaults to 3600.0
+        :type eop_interval: float, optional
+
+        """
+        super().__init__(latitude, longitude, elevation)
+
+        from .iers_tables import ensure_iers_configured
+        ensure_iers_configured()
+
+        self.phi = math.radians(latitude)
+        self.elong = math.radians(longitude)
+        self.hm = elevation
+        self.eop_interval = eop_interval
+
+        self._eop_time = None
+        self._eop = None
+
+    def name(self):
+        return 'erfa'
+
+    def get_eop(self, obstime):
+        """
+        Returns Earth orientation parameters for given time.
+
+        :param obstime: Time as a unix timestamp
+        :type obstime: float
+        :returns:
+            (float, float, float) UT1-UTC in seconds and polar motion x/y
+            in radians
+        """
+
+        if self._eop_time is None or abs(obstime - self._eop_time) > self.eop_interval:
+            from astropy.time import Time
+            from astropy.utils import iers
+            from astropy import units as u
+
+            t = Time(obstime, format='unix')
+            table = iers.earth_orientation_table.get()
+            dut1 = table.ut1_utc(t).to_value(u.s)
+            xp, yp = table.pm_xy(t)
+
+            self._eop = (float(dut1), float(xp.to_value(u.rad)),
+                         float(yp.to_value(u.rad)))
+            self._eop_time = obstime
+            logging.debug(f'ErfaTransformEngine: eop = {self._eop}')
+
+        return self._eop
+
+    def get_astrom(self, obstime):
+        """
+        Compute star independent astrometry parameters for given time.
+
+        :param obstime: Time as a unix timestamp
+        :type obstime: float
+        :returns:
+            (eraASTROM) ERFA astrometry context
+        """
+
+        import erfa
+
+        dut1, xp, yp = self.get_eop(obstime)
+
+        # no refraction so pressure is zero
+        astrom, eo = erfa.apco13(UNIX_EPOCH_JD, obstime/SECONDS_PER_DAY, dut1,
+                                 self.elong, self.phi, self.hm, xp, yp,
+                                 0.0, 0.0, 0.0, 1.0)
+        return astrom
+
+    def altaz_to_radec(self, alt, az, obstime):
+        return self._altaz_to_radec_astrom(alt, az, self.get_astrom(obstime))
+
+    def radec_to_altaz(self, ra, dec, obstime):
+        return self._radec_to_altaz_astrom(ra, dec, self.get_astrom(obstime))
+
+    def _altaz_to_radec_astrom(self, alt, az, astrom):
+        import erfa
+
+        ri, di = erfa.atoiq('A', math.radians(az), math.radians(90.0 - alt),
+                            astrom)
+        rc, dc = erfa.aticq(ri, di, astrom)
+
+        return math.degrees(erfa.anp(rc)), math.degrees(dc)
+
+    def _radec_to_altaz_astrom(self, ra, dec, astrom):
+        import erfa
+
+        ri, di = erfa.atciq(math.radians(ra), math.radians(dec),
+                            0.0, 0.0, 0.0, 0.0, astrom)
+        aob, zob, hob, dob, rob = erfa.atioq(ri, di, astrom)
+
+        return 90.0 - math.degrees(zob), math.degrees(erfa.anp(aob))
+
+
+class CachedTransformEngine(ErfaTransformEngine):
+    """
+    Engine which caches the ICRS to topocentric rotation and only updates
+    it for Earth rotation between refreshes.
+
+    Every quantum seconds the full ERFA astrometry context is computed
+    and the exact transform is used.  From it the rotation from ICRS to
+    alt/az (bias-precession-nutation, Earth rotation angle, polar motion
+    and site latitude) is cached along with the observer velocity for
+    annual aberration.  Until the next refresh each conversion advances
+    the Earth rotation angle by the elapsed time and applies 3x3 matrix
+    products to a unit vector.
+
+    Light deflection and diurnal aberration are neglected which keeps
+    the results within 0.5 arcseconds of the exact transform.
+    """
+
+    # Earth rotation angle rate in radians per second
+    ERA_RATE = 2*math.pi*1.00273781191135448/SECONDS_PER_DAY
+
+    def __init__(self, latitude, longitude, elevation, quantum=5.0, **kwargs):
+        """
+        :param quantum: Seconds the cached rotation is used before it is
+                        recomputed, defaults to 5.0
+        :type quantum: float, optional
+
+        """
+        super().__init__(latitude, longitude, elevation, **kwargs)
+
+        self.quantum = quantum
+
+        # (time, topocentric matrix, celestial matrix, velocity, bm1)
+        self._cache = None
+
+    def name(self):
+        return 'cached'
+
+    def _refresh(self, obstime):
+        """
+        Compute exact astrometry context and cache rotation matrices.
+
+        :param obstime: Time as a unix timestamp
+        :type obstime: float
+        :returns:
+            (eraASTROM) ERFA astrometry context for obstime
+        """
+
+        import numpy as np
+
+        astrom = self.get_astrom(obstime)
+
+        # CIRS to -HA/Dec for Earth rotation angle plus longitude
+        era = astrom['eral']
+        c, s = math.cos(era), math.sin(era)
+        r_era = np.array([[c, s, 0.0], [-s, c, 0.0], [0.0, 0.0, 1.0]])
+
+        # polar motion (small angle form as used by eraAtioq)
+        xpl, ypl = astrom['xpl'], astrom['ypl']
+        r_pm = np.array([[1.0, 0.0, xpl], [0.0, 1.0, -ypl], [-xpl, ypl, 1.0]])
+
+        # -HA/Dec to alt/az frame for site latitude
+        sphi, cphi = astrom['sphi'], astrom['cphi']
+        r_lat = np.array([[sphi, 0.0, -cphi], [0.0, 1.0, 0.0], [cphi, 0.0, sphi]])
+
+        topo = r_lat @ r_pm
+        celestial = r_era @ astrom['bpn']
+
+        self._cache = (obstime, topo, celestial,
+                       np.array(astrom['v']), float(astrom['bm1']))
+
+        return astrom
+
+    def _rotation(self, obstime):
+        """
+        Returns ICRS (aberrated) to alt/az rotation for given time.
+
+        :param obstime: Time as a unix timestamp
+        :type obstime: float
+        :returns:
+            (ndarray, tuple) 3x3 rotation matrix and the cache entry used
+        """
+
+        import numpy as np
+
+        cache = self._cache
+        t0, topo, celestial, v, bm1 = cache
+
+        theta = self.ERA_RATE*(obstime - t0)
+        c, s = math.cos(theta), math.sin(theta)
+        r_delta = np.array([[c, s, 0.0], [-s, c, 0.0], [0.0, 0.0, 1.0]])
+
+        return topo @ r_delta @ celestial, cache
+
+    def _cache_valid(self, obstime):
+        return self._cache is not None and \
+            abs(obstime - self._cache[0]) < self.quantum
+
+    @staticmethod
+    def _aberrate(p, v, bm1):
+        """ Apply annual aberration to unit vector p (eraAb without deflection). """
+        pdv = p @ v
+        w1 = 1.0 + pdv/(1.0 + bm1)
+        q = p*bm1 + w1*v
+        return q / math.sqrt(q @ q)
+
+    def altaz_to_radec(self, alt, az, obstime):
+        if not self._cache_valid(obstime):
+            return self._altaz_to_radec_astrom(alt, az, self._refresh(obstime))
+
+        import numpy as np
+
+        rot, (t0, topo, celestial, v, bm1) = self._rotation(obstime)
+
+        alt_r = math.radians(alt)
+        az_r = math.radians(az)
+        cos_alt = math.cos(alt_r)
+        aet = np.array([-cos_alt*math.cos(az_r), cos_alt*math.sin(az_r),
+                        math.sin(alt_r)])
+
+        # rotate back to aberrated direction then remove aberration
+        # iteratively as done by eraAticq
+        pa = rot.T @ aet
+        p = pa
+        for i in range(2):
+            p = p + (pa - self._aberrate(p, v, bm1))
+            p = p / math.sqrt(p @ p)
+
+        ra = math.atan2(p[1], p[0]) % (2*math.pi)
+        dec = math.atan2(p[2], math.hypot(p[0], p[1]))
+
+        return math.degrees(ra), math.degrees(dec)
+
+    def radec_to_altaz(self, ra, dec, obstime):
+        if not self._cache_valid(obstime):
+            return self._radec_to_altaz_astrom(ra, dec, self._refresh(obstime))
+
+        import numpy as np
+
+        rot, (t0, topo, celestial, v, bm1) = self._rotation(obstime)
+
+        ra_r = math.radians(ra)
+        dec_r = math.radians(dec)
+        cos_dec = math.cos(dec_r)
+        p = np.array([cos_dec*math.cos(ra_r), cos_dec*math.sin(ra_r),
+                      math.sin(dec_r)])
+
+        x, y, z = rot @ self._aberrate(p, v, bm1)
+
+        az = math.atan2(y, -x) % (2*math.pi)
+        alt = math.atan2(z, math.hypot(x, y))
+
+        return math.degrees(alt), math.degrees(az)
+
+
+class FastTransformEngine(TransformEngine):
+    """
+    Low precision engine using Meeus style formulae in plain NumPy.
+
+    Sidereal time is from the IAU 1982 GMST expression using UTC in place
+    of UT1 and precession from J2000 uses the IAU 1976 angles.  Nutation,
+    aberration, polar motion and frame bias are neglected.  This engine
+    does not import astropy or access the IERS tables at all.
+
+    Compared with the astropy transforms the error is below 60 arcseconds
+    for dates within a few decades of J2000 (typically 20-40 arcseconds
+    from the neglected aberration and nutation plus up to 14 arcseconds
+    from UT1-UTC).  This is well below the resolution of setting circle
+    encoders with a few thousand steps per revolution (5 arcminutes for
+    4000 steps).
+    """
+
+    def __init__(self, latitude, longitude, elevation):
+        super().__init__(latitude, longitude, elevation)
+
+        import numpy as np
+
+        # -HA/Dec to alt/az frame for site latitude
+        sphi = math.sin(math.radians(latitude))
+        cphi = math.cos(math.radians(latitude))
+        self._r_lat = np.array([[sphi, 0.0, -cphi],
+                                [0.0, 1.0, 0.0],
+                                [cphi, 0.0, sphi]])
+
+    def name(self):
+        return 'fast'
+
+    @staticmethod
+    def _rz(angle):
+        import numpy as np
+        c, s = math.cos(angle), math.sin(angle)
+        return np.array([[c, s, 0.0], [-s, c, 0.0], [0.0, 0.0, 1.0]])
+
+    @staticmethod
+    def _ry(angle):
+        import numpy as np
+        c, s = math.cos(angle), math.sin(angle)
+        return np.array([[c, 0.0, -s], [0.0, 1.0, 0.0], [s, 0.0, c]])
+
+    def _rotation(self, obstime):
+        """
+        Returns J2000 to alt/az rotation for given time.
+
+        :param obstime: Time as a unix timestamp
+        :type obstime: float
+        :returns:
+            (ndarray) 3x3 rotation matrix
+        """
+
+        d = UNIX_EPOCH_JD + obstime/SECONDS_PER_DAY - 2451545.0
+        t = d/36525.0
+
+        # local mean sidereal time
+        lst = math.radians((mean_sidereal_angle(obstime) + self.longitude) % 360.0)
+
+        # precession J2000 to date (Meeus 21.2)
+        arcsec = math.pi/(180.0*3600.0)
+        zeta = (2306.2181*t + 0.30188*t*t + 0.017998*t*t*t)*arcsec
+        z = (2306.2181*t + 1.09468*t*t + 0.018203*t*t*t)*arcsec
+        theta = (2004.3109*t - 0.42665*t*t - 0.041833*t*t*t)*arcsec
+        prec = self._rz(-z) @ self._ry(theta) @ self._rz(-zeta)
+
+        return self._r_lat @ self._rz(lst) @ prec
+
+    def altaz_to_radec(self, alt, az, obstime):
+        import numpy as np
+
+        alt_r = math.radians(alt)
+        az_r = math.radians(az)
+        cos_alt = math.cos(alt_r)
+        aet = np.array([-cos_alt*math.cos(az_r), cos_alt*math.sin(az_r),
+                        math.sin(alt_r)])
+
+        p = self._rotation(obstime).T @ aet
+
+        ra = math.atan2(p[1], p[0]) % (2*math.pi)
+        dec = math.atan2(p[2], math.hypot(p[0], p[1]))
+
+        return math.degrees(ra), math.degrees(dec)
+
+    def radec_to_altaz(self, ra, dec, obstime):
+        import numpy as np
+
+        ra_r = math.radians(ra)
+        dec_r = math.radians(dec)
+        cos_dec = math.cos(dec_r)
+        p = np.array([cos_dec*math.cos(ra_r), cos_dec*math.sin(ra_r),
+                      math.sin(dec_r)])
+
+        x, y, z = self._rotation(obstime) @ p
+
+        az = math.degrees(math.atan2(y, -x) % (2*math.pi))
+        alt = math.degrees(math.atan2(z, math.hypot(x, y)))
+
+        return alt, az
+
+
+# engines which can be selected in the profile
+TRANSFORM_ENGINES = {
+    'astropy': AstropyTransformEngine,
+    'erfa': ErfaTransformEngine,
+    'cached': CachedTransformEngine,
+    'fast': FastTransformEngine
+}
+
+
+def create_transform_engine(name, latitude, longitude, elevation):
+    """
+    Create transform engine by name.
+
+    :param name: Name of engine - a key of TRANSFORM_ENGINES
+    :type name: str
+    :param latitude: Site latitude in degrees
+    :type latitude: float
+    :param longitude: Site longitude in degrees, east positive
+    :type longitude: float
+    :param elevation: Site elevation in meters
+    :type elevation: float
+    :returns:
+        (TransformEngine) Engine object or None if name is not known
+    """
+
+    engine_class = TRANSFORM_ENGINES.get(name)
+    if engine_class is None:
+        logging.error(f'Unknown transform engine {name}! '
+                      f'Valid choices are {" ".join(TRANSFORM_ENGINES)}.')
+        return None
+
+    logging.info(f'Using transform engine {name}.')
+    return engine_class(latitude, longitude, elevation)
@@ -0,0 +1,281 @@
+#
+# Transports carrying the DSC protocols - serial ports, TCP sockets and
+# pseudo terminals
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import socket
+import select
+import logging
+
+import serial
+
+try:
+    import tty
+    import fcntl
+    import termios
+except ImportError:
+    # only needed by PtyTransport which is not available on Windows
+    tty = fcntl = termios = None
+
+
+class Transport:
+    """
+    Byte stream to DSC hardware.
+
+    All transports have the same interface as the subset of serial.Serial
+    used by the encoder drivers.  Errors are raised as OSError (which
+    includes serial.SerialException) so a driver can treat any of them
+    as a lost link.
+
+    readinto() waits at most the timeout given when the transport was
+    opened and returns the bytes available which may be fewer than
+    requested.
+    """
+
+    def write(self, data):
+        """
+        Write all of data.
+
+        :param data: Bytes to send
+        :type data: bytes
+        """
+        raise NotImplementedError
+
+    def readinto(self, b):
+        """
+        Read bytes into a buffer.
+
+        :param b: Buffer to fill
+        :type b: bytearray or memoryview
+        :returns:
+            (int) Number of bytes read - 0 on timeout
+        """
+        raise NotImplementedError
+
+    @property
+    def in_waiting(self):
+        """ Number of bytes which can be read without waiting. """
+        raise NotImplementedError
+
+    def reset_input_buffer(self):
+        """ Discard bytes received and not yet read. """
+        raise NotImplementedError
+
+    def fileno(self):
+        """ File descriptor for use with select() where supported. """
+        raise NotImplementedError
+
+    def close(self):
+        """ Close the transport. """
+        raise NotImplementedError
+
+
+class SerialTransport(Transport):
+    """ Serial port opened with pyserial. """
+
+    def __init__(self, address, speed, timeout):
+        """
+        :param address: Serial device like /dev/ttyUSB0 or COM3
+        :type address: str
+        :param speed: Serial port speed
+        :type speed: int
+        :param timeout: Read timeout in seconds
+        :type timeout: float
+
+        """
+        self.port = serial.Serial(address, speed, timeout=timeout)
+
+    def write(self, data):
+        self.port.write(data)
+
+    def readinto(self, b):
+        return self.port.readinto(b)
+
+    @property
+    def in_waiting(self):
+        return self.port.in_waiting
+
+    def reset_input_buffer(self):
+        self.port.reset_input_buffer()
+
+    def fileno(self):
+        return self.port.fileno()
+
+    def close(self):
+        self.port.close()
+
+
+class TcpTransport(Transport):
+    """
+    Persistent TCP connection to a DSC on the network such as a WiFi
+    DSC box or a ser2net bridge.  Nagle's algorithm is disabled so each
+    short request is sent immediately.
+    """
+
+    #: bytes peeked to count bytes waiting
+    PEEK_SIZE = 4096
+
+    def __init__(self, address, speed, timeout, connect_timeout=5.0):
+        """
+        :param address: host:port
+        :type address: str
+        :param speed: Ignored
+        :type speed: int
+        :param timeout: Read timeout in seconds
+        :type timeout: float
+        :param connect_timeout: Seconds to wait for connection,
+                                defaults to 5.0
+        :type connect_timeout: float, optional
+
+        """
+
+        host, sep, port = address.rpartition(':')
+        if not sep or not host:
+            raise ValueError(f'TCP address {address} must be host:port')
+
+        self.sock = socket.create_connection((host.strip('[]'), int(port)),
+                                             timeout=connect_timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.settimeout(timeout)
+
+    def write(self, data):
+        self.sock.sendall(data)
+
+    def readinto(self, b):
+        try:
+            n = self.sock.recv_into(b)
+        except socket.timeout:
+            return 0
+        if n == 0 and len(b) > 0:
+            raise ConnectionResetError('Connection closed by DSC')
+        return n
+
+    @property
+    def in_waiting(self):
+        readable, _, _ = select.select([self.sock], [], [], 0)
+        if not readable:
+            return 0
+        n = len(self.sock.recv(self.PEEK_SIZE, socket.MSG_PEEK))
+        if n == 0:
+            raise ConnectionResetError('Connection closed by DSC')
+        return n
+
+    def reset_input_buffer(self):
+        while self.in_waiting:
+            self.sock.recv(self.PEEK_SIZE)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+
+class PtyTransport(Transport):
+    """
+    Pseudo terminal such as an emulator of DSC hardware.  The terminal is
+    put in raw mode and there is no speed to set.  Only available on
+    POSIX systems.
+    """
+
+    def __init__(self, address, speed, timeout):
+        """
+        :param address: Path of pseudo terminal like /dev/pts/3
+        :type address: str
+        :param speed: Ignored
+        :type speed: int
+        :param timeout: Read timeout in seconds
+        :type timeout: float
+
+        """
+
+        self.timeout = timeout
+        self.fd = os.open(address, os.O_RDWR | os.O_NOCTTY)
+        try:
+            tty.setraw(self.fd)
+        except Exception:
+            os.close(self.fd)
+            raise
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.fd, view):]
+
+    def readinto(self, b):
+        readable, _, _ = select.select([self.fd], [], [], self.timeout)
+        if not readable:
+            return 0
+        return os.readv(self.fd, [b])
+
+    @property
+    def in_waiting(self):
+        buf = bytearray(4)
+        fcntl.ioctl(self.fd, termios.FIONREAD, buf)
+        return int.from_bytes(buf, sys.byteorder)
+
+    def reset_input_buffer(self):
+        termios.tcflush(self.fd, termios.TCIFLUSH)
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        os.close(self.fd)
+
+
+TRANSPORTS = {
+    'serial': SerialTransport,
+    'tcp': TcpTransport,
+    'pty': PtyTransport
+}
+
+
+def open_transport(url, speed, timeout):
+    """
+    Open transport by URL.
+
+    The URL is serial://device, tcp://host:port or pty://path.  A URL
+    without a scheme is a serial device so existing profiles naming a
+    port like /dev/ttyUSB0 or COM3 keep working.
+
+    :param url: URL or serial device name
+    :type url: str
+    :param speed: Serial port speed
+    :type speed: int
+    :param timeout: Read timeout in seconds
+    :type timeout: float
+    :returns:
+        (Transport) Open transport
+    :raises ValueError: If the scheme is not known
+    """
+
+    scheme, sep, address = url.partition('://')
+    if not sep:
+        scheme, address = 'serial', url
+
+    transport_class = TRANSPORTS.get(scheme)
+    if transport_class is None:
+        raise ValueError(f'Unknown transport {scheme}! '
+                         f'Valid choices are {" ".join(TRANSPORTS)}.')
+
+    logging.debug(f'Opening {scheme} transport to {address}')
+    return transport_class(address, speed, timeout)
@@ -0,0 +1,116 @@
+#
+# Warm-up of lazily initialized code paths before the service starts
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import time
+import logging
+
+from .alpaca_service import AlpacaBaseService, AlpacaTelescopeService
+
+
+def warm_up_transforms(driver):
+    """
+    Install the transform engine from the current profile on the driver
+    and run a dummy transform with it so the transform code (astropy
+    frame graph, ERFA, IERS tables) and the engine's own caches are
+    loaded before the first request.
+
+    :param driver: Telescope model
+    :type driver: AlpacaAltAzTelescopeModel
+    """
+
+    profile, profile_name = driver.load_profile()
+    if profile is None or None in [profile.location.latitude,
+                                   profile.location.longitude,
+                                   profile.location.altitude]:
+        logging.debug('warm_up_transforms: no usable profile')
+        return
+
+    if not driver.setup_transform(profile):
+        return
+
+    obstime = time.time()
+    alt, az = driver.transform.radec_to_altaz(0.0, 0.0, obstime)
+    driver.transform.altaz_to_radec(alt, az, obstime)
+
+
+def warm_up_templates(app):
+    """
+    Compile all templates so first page render does not pay for it.
+
+    :param app: Flask app object
+    :type app: Flask
+    """
+
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+
+
+def warm_up_schemas():
+    """
+    Run validation through each PUT request schema so marshmallow is fully
+    initialized before the first PUT request.
+    """
+
+    for service in [AlpacaBaseService, AlpacaTelescopeService]:
+        for schema, handler in service.put_actions.values():
+            schema.validate({})
+
+
+def warm_up_requests(app):
+    """
+    Send static and dynamic GET requests through the app to initialize
+    request routing and response serialization.
+
+    :param app: Flask app object
+    :type app: Flask
+    """
+
+    with app.test_client() as client:
+        client.get('/api/v1/telescope/0/description')
+        client.get('/api/v1/telescope/0/connected')
+
+
+def warm_up(app, driver):
+    """
+    Run all warm-up stages logging how long each one took.  A failing
+    stage is logged and does not prevent the service from starting.
+
+    :param app: Flask app object
+    :type app: Flask
+    :param driver: Telescope model
+    :type driver: AlpacaAltAzTelescopeModel
+    """
+
+    stages = [('transforms', lambda: warm_up_transforms(driver)),
+              ('templates', lambda: warm_up_templates(app)),
+              ('schemas', warm_up_schemas),
+              ('requests', lambda: warm_up_requests(app))]
+
+    start = time.perf_counter()
+    for name, stage in stages:
+        stage_start = time.perf_counter()
+        try:
+            stage()
+        except Exception:
+            logging.error(f'Warm-up of {name} failed!', exc_info=True)
+        logging.info(f'Warm-up of {name} took '
+                     f'{(time.perf_counter()-stage_start)*1000:.1f} ms')
+
+    logging.info(f'Warm-up took {(time.perf_counter()-start)*1000:.1f} ms')
@@ -56,7 +56,9 @@ setup(
     python_requires='>=3.7, <4',
 
     install_requires=[
-                      'astropy>=1.10',
+                      'astropy>=4.3',
+                      'pyerfa>=2.0',
+                      'numpy>=1.17',
                       'Flask>=1.1',
                       'flask-restx>=0.2.0',
                       'marshmallow>=3.8.0',
@@ -0,0 +1,227 @@
+#
+# Emulator of digital setting circles hardware on a pseudo terminal
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import pty
+import tty
+import time
+import queue
+import collections
+import select
+import socket
+import threading
+
+
+class EncoderEmulator:
+    """
+    Emulate DSC hardware speaking the "Generic" or "DaveEk" protocol on
+    a pseudo terminal or, with transport='tcp', as a TCP server on the
+    local host like a WiFi DSC box.  Connect an encoders driver to the
+    port attribute which is a device path or a tcp:// URL.
+
+    Latency models the link - each command reaches the emulated hardware
+    latency seconds after it is written and each response reaches the
+    driver latency seconds after it is sent.  The emulated hardware handles
+    one command at a time taking process_time seconds for each.
+
+    Each position request increments the altitude count so responses can
+    be matched to requests.
+
+    Faults queued with inject() corrupt the framing of the following
+    position responses:
+
+    - 'drop' loses the last byte of the response
+    - 'extra' appends a stray byte after the response
+    - 'noise' inserts a stray byte before the response
+
+    Setting silent makes the hardware read commands without answering
+    like a board which has not started.
+    """
+
+    FAULTS = ['drop', 'extra', 'noise']
+
+    def __init__(self, protocol='Generic', latency=0.0, process_time=0.0,
+                 alt=0, az=2000, transport='pty'):
+        self.protocol = protocol
+        self.transport = transport
+        self.latency = latency
+        self.process_time = process_time
+        self.alt = alt
+        self.az = az
+        self.res_alt = 4000
+        self.res_az = 4000
+
+        #: number of position requests received
+        self.position_requests = 0
+
+        #: faults to apply to the next position responses
+        self.faults = collections.deque()
+
+        #: commands are read but not answered if True
+        self.silent = False
+
+        self._buf = b''
+        self._device_free = 0.0
+        self._responses = queue.Queue()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self.transport == 'tcp':
+            self._listener = socket.create_server(('127.0.0.1', 0))
+            self._conn = None
+            self.master = None
+            self.port = f'tcp://127.0.0.1:{self._listener.getsockname()[1]}'
+        else:
+            self.master, self.slave = pty.openpty()
+            tty.setraw(self.slave)
+            self.port = os.ttyname(self.slave)
+
+        self._threads = [threading.Thread(target=self._reader, daemon=True),
+                         threading.Thread(target=self._writer, daemon=True)]
+        for t in self._threads:
+            t.start()
+
+        return self
+
+    def stop(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._responses.put(None)
+        for t in self._threads:
+            t.join()
+        if self.transport == 'tcp':
+            if self._conn is not None:
+                self._conn.close()
+            self._listener.close()
+        else:
+            os.close(self.master)
+            os.close(self.slave)
+
+    def inject(self, fault):
+        """ Corrupt the next position response with fault. """
+        if fault not in self.FAULTS:
+            raise ValueError(f'Unknown fault {fault}')
+        self.faults.append(fault)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _reader(self):
+        while not self._stop.is_set():
+            if self.transport == 'tcp' and self._conn is None:
+                self._accept()
+                continue
+
+            r, _, _ = select.select([self.master], [], [], 0.05)
+            if not r:
+                continue
+            try:
+                data = os.read(self.master, 1024)
+            except OSError:
+                break
+            if not data and self.transport == 'tcp':
+                # client disconnected - wait for it to reconnect
+                self._conn.close()
+                self._conn = None
+                self._buf = b''
+                continue
+            arrived = time.monotonic() + self.latency
+            self._buf += data
+            for cmd in self._parse_commands():
+                self._schedule(arrived, self._handle(cmd))
+
+    def _accept(self):
+        r, _, _ = select.select([self._listener], [], [], 0.05)
+        if r:
+            self._conn, _ = self._listener.accept()
+            self.master = self._conn.fileno()
+
+    def _parse_commands(self):
+        cmds = []
+        if self.protocol == 'Generic':
+            while b'\n' in self._buf:
+                cmd, self._buf = self._buf.split(b'\n', 1)
+                cmds.append(cmd.strip())
+        else:
+            while self._buf:
+                n = 5 if self._buf[:1] == b'z' else 1
+                if len(self._buf) < n:
+                    break
+                cmds.append(self._buf[:n])
+                self._buf = self._buf[n:]
+        return cmds
+
+    def _handle(self, cmd):
+        if cmd in [b'Q', b'y']:
+            self.position_requests += 1
+            self.alt += 1
+            if self.protocol == 'Generic':
+                resp = f'{self.alt}\t{self.az}\r'.encode()
+            else:
+                resp = (self.alt.to_bytes(2, 'little') +
+                        self.az.to_bytes(2, 'little'))
+            return self._apply_fault(resp)
+        elif cmd in [b'H', b'h']:
+            if self.protocol == 'Generic':
+                return f'{self.res_alt}\t{self.res_az}\r'.encode()
+            return (self.res_alt.to_bytes(2, 'little') +
+                    self.res_az.to_bytes(2, 'little'))
+        elif cmd[:1] == b'Z':
+            self.res_alt, self.res_az = [int(v) for v in cmd[1:].split()]
+            return b'*'
+        elif cmd[:1] == b'z':
+            self.res_alt = int.from_bytes(cmd[1:3], 'little')
+            self.res_az = int.from_bytes(cmd[3:5], 'little')
+        return None
+
+    def _apply_fault(self, resp):
+        if not self.faults:
+            return resp
+        fault = self.faults.popleft()
+        if fault == 'drop':
+            return resp[:-1]
+        elif fault == 'extra':
+            return resp + b'\xff'
+        return b'\xff' + resp
+
+    def _schedule(self, arrived, response):
+        start = max(arrived, self._device_free)
+        self._device_free = start + self.process_time
+        if response is not None and not self.silent:
+            self._responses.put((self._device_free + self.latency, response))
+
+    def _writer(self):
+        while True:
+            item = self._responses.get()
+            if item is None:
+                break
+            when, response = item
+            delay = when - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                os.write(self.master, response)
+            except (OSError, TypeError):
+                # client disconnected
+                pass
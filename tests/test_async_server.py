@@ -0,0 +1,214 @@
+#
+# Test asyncio Alpaca server front end
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import json
+import asyncio
+import threading
+
+from consts import REST_API_URI
+
+from alpacadsc.alpaca_controller import ALPACA_ERROR_NOTIMPLEMENTED
+from alpacadsc.async_server import AsyncAlpacaServer
+from alpacadsc.encoder_pool import shared_encoder_pool
+
+# we must import pytest fixtures client and my_fs for the test cases
+# below to run properly.
+from utils import create_test_profile, client, my_fs
+
+
+class HTTPClient:
+    """ Minimal keep-alive HTTP client for the tests. """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, port):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        return cls(reader, writer)
+
+    async def request(self, method, path, body=b''):
+        head = f'{method} {path} HTTP/1.1\r\nHost: localhost\r\n'
+        if body:
+            head += 'Content-Type: application/x-www-form-urlencoded\r\n'
+        head += f'Content-Length: {len(body)}\r\n\r\n'
+        self.writer.write(head.encode() + body)
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode().partition(':')
+            headers[name.lower()] = value.strip()
+        body = await self.reader.readexactly(int(headers['content-length']))
+        return status, headers, body
+
+    async def alpaca(self, method, action, body=b''):
+        status, headers, body = await self.request(method,
+                                                   REST_API_URI + '/' + action,
+                                                   body)
+        assert status == 200
+        return json.loads(body)
+
+    def close(self):
+        self.writer.close()
+
+
+def run_server(app, test):
+    async def main():
+        server = AsyncAlpacaServer(app, port=0)
+        await server.start()
+        try:
+            await test(server)
+        finally:
+            await server.close()
+
+    asyncio.run(main())
+
+
+def test_async_server_keep_alive(client):
+    create_test_profile()
+
+    async def test(server):
+        c = await HTTPClient.connect(server.port)
+
+        # many requests on one connection
+        resp = await c.alpaca('GET', 'connected')
+        assert resp['Value'] is False
+        resp = await c.alpaca('GET', 'cansync')
+        assert resp['Value'] is True
+        resp = await c.alpaca('GET', 'notanaction')
+        assert resp['ErrorNumber'] == ALPACA_ERROR_NOTIMPLEMENTED
+        resp = await c.alpaca('PUT', 'notanaction',
+                              b'ClientID=1&ClientTransactionID=1')
+        assert resp['ErrorNumber'] == ALPACA_ERROR_NOTIMPLEMENTED
+
+        resp = await c.alpaca('PUT', 'connected',
+                              b'Connected=True&ClientID=1&ClientTransactionID=2')
+        assert resp['ErrorNumber'] == 0
+        resp = await c.alpaca('GET', 'connected')
+        assert resp['Value'] is True
+
+        resp = await c.alpaca('PUT', 'synctocoordinates',
+                              b'RightAscension=6&Declination=30&'
+                              b'ClientID=1&ClientTransactionID=3')
+        assert resp['ErrorNumber'] == 0
+
+        # concurrent pointing requests share snapshots
+        resps = await asyncio.gather(*[c2.alpaca('GET', 'declination')
+                                       for c2 in [c] + [await HTTPClient.connect(server.port)
+                                                        for i in range(5)]])
+        assert all(abs(r['Value'] - 30) < 0.1 for r in resps)
+
+        resp = await c.alpaca('GET', 'state')
+        assert resp['Value']['Synchronized'] is True
+        assert abs(resp['Value']['RightAscension'] - 6) < 0.01
+
+        # pages rendered by Flask app
+        status, headers, body = await c.request('GET', '/encoders')
+        assert status == 200
+        assert b'Monitor Encoders' in body
+        status, headers, body = await c.request('GET', '/setup')
+        assert status == 200
+
+        # state stream sent from the event loop
+        s = await HTTPClient.connect(server.port)
+        s.writer.write(f'GET {REST_API_URI}/stream?rate=10 HTTP/1.1\r\n\r\n'.encode())
+        assert b' 200 ' in await s.reader.readline()
+        head = await s.reader.readuntil(b'\r\n\r\n')
+        assert b'text/event-stream' in head
+        event = await asyncio.wait_for(s.reader.readuntil(b'\n\n'), 5)
+        data = json.loads(event.split(b'data: ', 1)[1])
+        assert data['Synchronized'] is True
+        connections = server.connections
+        s.close()
+        await asyncio.sleep(0.3)
+        assert server.connections == connections - 1
+
+        resp = await c.alpaca('PUT', 'connected',
+                              b'Connected=False&ClientID=1&ClientTransactionID=4')
+        assert resp['ErrorNumber'] == 0
+        c.close()
+
+    run_server(client.application, test)
+    shared_encoder_pool().close()
+
+
+def test_async_server_many_connections(client):
+
+    async def test(server):
+        threads = threading.active_count()
+
+        clients = [await HTTPClient.connect(server.port) for i in range(300)]
+        await asyncio.sleep(0.1)
+        assert server.connections == 300
+
+        resps = await asyncio.gather(*[c.alpaca('GET', 'connected')
+                                       for c in clients])
+        assert all(r['Value'] is False for r in resps)
+
+        # connections are coroutines not threads
+        assert threading.active_count() == threads
+
+        for c in clients:
+            c.close()
+        await asyncio.sleep(0.1)
+        assert server.connections == 0
+
+        # bad request closes connection
+        c = await HTTPClient.connect(server.port)
+        c.writer.write(b'garbage\r\n\r\n')
+        assert b' 400 ' in await c.reader.readline()
+
+    run_server(client.application, test)
+
+
+def test_async_server_no_snapshot_window(client, mocker):
+    """
+    Test a pointing GET reads the encoders once when snapshots are not
+    shared between requests.
+    """
+
+    create_test_profile()
+    driver = client.application.extensions['alpacadsc']['driver']
+
+    async def test(server):
+        c = await HTTPClient.connect(server.port)
+        resp = await c.alpaca('PUT', 'connected',
+                              b'Connected=True&ClientID=1&ClientTransactionID=1')
+        assert resp['ErrorNumber'] == 0
+
+        driver.snapshot_window = 0
+        compute = mocker.spy(driver, 'compute_pointing_snapshot')
+        for i in range(3):
+            resp = await c.alpaca('GET', 'altitude')
+            assert resp['ErrorNumber'] == 0
+        assert compute.call_count == 3
+
+        resp = await c.alpaca('PUT', 'connected',
+                              b'Connected=False&ClientID=1&ClientTransactionID=2')
+        assert resp['ErrorNumber'] == 0
+        c.close()
+
+    run_server(client.application, test)
+    shared_encoder_pool().close()
@@ -0,0 +1,724 @@
+#
+# Test encoder access layer
+#
+#
+# Invocation:  Run from the root directory of alpacadsc git checkout:
+#              python -m pytest -v tests/
+#
+# To see logging output up to a certain log level add the options:
+#              "-v -o log_cli=true --log-cli-level=DEBUG"
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import time
+import logging
+import socket
+import threading
+
+import pytest
+
+from alpacadsc.encoders_altaz_simulator import EncodersAltAzSimulator
+from alpacadsc.encoder_sampler import EncoderSampler
+from alpacadsc.single_flight import SingleFlight
+from alpacadsc.command_queue import CommandQueue, CommandQueueStopped
+from alpacadsc.baseencoders import PRIORITY_SYNC, PRIORITY_CONFIG, PRIORITY_POLL
+from alpacadsc.baseencoders import EncoderLinkDown
+from alpacadsc.encoders_altaz_daveek import EncodersDaveEk
+from alpacadsc.encoders_altaz_generic import EncodersGeneric
+from alpacadsc.encoder_io_loop import EncoderIOLoop
+from alpacadsc.encoder_pool import EncoderPool
+from alpacadsc.transports import open_transport, TcpTransport, PtyTransport
+from alpacadsc.encoder_codecs import DaveEkCodec, GenericCodec, FramingError
+
+from encoder_emulator import EncoderEmulator
+
+
+def test_sampler_publishes_latest(mocker):
+    """
+    Test background sampler polls encoders and publishes latest position
+    without readers touching the encoders.
+    """
+
+    encoders = EncodersAltAzSimulator(res_alt=10000, res_az=10000)
+    read = mocker.patch.object(encoders, 'get_encoder_position',
+                               return_value=(1000, 2000))
+
+    sampler = EncoderSampler(encoders, rate=100)
+    sampler.start()
+    try:
+        # first sample is available as soon as start() returns
+        sample = sampler.latest
+        assert (sample.alt, sample.az) == (1000, 2000)
+
+        # sampler keeps polling in background
+        time.sleep(0.1)
+        assert read.call_count > 2
+        assert sampler.latest.timestamp >= sample.timestamp
+
+        # new positions are picked up by the sampler
+        count = read.call_count
+        read.return_value = (3000, 4000)
+        while sampler.latest.alt != 3000:
+            time.sleep(0.01)
+        assert read.call_count > count
+    finally:
+        sampler.stop()
+
+    assert not sampler.running
+
+
+def test_single_flight_coalesces_reads():
+    """
+    Test a burst of simultaneous encoder reads results in one read with all
+    callers getting its result.
+    """
+
+    count = 0
+
+    def slow_read():
+        nonlocal count
+        count += 1
+        time.sleep(0.3)
+        return count, 2000
+
+    flight = SingleFlight()
+    barrier = threading.Barrier(20)
+    results = []
+
+    def poll():
+        barrier.wait()
+        results.append(flight.do(slow_read))
+
+    threads = [threading.Thread(target=poll) for i in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert count == 1
+    assert results == [(1, 2000)]*20
+    assert (flight.calls, flight.shared) == (1, 19)
+
+    # next read after the burst is a new read
+    assert flight.do(slow_read) == (2, 2000)
+
+
+def test_single_flight_shares_errors():
+    """ Test an exception from the read in flight is raised for all callers. """
+
+    started = threading.Event()
+
+    def failing_read():
+        started.set()
+        time.sleep(0.2)
+        raise IOError('serial port gone')
+
+    flight = SingleFlight()
+    errors = []
+
+    def poll():
+        try:
+            flight.do(failing_read)
+        except IOError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=poll)
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=poll)
+    follower.start()
+    leader.join()
+    follower.join()
+
+    assert len(errors) == 2
+    assert errors[0] is errors[1]
+    assert flight.calls == 1
+
+    with pytest.raises(IOError):
+        flight.do(failing_read)
+
+
+def test_command_queue_priority():
+    """
+    Test pending transactions run one at a time in priority order and
+    queue statistics are collected.
+    """
+
+    cmdq = CommandQueue()
+    cmdq.start()
+
+    busy = threading.Event()
+    release = threading.Event()
+    order = []
+
+    def transaction(tag):
+        order.append(tag)
+        return tag
+
+    def blocking():
+        busy.set()
+        release.wait()
+
+    try:
+        blocker = threading.Thread(target=cmdq.submit, args=(blocking,))
+        blocker.start()
+        busy.wait()
+
+        # queue up while port is busy - sync should jump ahead of polls
+        threads = []
+        for tag, priority in [('poll1', PRIORITY_POLL),
+                              ('poll2', PRIORITY_POLL),
+                              ('config', PRIORITY_CONFIG),
+                              ('sync', PRIORITY_SYNC)]:
+            t = threading.Thread(target=cmdq.submit, args=(transaction, tag),
+                                 kwargs=dict(priority=priority))
+            t.start()
+            threads.append(t)
+            while cmdq.stats()['depth'] < len(threads):
+                time.sleep(0.001)
+
+        stats = cmdq.stats()
+        assert stats['depth'] == 4
+        assert stats['max_depth'] == 4
+
+        release.set()
+        blocker.join()
+        for t in threads:
+            t.join()
+
+        assert order == ['sync', 'config', 'poll1', 'poll2']
+
+        stats = cmdq.stats()
+        assert stats['depth'] == 0
+        assert stats['wait']['poll']['count'] == 3
+        assert stats['wait']['sync']['count'] == 1
+        assert stats['wait']['poll']['max'] > 0
+
+        # errors in a transaction are raised in the caller
+        with pytest.raises(ZeroDivisionError):
+            cmdq.submit(lambda: 1/0)
+    finally:
+        release.set()
+        cmdq.stop()
+
+    with pytest.raises(CommandQueueStopped):
+        cmdq.submit(transaction, 'late')
+
+
+def test_serial_encoders_use_command_queue(mocker):
+    """ Test serial encoder driver runs its transactions on the command queue. """
+
+    port = mocker.MagicMock()
+    port.in_waiting = 0
+
+    def readinto(b):
+        b[:4] = (1000).to_bytes(2, 'little') + (2000).to_bytes(2, 'little')
+        return 4
+
+    port.readinto.side_effect = readinto
+    mocker.patch('alpacadsc.transports.serial.Serial', return_value=port)
+    mocker.patch('alpacadsc.baseencoders_serial.time.sleep')
+
+    encoders = EncodersDaveEk(res_alt=10000, res_az=10000)
+    assert encoders.get_command_stats() is None
+    assert encoders.connect('/dev/ttyFAKE')
+
+    threads = {}
+
+    def read():
+        threads['position'] = threading.current_thread().name
+        return EncodersDaveEk._read_position(encoders)
+
+    mocker.patch.object(encoders, '_read_position', side_effect=read)
+
+    try:
+        assert encoders.get_encoder_position() == (1000, 2000)
+        assert encoders.get_encoder_position(priority=PRIORITY_SYNC) == (1000, 2000)
+        assert threads['position'] == 'CommandQueue-/dev/ttyFAKE'
+
+        stats = encoders.get_command_stats()
+        # readiness probe and resolution
+        assert stats['wait']['config']['count'] == 2
+        assert stats['wait']['poll']['count'] == 1
+        assert stats['wait']['sync']['count'] == 1
+    finally:
+        encoders.disconnect()
+
+    assert encoders.get_encoder_position() is None
+
+
+@pytest.mark.parametrize('driver', [EncodersGeneric, EncodersDaveEk])
+def test_pipelined_reads(driver):
+    """
+    Test pipelined polls match responses to requests in order and raise
+    the read rate on a link with latency.
+    """
+
+    nreads = 20
+
+    with EncoderEmulator(protocol=driver().name(), latency=0.02,
+                         process_time=0.005) as emulator:
+        encoders = driver(res_alt=10000, res_az=10000)
+        assert encoders.connect(emulator.port)
+        assert encoders.get_encoder_resolution() == (10000, 10000)
+
+        try:
+            elapsed = {}
+            for depth in [1, 2]:
+                assert encoders.set_pipeline_depth(depth)
+
+                first = emulator.position_requests + 1
+                start = time.monotonic()
+                alts = [encoders.get_encoder_position()[0] for i in range(nreads)]
+                elapsed[depth] = time.monotonic() - start
+
+                assert alts == list(range(first, first + nreads))
+
+            assert elapsed[1] / elapsed[2] > 1.6
+
+            # pipelined response is timed from the earlier poll's request
+            start = time.time()
+            pos, sent = encoders.get_timed_encoder_position()
+            assert sent < start
+            assert encoders.set_pipeline_depth(1)
+            start = time.time()
+            pos, sent = encoders.get_timed_encoder_position()
+            assert sent >= start
+            assert encoders.set_pipeline_depth(2)
+
+            # other transactions wait for the outstanding response
+            assert encoders.get_encoder_resolution() == (10000, 10000)
+            pos = encoders.get_encoder_position(priority=PRIORITY_SYNC)
+            assert pos == (emulator.position_requests, 2000)
+        finally:
+            encoders.disconnect()
+
+
+def test_reconnect_after_port_lost(tmp_path):
+    """
+    Test the driver reopens a serial port which disappears and reappears
+    and restores the encoder resolution.
+    """
+
+    port = tmp_path / 'ttyDSC'
+
+    emulator = EncoderEmulator().start()
+    os.symlink(emulator.port, port)
+
+    encoders = EncodersGeneric(res_alt=10000, res_az=8000)
+    assert encoders.connect(str(port))
+    encoders.supervisor.min_delay = 0.1
+
+    try:
+        assert encoders.get_encoder_position() == (1, 2000)
+
+        # adapter unplugged
+        emulator.stop()
+        os.remove(port)
+
+        # link is reopened after repeated failures
+        with pytest.raises(EncoderLinkDown):
+            for i in range(EncodersGeneric.MAX_FAILURES + 1):
+                assert encoders.get_encoder_position() is None
+        assert not encoders.link_up
+        assert not encoders.get_command_stats()['link_up']
+
+        # requests fail fast while reconnecting
+        start = time.monotonic()
+        with pytest.raises(EncoderLinkDown):
+            encoders.get_encoder_position()
+        assert time.monotonic() - start < 0.1
+
+        time.sleep(0.5)
+
+        # adapter plugged back in
+        emulator = EncoderEmulator(alt=100).start()
+        os.symlink(emulator.port, port)
+
+        deadline = time.monotonic() + 10
+        while not encoders.link_up and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert encoders.link_up
+
+        assert (emulator.res_alt, emulator.res_az) == (10000, 8000)
+        assert encoders.get_encoder_position() == (101, 2000)
+        assert encoders.get_command_stats()['reconnects'] == 1
+    finally:
+        encoders.disconnect()
+        emulator.stop()
+
+
+def test_reconnect_waits_for_answer(tmp_path):
+    """
+    Test a reopened port which does not answer is not reported as
+    restored and reconnect attempts continue until it answers.
+    """
+
+    port = tmp_path / 'ttyDSC'
+
+    # setting the resolution is not answered in this protocol so only the
+    # probe can tell the board is not there
+    emulator = EncoderEmulator('DaveEk').start()
+    os.symlink(emulator.port, port)
+
+    encoders = EncodersDaveEk(res_alt=10000, res_az=8000)
+    assert encoders.connect(str(port))
+    encoders.supervisor.min_delay = 0.1
+    encoders.READY_TIMEOUT = 0.3
+
+    try:
+        # port reappears but the board does not answer
+        emulator.stop()
+        emulator = EncoderEmulator('DaveEk', alt=100).start()
+        emulator.silent = True
+        os.remove(port)
+        os.symlink(emulator.port, port)
+
+        with pytest.raises(EncoderLinkDown):
+            for i in range(EncodersDaveEk.MAX_FAILURES + 1):
+                encoders.get_encoder_position()
+
+        time.sleep(1.5)
+        assert not encoders.link_up
+        assert encoders.supervisor.running
+        assert encoders.get_command_stats()['reconnects'] == 0
+
+        # board starts answering
+        emulator.silent = False
+
+        deadline = time.monotonic() + 10
+        while not encoders.link_up and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert encoders.link_up
+        assert (emulator.res_alt, emulator.res_az) == (10000, 8000)
+        assert encoders.get_command_stats()['reconnects'] == 1
+    finally:
+        encoders.disconnect()
+        emulator.stop()
+
+
+class BytesPort:
+    """ Port returning canned bytes to a codec. """
+
+    def __init__(self, data=b''):
+        self.data = bytearray(data)
+
+    @property
+    def in_waiting(self):
+        return len(self.data)
+
+    def readinto(self, b):
+        n = min(len(b), len(self.data))
+        b[:n] = self.data[:n]
+        del self.data[:n]
+        return n
+
+
+def test_codecs_validate_frames():
+    """ Test codecs reject misframed and impossible responses. """
+
+    codec = GenericCodec()
+    port = BytesPort(b'1000\t-2000\r+5\t6\r')
+    assert codec.read_position(port, 0, 10000, 10000) == (1000, -2000)
+    assert codec.read_position(port, 0, 10000, 10000) == (5, 6)
+    assert codec.buffered == 0
+    for frame in [b'', b'1000\t2000', b'\xff1000\t2000\r', b'1000 2000\r',
+                  b'10000\t20000\r', b'1'*GenericCodec.MAX_FRAME_LENGTH]:
+        with pytest.raises(FramingError):
+            codec.read_position(BytesPort(frame), 0, 10000, 10000)
+        codec.reset()
+
+    codec = DaveEkCodec()
+    frame = (1000).to_bytes(2, 'little') + (2000).to_bytes(2, 'little')
+    assert codec.read_position(BytesPort(frame), 0, 10000, 10000) == (1000, 2000)
+    for frame in [frame[:3], b'\xff' + frame[:3], b'\xff\xff\xff\xff']:
+        with pytest.raises(FramingError):
+            codec.read_position(BytesPort(frame), 0, 10000, 10000)
+        codec.reset()
+
+
+@pytest.mark.parametrize('codec_class, frame', [
+    (GenericCodec, b'+12345\t-02000\r'),
+    (DaveEkCodec, (12345).to_bytes(2, 'little') + (2000).to_bytes(2, 'little'))])
+def test_codec_parse_cost(codec_class, frame):
+    """
+    Micro-benchmark of reading and decoding one position response from
+    data already received and of decoding alone.  Run with
+    --log-cli-level=INFO to see the cost per sample.
+    """
+
+    nsamples = 20000
+
+    codec = codec_class()
+    port = BytesPort()
+    start = time.perf_counter()
+    for i in range(nsamples):
+        port.data[:] = frame
+        codec.read_position(port, 0, 20000, 20000)
+    cost = (time.perf_counter() - start)/nsamples
+
+    buf = bytearray(frame)
+    start = time.perf_counter()
+    for i in range(nsamples):
+        codec.decode_counts(buf, 0, len(buf))
+    decode_cost = (time.perf_counter() - start)/nsamples
+
+    logging.info(f'{codec_class.__name__}: {cost*1e6:.2f} us per sample '
+                 f'({decode_cost*1e6:.2f} us decoding)')
+    assert cost < 100e-6
+
+
+@pytest.mark.parametrize('fault', EncoderEmulator.FAULTS)
+@pytest.mark.parametrize('driver', [EncodersGeneric, EncodersDaveEk])
+def test_framing_fault_recovery(driver, fault):
+    """
+    Test a corrupted response costs at most the read it corrupted and
+    the following read is aligned without waiting for the serial timeout.
+    """
+
+    nfaults = 5
+
+    with EncoderEmulator(protocol=driver().name()) as emulator:
+        encoders = driver(res_alt=10000, res_az=10000)
+        assert encoders.connect(emulator.port)
+
+        try:
+            errors = encoders.get_command_stats()['framing_errors']
+            recovery = []
+            for i in range(nfaults):
+                emulator.inject(fault)
+                start = time.monotonic()
+                # only the corrupted read may fail
+                pos = encoders.get_encoder_position()
+                assert pos is None or pos == (emulator.alt, 2000)
+                assert encoders.get_encoder_position() == (emulator.alt, 2000)
+                recovery.append(time.monotonic() - start)
+
+            # each fault was detected once and reads after the last succeed
+            stats = encoders.get_command_stats()
+            assert stats['framing_errors'] - errors == nfaults
+            for i in range(5):
+                assert encoders.get_encoder_position() == (emulator.alt, 2000)
+            assert (encoders.get_command_stats()['framing_errors'] ==
+                    stats['framing_errors'])
+
+            assert max(recovery) < 1.0
+            assert encoders.link_up
+        finally:
+            encoders.disconnect()
+
+
+@pytest.mark.parametrize('scheme', ['', 'serial://', 'pty://', 'tcp'])
+def test_transports(scheme):
+    """
+    Test the drivers work the same over each transport with TCP tested
+    against the emulator acting as a network DSC.
+    """
+
+    transport = 'tcp' if scheme == 'tcp' else 'pty'
+    with EncoderEmulator(transport=transport) as emulator:
+        url = emulator.port if transport == 'tcp' else scheme + emulator.port
+
+        encoders = EncodersGeneric(res_alt=10000, res_az=8000)
+        assert encoders.connect(url)
+
+        try:
+            if transport == 'tcp':
+                assert isinstance(encoders.transport, TcpTransport)
+                sock = encoders.transport.sock
+                assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+            elif scheme == 'pty://':
+                assert isinstance(encoders.transport, PtyTransport)
+
+            assert encoders.get_encoder_resolution() == (10000, 8000)
+            for i in range(1, 4):
+                assert encoders.get_encoder_position() == (i, 2000)
+
+            emulator.inject('noise')
+            assert encoders.get_encoder_position() is None
+            assert encoders.get_encoder_position() == (5, 2000)
+
+            encoders.set_pipeline_depth(2)
+            assert encoders.get_encoder_position() == (6, 2000)
+            assert encoders.get_encoder_position() == (7, 2000)
+        finally:
+            encoders.disconnect()
+
+    with pytest.raises(ValueError):
+        open_transport('usb://1234', 9600, 0.1)
+
+
+def test_io_loop_serves_many_devices():
+    """
+    Test one event loop thread polls a dozen devices at the requested
+    rate while other transactions still reach each device.
+    """
+
+    ndevices = 12
+    rate = 20.0
+
+    emulators = []
+    drivers = []
+    loop = EncoderIOLoop()
+    loop.start()
+    try:
+        for i in range(ndevices):
+            driver = [EncodersGeneric, EncodersDaveEk][i % 2]
+            emulator = EncoderEmulator(protocol=driver().name(),
+                                       latency=0.005).start()
+            emulators.append(emulator)
+            encoders = driver(res_alt=10000, res_az=10000)
+            assert encoders.connect(emulator.port)
+            drivers.append(encoders)
+
+        samplers = [loop.add(encoders, rate) for encoders in drivers]
+        assert all(sampler.latest is not None for sampler in samplers)
+        time.sleep(1.0)
+
+        for sampler, emulator in zip(samplers, emulators):
+            assert sampler.samples >= 0.7*rate
+            latest = sampler.latest
+            assert time.time() - latest.timestamp < 3/rate
+            assert latest.az == 2000
+
+        # other transactions wait for a poll in progress
+        pos = drivers[0].get_encoder_position(priority=PRIORITY_SYNC)
+        assert pos[1] == 2000
+        assert drivers[1].get_encoder_resolution() == (10000, 10000)
+
+        names = [t.name for t in threading.enumerate()]
+        assert names.count('EncoderIOLoop') == 1
+
+        samplers[0].stop()
+        assert not samplers[0].running
+        samples = samplers[0].samples
+        time.sleep(0.2)
+        assert samplers[0].samples == samples
+        assert samplers[1].running
+    finally:
+        loop.stop()
+        for encoders in drivers:
+            encoders.disconnect()
+        for emulator in emulators:
+            emulator.stop()
+
+
+def test_io_loop_survives_link_loss(tmp_path):
+    """
+    Test the event loop keeps polling the other devices when one loses
+    its link or raises an unexpected error and resumes polling a device
+    once its link is restored.
+    """
+
+    port = tmp_path / 'ttyDSC'
+    rate = 20.0
+
+    lost = EncoderEmulator().start()
+    os.symlink(lost.port, port)
+    other = EncoderEmulator().start()
+
+    loop = EncoderIOLoop()
+    loop.start()
+    encoders = EncodersGeneric(res_alt=10000, res_az=10000)
+    other_encoders = EncodersGeneric(res_alt=10000, res_az=10000)
+    try:
+        assert encoders.connect(str(port))
+        assert other_encoders.connect(other.port)
+        encoders.supervisor.min_delay = 0.1
+
+        sampler = loop.add(encoders, rate)
+        other_sampler = loop.add(other_encoders, rate)
+        time.sleep(0.3)
+
+        # adapter unplugged while the loop is polling it
+        lost.stop()
+        os.remove(port)
+
+        deadline = time.monotonic() + 5
+        while encoders.link_up and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert not encoders.link_up
+
+        # an unexpected error from one response is contained
+        poll_response = other_encoders.poll_response
+
+        def fail_once():
+            other_encoders.poll_response = poll_response
+            raise ValueError('bad response')
+
+        other_encoders.poll_response = fail_once
+        time.sleep(0.2)
+        assert other_encoders.poll_response is poll_response
+
+        samples = other_sampler.samples
+        time.sleep(0.3)
+        assert loop.running
+        assert other_sampler.samples > samples
+        assert time.time() - other_sampler.latest.timestamp < 3/rate
+
+        # adapter plugged back in
+        lost = EncoderEmulator(alt=100).start()
+        os.symlink(lost.port, port)
+
+        deadline = time.monotonic() + 10
+        while (sampler.latest.alt < 100 and time.monotonic() < deadline):
+            time.sleep(0.05)
+        assert encoders.link_up
+        assert sampler.latest.alt > 100
+        assert encoders.loop_sampler is sampler
+    finally:
+        loop.stop()
+        encoders.disconnect()
+        other_encoders.disconnect()
+        lost.stop()
+        other.stop()
+
+
+def test_encoder_pool():
+    """
+    Test the pool reuses connected drivers with the same settings, opens
+    a new connection when settings change and closes idle connections.
+    """
+
+    with EncoderEmulator() as emulator:
+        pool = EncoderPool(idle_timeout=0.5)
+
+        # readiness probe instead of a fixed delay after opening
+        start = time.monotonic()
+        encoders = pool.acquire(EncodersGeneric, emulator.port, 9600, 10000, 10000)
+        assert time.monotonic() - start < 0.2
+        assert (emulator.res_alt, emulator.res_az) == (10000, 10000)
+
+        pool.release(encoders)
+        assert encoders.link_up
+        again = pool.acquire(EncodersGeneric, emulator.port, 9600, 10000, 10000,
+                             reverse_az=True)
+        assert again is encoders
+        assert again.reverse_az
+        assert pool.reuses == 1
+
+        # resolution changed so old connection is closed and a new one opened
+        pool.release(again)
+        other = pool.acquire(EncodersGeneric, emulator.port, 9600, 8000, 8000)
+        assert other is not encoders
+        assert encoders.transport is None
+        assert (emulator.res_alt, emulator.res_az) == (8000, 8000)
+
+        pool.release(other)
+        time.sleep(1.0)
+        assert other.transport is None
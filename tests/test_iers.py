@@ -0,0 +1,100 @@
+#
+# Test offline IERS table handling
+#
+#
+# Invocation:  Run from the root directory of alpacadsc git checkout:
+#              python -m pytest -v tests/
+#
+# To see logging output up to a certain log level add the options:
+#              "-v -o log_cli=true --log-cli-level=DEBUG"
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+from astropy.utils import iers
+
+from alpacadsc.iers_tables import configure_iers, update_iers_cache
+from alpacadsc.iers_tables import get_iers_cache_file, iers_table_age
+from alpacadsc.transforms import create_transform_engine
+
+from consts import ABOUT_URI
+
+# we must import pytest fixtures client for the test cases
+# below to run properly.  Pytest will inject them into the argument
+# list for the test cases.  It is normal for a python linter to
+# report they are unused.
+from utils import client
+
+
+def test_configure_iers_offline(client, mocker, tmp_path):
+    """
+    Test IERS handling is configured to never download and the table in
+    use and its age are reported.
+    """
+
+    mocker.patch('alpacadsc.iers_tables.get_iers_cache_file',
+                 return_value=tmp_path / 'finals2000A.all')
+
+    table = configure_iers()
+
+    assert iers.conf.auto_download is False
+    assert iers.earth_orientation_table.get() is table
+    assert iers_table_age() is not None
+
+    rv = client.get(ABOUT_URI)
+    assert b'IERS Table Age' in rv.data
+
+
+def test_update_iers_cache(mocker, tmp_path):
+    """
+    Test table downloaded ahead of time is stored in the cache and used
+    by configure_iers().
+    """
+
+    cache_file = tmp_path / 'alpacadsc' / 'finals2000A.all'
+    mocker.patch('alpacadsc.iers_tables.get_iers_cache_file',
+                 return_value=cache_file)
+
+    # use bundled table in place of a network download
+    download = mocker.patch('astropy.utils.data.download_file',
+                            return_value=iers.IERS_A_FILE)
+
+    assert update_iers_cache() == cache_file
+    assert download.call_count == 1
+    assert cache_file.exists()
+
+    table = configure_iers()
+    assert table.meta['data_path'] == str(cache_file)
+
+
+def test_engine_configures_iers(mocker, tmp_path):
+    """
+    Test the engines using Earth orientation data configure IERS when
+    created and the fast engine does not.
+    """
+
+    mocker.patch('alpacadsc.iers_tables.get_iers_cache_file',
+                 return_value=tmp_path / 'finals2000A.all')
+    mocker.patch('alpacadsc.iers_tables._iers_table', None)
+    configure = mocker.patch('alpacadsc.iers_tables.configure_iers',
+                             wraps=configure_iers)
+
+    create_transform_engine('fast', 40.0, -80.0, 300.0)
+    assert configure.call_count == 0
+
+    create_transform_engine('erfa', 40.0, -80.0, 300.0)
+    create_transform_engine('astropy', 40.0, -80.0, 300.0)
+    assert configure.call_count == 1
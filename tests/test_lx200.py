@@ -0,0 +1,139 @@
+#
+# Test LX200 protocol server
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import asyncio
+
+import pytest
+
+from consts import REST_API_URI
+
+from alpacadsc.lx200_server import LX200Server, format_ra, format_degrees
+from alpacadsc.lx200_server import parse_ra, parse_dec, LX200_SYNC_REPLY
+from alpacadsc.encoder_pool import shared_encoder_pool
+
+# we must import pytest fixtures client and my_fs for the test cases
+# below to run properly.
+from utils import create_test_profile, REST_Handler, client, my_fs
+
+
+@pytest.mark.parametrize('hours, high, expected', [
+    (0.0, True, '00:00:00#'),
+    (6.5, True, '06:30:00#'),
+    (23.99999, True, '00:00:00#'),
+    (12.5125, False, '12:30.8#'),
+    (None, True, '00:00:00#')])
+def test_format_ra(hours, high, expected):
+    assert format_ra(hours, high) == expected
+
+
+@pytest.mark.parametrize('degrees, high, signed, expected', [
+    (45.5, True, True, "+45*30'00#"),
+    (-0.5, True, True, "-00*30'00#"),
+    (-12.25, False, True, '-12*15#'),
+    (359.9999, True, False, "000*00'00#"),
+    (270.5, False, False, '270*30#')])
+def test_format_degrees(degrees, high, signed, expected):
+    assert format_degrees(degrees, high, signed) == expected
+
+
+def test_parse_coordinates():
+    assert parse_ra('06:30:00') == 6.5
+    assert parse_ra(' 12:30.6') == pytest.approx(12.51)
+    assert parse_ra('24:00:00') is None
+    assert parse_ra('garbage') is None
+
+    assert parse_dec('+45*30:00') == 45.5
+    assert parse_dec('-12*15') == -12.25
+    assert parse_dec('+45\xdf30:00') == 45.5
+    assert parse_dec("-00*30'00") == -0.5
+    assert parse_dec('+91*00') is None
+
+
+def test_lx200_server(client):
+    create_test_profile()
+    rest = REST_Handler(client, REST_API_URI)
+    rest.put('connected', data=dict(Connected=True))
+
+    driver = client.application.extensions['alpacadsc']['driver']
+    broadcaster = client.application.extensions['alpacadsc']['broadcaster']
+
+    async def query(reader, writer, command, length):
+        writer.write(command)
+        await writer.drain()
+        return await asyncio.wait_for(reader.readexactly(length), 5)
+
+    async def main():
+        server = LX200Server(driver, broadcaster, port=0)
+        await server.start()
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+
+            assert await query(reader, writer, b'\x06', 1) == b'A'
+
+            # sync then read back position
+            assert await query(reader, writer, b':Sr06:00:00#', 1) == b'1'
+            assert await query(reader, writer, b':Sd+30*00:00#', 1) == b'1'
+            assert await query(reader, writer, b':Sd+99*00:00#', 1) == b'0'
+            assert await query(reader, writer, b':Sd+30*00:00#', 1) == b'1'
+            assert await query(reader, writer, b':CM#', len(LX200_SYNC_REPLY)) == \
+                LX200_SYNC_REPLY
+
+            # wait for state sampled after sync
+            await asyncio.sleep(3*broadcaster.period)
+
+            ra = await query(reader, writer, b':GR#', 9)
+            assert abs(parse_ra(ra[:-1].decode()) - 6) < 1/60
+            dec = await query(reader, writer, b':GD#', 10)
+            assert abs(parse_dec(dec[:-1].decode()) - 30) < 1/60
+
+            # low precision and several commands in one write
+            writer.write(b':U#')
+            reply = await query(reader, writer, b':GR#:GD#', 15)
+            assert reply.endswith(b'#') and b'.' in reply
+
+            # unterminated command is discarded instead of buffered forever
+            writer.write(b':' + b'x'*200)
+            await writer.drain()
+            await asyncio.sleep(0.1)
+            assert await query(reader, writer, b':GVP#', 10) == b'AlpacaDSC#'
+
+            # many clients polling share the sampled state
+            samples = broadcaster.samples
+            clients = [await asyncio.open_connection('127.0.0.1', server.port)
+                       for i in range(50)]
+            for i in range(5):
+                replies = await asyncio.gather(*[query(r, w, b':GR#:GD#', 19)
+                                                 for r, w in clients])
+                assert all(r.startswith(b'06:00:') or r.startswith(b'05:59:')
+                           for r in replies)
+                await asyncio.sleep(0.05)
+            assert broadcaster.samples - samples <= 10
+            assert server.connections == 51
+
+            for r, w in clients + [(reader, writer)]:
+                w.close()
+            await asyncio.sleep(0.2)
+            assert server.connections == 0
+        finally:
+            await server.close()
+
+    asyncio.run(main())
+
+    rest.put('connected', data=dict(Connected=False))
+    shared_encoder_pool().close()
@@ -0,0 +1,174 @@
+#
+# Test multi-process serving with shared pointing state
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import json
+import time
+import threading
+import http.client
+
+from alpacadsc.shared_pointing import SharedPointing
+from alpacadsc.multiworker import MultiWorkerServer
+from alpacadsc.startservice import create_app
+from alpacadsc.encoder_pool import shared_encoder_pool
+
+from utils import create_test_profile
+
+
+def make_state(value):
+    return {'Timestamp': 1000.0 + value, 'Connected': True,
+            'Synchronized': True, 'Altitude': value, 'Azimuth': value,
+            'RightAscension': value, 'Declination': value,
+            'SiderealTime': value, 'EncoderAltitude': value,
+            'EncoderAzimuth': value, 'EncoderAge': None}
+
+
+def test_shared_pointing_seqlock():
+    shared = SharedPointing()
+    reader = SharedPointing(shared.name)
+    try:
+        assert reader.read() == (None, None)
+
+        shared.publish(make_state(7.0), published=123.0)
+        published, state = reader.read()
+        assert published == 123.0
+        assert state == make_state(7.0)
+
+        # reader must never see fields from two different publishes
+        stop = threading.Event()
+
+        def writer():
+            i = 0
+            while not stop.is_set():
+                shared.publish(make_state(float(i)))
+                i += 1
+
+        t = threading.Thread(target=writer)
+        t.start()
+        try:
+            for i in range(20000):
+                published, state = reader.read()
+                if published is None:
+                    continue
+                assert len({state[k] for k in SharedPointing.FIELDS[3:10]}) == 1
+                assert state['Timestamp'] == 1000.0 + state['Altitude']
+        finally:
+            stop.set()
+            t.join()
+    finally:
+        reader.close()
+        shared.close()
+
+
+def get(port, path, method='GET', body=None, headers={}):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    try:
+        conn.request(method, path, body=body, headers=headers)
+        resp = conn.getresponse()
+        return resp.status, resp.read()
+    finally:
+        conn.close()
+
+
+def test_multiworker_server():
+    app = create_app(warmup=False)
+    server = MultiWorkerServer(app, port=0, workers=2)
+    server.start()
+    t = threading.Thread(target=server.serve_forever)
+    t.start()
+    try:
+        # workers take a moment to start but the listener already accepts
+        status, data = get(server.port, '/api/v1/telescope/0/connected')
+        assert status == 200
+        assert json.loads(data)['Value'] is False
+
+        # static responses served by workers
+        status, data = get(server.port, '/api/v1/telescope/0/cansync')
+        assert json.loads(data)['Value'] is True
+
+        # not connected so passed to owner
+        status, data = get(server.port, '/api/v1/telescope/0/altitude')
+        assert status == 200
+
+        # pages are passed to owner
+        status, data = get(server.port, '/about')
+        assert status == 200
+        assert b'html' in data.lower()
+
+        # pointing comes from shared state published by owner
+        server._publisher.stop()
+        server.shared.publish(make_state(42.5))
+        status, data = get(server.port, '/api/v1/telescope/0/altitude')
+        assert json.loads(data)['Value'] == 42.5
+        status, data = get(server.port, '/api/v1/telescope/0/state')
+        assert json.loads(data)['Value']['Declination'] == 42.5
+
+        # stream served by workers from shared state
+        conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=10)
+        conn.request('GET', '/api/v1/telescope/0/stream?rate=10')
+        resp = conn.getresponse()
+        assert resp.getheader('Content-Type').startswith('text/event-stream')
+        assert resp.readline().startswith(b'id: 1')
+        assert json.loads(resp.readline()[6:])['Altitude'] == 42.5
+        conn.close()
+
+        # stale state is never served
+        server.shared.publish(make_state(42.5), published=time.time() - 10)
+        status, data = get(server.port, '/api/v1/telescope/0/altitude')
+        assert json.loads(data)['Value'] != 42.5
+    finally:
+        server.shutdown()
+        t.join()
+
+
+def test_multiworker_read_after_write():
+    """
+    Test state read from a worker right after a PUT reflects the PUT
+    without waiting for the periodic publish.
+    """
+
+    create_test_profile()
+
+    app = create_app(warmup=False)
+    server = MultiWorkerServer(app, port=0, workers=2)
+    server.start()
+    t = threading.Thread(target=server.serve_forever)
+    t.start()
+    try:
+        # only publishing done on behalf of requests is left
+        server._publisher.stop()
+
+        form = {'Content-Type': 'application/x-www-form-urlencoded'}
+        for connected in [True, False]:
+            # fresh state from before the PUT so workers answer locally
+            server._publisher.publish()
+            status, data = get(server.port, '/api/v1/telescope/0/connected')
+            assert json.loads(data)['Value'] is not connected
+
+            status, data = get(server.port, '/api/v1/telescope/0/connected',
+                               method='PUT', headers=form,
+                               body=f'Connected={connected}&ClientID=1&'
+                                    'ClientTransactionID=1')
+            assert json.loads(data)['ErrorNumber'] == 0
+
+            status, data = get(server.port, '/api/v1/telescope/0/connected')
+            assert json.loads(data)['Value'] is connected
+    finally:
+        server.shutdown()
+        t.join()
+        shared_encoder_pool().close()
@@ -0,0 +1,125 @@
+#
+# Test Server-Sent Events stream of telescope state
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import json
+import time
+
+import pytest
+
+from consts import REST_API_URI
+
+from alpacadsc.pointing_stream import PointingStream, PointingBroadcaster
+from alpacadsc.pointing_stream import STREAM_MAX_RATE
+from alpacadsc.encoder_pool import shared_encoder_pool
+
+# we must import pytest fixtures client and my_fs for the test cases
+# below to run properly.
+from utils import create_test_profile, REST_Handler, client, my_fs
+
+
+def parse_event(event):
+    fields = dict(line.split(': ', 1) for line in event.strip().split('\n'))
+    return int(fields['id']), json.loads(fields['data'])
+
+
+def test_stream_sends_changes():
+    state = {'Connected': True, 'Synchronized': False,
+             'EncoderAltitude': 100, 'EncoderAzimuth': 200, 'EncoderAge': 0.1}
+
+    stream = PointingStream(lambda: dict(state), rate=100, heartbeat=0.2)
+    assert stream.period == 1 / STREAM_MAX_RATE
+
+    event_id, data = parse_event(stream.next_event())
+    assert event_id == 1
+    assert data == state
+
+    # unchanged position is not sent again
+    state['EncoderAge'] = 0.2
+    assert stream.next_event() is None
+
+    state['EncoderAzimuth'] = 201
+    event_id, data = parse_event(stream.next_event())
+    assert event_id == 2
+    assert data['EncoderAzimuth'] == 201
+
+    # until the heartbeat is due
+    assert stream.next_event() is None
+    time.sleep(0.25)
+    event_id, data = parse_event(stream.next_event())
+    assert event_id == 3
+
+    with pytest.raises(ValueError):
+        PointingStream(lambda: state, rate='abc')
+    with pytest.raises(ValueError):
+        PointingStream(lambda: state, rate=0)
+
+
+def test_broadcaster_shared_by_clients():
+    calls = []
+
+    def get_state():
+        calls.append(time.monotonic())
+        return {'EncoderAltitude': len(calls)}
+
+    broadcaster = PointingBroadcaster(get_state, rate=20, idle_timeout=0.3)
+    streams = [PointingStream(broadcaster.latest, rate=20) for i in range(50)]
+
+    start = time.monotonic()
+    events = 0
+    while time.monotonic() - start < 0.5:
+        for stream in streams:
+            if stream.next_event() is not None:
+                events += 1
+        time.sleep(0.05)
+
+    # every client gets events but the state is sampled at one rate
+    assert all(stream.events > 3 for stream in streams)
+    assert len(calls) <= 0.5*20 + 2
+
+    # sampling stops without clients
+    time.sleep(0.6)
+    assert not broadcaster.running
+    ncalls = len(calls)
+    time.sleep(0.2)
+    assert len(calls) == ncalls
+
+
+def test_stream_endpoint(client):
+    create_test_profile()
+
+    rest = REST_Handler(client, REST_API_URI)
+    rest.put('connected', data=dict(Connected=True))
+
+    rv = client.get(REST_API_URI + '/stream', query_string={'rate': 10},
+                    buffered=False)
+    assert rv.status_code == 200
+    assert rv.mimetype == 'text/event-stream'
+
+    events = iter(rv.response)
+    event_id, data = parse_event(next(events).decode())
+    assert event_id == 1
+    assert data['Connected'] is True
+    assert data['EncoderAltitude'] is not None
+    rv.close()
+
+    rv = client.get(REST_API_URI + '/stream', query_string={'rate': -1})
+    assert rv.status_code == 400
+
+    rest.put('connected', data=dict(Connected=False))
+    shared_encoder_pool().close()
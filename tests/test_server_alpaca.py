@@ -26,6 +26,7 @@
 #
 from alpacadsc import __version__ as AlpacaDSCDriver_Version
 from alpacadsc.alpaca_models import AlpacaAltAzTelescopeModel
+from alpacadsc.alpaca_controller import ALPACA_ERROR_NOTIMPLEMENTED
 
 from consts import REST_API_URI
 
@@ -73,6 +74,12 @@ def test_rest_get_basic(client):
     rv = rest.get('connected')
     assert isinstance(rv.json['Value'], bool)
 
+    # internal driver attributes are not Alpaca properties
+    for action in ['encoders', 'sampler', 'transform', 'profile', 'enc_alt0']:
+        rv = client.get(f'{REST_API_URI}/{action}')
+        assert rv.status_code == 200
+        assert rv.json['ErrorNumber'] == ALPACA_ERROR_NOTIMPLEMENTED
+
 
 def test_rest_connected(client, my_fs):
     """
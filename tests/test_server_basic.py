@@ -26,18 +26,21 @@
 #
 from pathlib import Path
 
+import alpacadsc.warmup
+
 from alpacadsc.alpaca_models import PROFILE_BASENAME
 from alpacadsc.profiles import find_profiles, get_current_profile
 from alpacadsc.altaz_dsc_profile import AltAzSettingCirclesProfile as Profile
+from alpacadsc.startservice import create_app
 
 from consts import ROOT_URI, GLOBAL_SETUP_URI, MONITOR_ENCODER_URL
-from consts import DRIVER_SETUP_URI, ABOUT_URI
+from consts import DRIVER_SETUP_URI, ABOUT_URI, REST_API_URI
 
 # we must import pytest fixtures client and my_fs for the test cases
 # below to run properly.  Pytest will inject them into the argument
 # list for the test cases.  It is normal for a python linter to
 # report they are unused.
-from utils import client, my_fs
+from utils import client, my_fs, create_test_profile, REST_Handler
 
 
 def test_root(client):
@@ -53,6 +56,14 @@ def test_global_setup(client):
     assert b'Alt/Az Setting Circles Alpaca Server Information' in rv.data
 
 
+def test_global_setup_host():
+    """ Test '/setup' shows the address the service listens on """
+    app = create_app(port=8001, warmup=False, host='0.0.0.0')
+    with app.test_client() as client:
+        rv = client.get(GLOBAL_SETUP_URI)
+    assert b'0.0.0.0' in rv.data and b'8001' in rv.data
+
+
 def test_driver_setup(client):
     """ Test '/setup/v1/telescope/0/setup' - should return driver setup page """
     rv = client.get(DRIVER_SETUP_URI)
@@ -171,7 +182,8 @@ def test_change_encoder_settings(client, my_fs):
                         alt_resolution=10000,
                         az_resolution=8000,
                         alt_reverse=False,
-                        az_reverse=True)
+                        az_reverse=True,
+                        read_deadline=0.5)
 
     form_dict = dict(form_id='encoder_modify_form', profile_id='Test1')
     post_dict = {**encoder_dict, **form_dict}
@@ -227,3 +239,99 @@ def test_change_location_settings(client, my_fs):
     new_location_dict['name'] = new_location_dict['obsname']
     del new_location_dict['obsname']
     assert new_location_dict == location_dict
+
+
+def test_change_sampler_settings(client, my_fs):
+    """
+    Test: Change Sampler Settings
+
+    Test consists of:
+      - Create new profiles Test1
+      - Change sampler values via POST
+      - Verify profile contains new sampler values
+    """
+    test_new_profile(client, my_fs, name='Test1')
+
+    form_dict = dict(form_id='sampler_modify_form', profile_id='Test1',
+                     sample_rate=5.0, pipeline_depth=2, io_loop='on')
+    rv = client.post(DRIVER_SETUP_URI, data=form_dict)
+
+    assert b'Profile Test1 updated.' in rv.data
+
+    profile = Profile(PROFILE_BASENAME, 'Test1.yaml')
+    profile.read()
+
+    assert profile._to_dict()['sampler'] == dict(rate=5.0, pipeline_depth=2,
+                                                 io_loop=True)
+
+    form_dict['pipeline_depth'] = 0
+    rv = client.post(DRIVER_SETUP_URI, data=form_dict)
+
+    assert b'pipeline_depth must be at least 1' in rv.data
+
+
+def test_change_pointing_settings(client, my_fs):
+    """
+    Test: Change Pointing Settings
+
+    Test consists of:
+      - Create new profiles Test1
+      - Change pointing values via POST
+      - Verify profile contains new pointing values
+      - Verify an unknown transform engine is rejected
+    """
+    test_new_profile(client, my_fs, name='Test1')
+
+    form_dict = dict(form_id='pointing_modify_form', profile_id='Test1',
+                     snapshot_window=0.5, transform_engine='erfa')
+    rv = client.post(DRIVER_SETUP_URI, data=form_dict)
+
+    assert b'Profile Test1 updated.' in rv.data
+
+    profile = Profile(PROFILE_BASENAME, 'Test1.yaml')
+    profile.read()
+
+    assert profile._to_dict()['pointing'] == dict(snapshot_window=0.5,
+                                                  engine='erfa')
+
+    form_dict['transform_engine'] = 'bogus'
+    rv = client.post(DRIVER_SETUP_URI, data=form_dict)
+
+    assert b'Transform engine bogus is not valid.' in rv.data
+
+
+def test_warm_up(mocker):
+    """ Test warm-up stages run when app is created unless disabled. """
+
+    stages = [mocker.spy(alpacadsc.warmup, name)
+              for name in ['warm_up_transforms', 'warm_up_templates',
+                           'warm_up_schemas', 'warm_up_requests']]
+
+    create_app(warmup=False)
+    assert all(stage.call_count == 0 for stage in stages)
+
+    create_app()
+    assert all(stage.call_count == 1 for stage in stages)
+
+
+def test_warm_up_installs_transform():
+    """
+    Test warm-up warms the driver's own transform engine and the same
+    engine is used after connecting.
+    """
+
+    create_test_profile()
+
+    app = create_app()
+    driver = app.extensions['alpacadsc']['driver']
+    engine = driver.transform
+    assert engine is not None
+    assert (engine.latitude, engine.longitude) == (45.0, 135.0)
+
+    with app.test_client() as client:
+        rest = REST_Handler(client, REST_API_URI)
+        rv = rest.put('connected', data=dict(Connected=True))
+        assert rv.json['ErrorNumber'] == 0
+
+    assert driver.transform is engine
+    driver.disconnect()
@@ -24,18 +24,25 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
+import time
+
 from astropy.time import Time
 from astropy import units as u
 from astropy.coordinates import EarthLocation, SkyCoord
 
 from consts import REST_API_URI
 
+from alpacadsc.alpaca_controller import ALPACA_ERROR_NOTIMPLEMENTED
+from alpacadsc.alpaca_controller import ALPACA_ERROR_UNSPECIFIEDERRROR
+from alpacadsc.encoder_pool import shared_encoder_pool
+
 # we must import pytest fixtures client and my_fs for the test cases
 # below to run properly.  Pytest will inject them into the argument
 # list for the test cases.  It is normal for a python linter to
 # report they are unused.
 from utils import create_test_profile, REST_Handler, client, my_fs
 from utils import mock_encoder_and_read_values
+from encoder_emulator import EncoderEmulator
 
 
 def test_encoders_endpoint(client, mocker):
@@ -65,6 +72,46 @@ def test_encoders_endpoint(client, mocker):
     assert (values.enc_alt, values.enc_az) == (test_enc_alt, test_enc_az)
 
 
+def test_encoders_report_one_snapshot(client, mocker):
+    """
+    Test '/encoders' page and its JSON variant are built from one
+    pointing snapshot without querying the encoder resolution.
+    """
+
+    create_test_profile()
+    rest = REST_Handler(client, REST_API_URI)
+    rest.put('connected', data=dict(Connected=True))
+
+    driver = client.application.extensions['alpacadsc']['driver']
+    driver.snapshot_window = 10
+    driver.invalidate_pointing_snapshot()
+
+    read = mocker.patch(
+        'alpacadsc.encoders_altaz_simulator.EncodersAltAzSimulator.get_encoder_position',
+        return_value=(1234, 4321))
+    resolution = mocker.spy(driver.encoders, 'get_encoder_resolution')
+
+    rv = client.get('/encoders', query_string={'format': 'json'})
+    assert rv.status_code == 200
+    report = rv.json
+    assert report['Connected'] is True
+    assert report['Resolution'] == [10000, 10000]
+    assert (report['EncoderAltitude'], report['EncoderAzimuth']) == (1234, 4321)
+    assert report['Altitude'] is None
+
+    rv = client.get('/encoders')
+    assert b'(1234, 4321)' in rv.data
+    assert b'(10000, 10000)' in rv.data
+    assert b'format=json' in rv.data
+
+    assert read.call_count == 1
+    assert resolution.call_count == 0
+
+    rest.put('connected', data=dict(Connected=False))
+    rv = client.get('/encoders', query_string={'format': 'json'})
+    assert rv.json == {'Connected': False}
+
+
 def test_encoders_sync(client, mocker):
     """
     Test synchronizing driver and alt/az and ra/dec mapping for
@@ -158,3 +205,208 @@ def test_encoders_sync(client, mocker):
     pred_radec = pred_altaz.transform_to('icrs')
     assert abs(values.ra_deg - pred_radec.ra.deg) < TEST_EPSILON
     assert abs(values.dec_deg - pred_radec.dec.deg) < TEST_EPSILON
+
+
+def test_pointing_snapshot_reused(client, mocker):
+    """
+    Test a client poll cycle of alt/az/ra/dec requests is served from one
+    encoder read when made within the snapshot window.
+    """
+
+    # create a profile with a long snapshot window
+    test_profile = create_test_profile()
+    test_profile.pointing.snapshot_window = 60.0
+    test_profile.write()
+
+    # create handler for sending REST requests
+    rest = REST_Handler(client, REST_API_URI)
+
+    read = mocker.patch(
+        'alpacadsc.encoders_altaz_simulator.EncodersAltAzSimulator.get_encoder_position',
+        return_value=(1000, 1000))
+
+    # connect and sync
+    rest.put('connected', data=dict(Connected=True))
+    rest.put('synctocoordinates', data=dict(RightAscension=12.0,
+                                            Declination=45.0))
+    read.reset_mock()
+
+    values = [rest.get(action).json['Value']
+              for action in ['altitude', 'azimuth',
+                             'rightascension', 'declination']]
+
+    assert read.call_count == 1
+    assert abs(values[2] - 12.0) < 0.1
+    assert abs(values[3] - 45.0) < 0.1
+
+
+def test_put_dispatch_errors(client, mocker):
+    """
+    Test PUT requests which fail validation or are not implemented return
+    the proper Alpaca error codes.
+    """
+
+    create_test_profile()
+
+    headers = {'content-type': 'application/x-www-form-urlencoded'}
+    data = dict(ClientID=1, ClientTransactionID=1)
+
+    rv = client.put(REST_API_URI + '/notanaction', headers=headers, data=data)
+    assert rv.json['ErrorNumber'] == ALPACA_ERROR_NOTIMPLEMENTED
+
+    # missing required fields
+    rv = client.put(REST_API_URI + '/synctocoordinates', headers=headers,
+                    data=data)
+    assert rv.json['ErrorNumber'] == ALPACA_ERROR_UNSPECIFIEDERRROR
+
+    # out of range declination
+    rv = client.put(REST_API_URI + '/synctocoordinates', headers=headers,
+                    data=dict(data, RightAscension=12.0, Declination=95.0))
+    assert rv.json['ErrorNumber'] == ALPACA_ERROR_UNSPECIFIEDERRROR
+
+
+def test_registry_dispatch(client, mocker):
+    """
+    Test static properties are served pre-serialized and errors raised by
+    a getter are not reported as not implemented.
+    """
+
+    create_test_profile()
+
+    rest = REST_Handler(client, REST_API_URI)
+
+    rv = rest.get('cansync')
+    assert rv.json['Value'] is True
+    assert rv.mimetype == 'application/json'
+
+    assert rest.get('connected').json['Value'] is False
+
+    rv = client.get(REST_API_URI + '/notanaction')
+    assert rv.json['ErrorNumber'] == ALPACA_ERROR_NOTIMPLEMENTED
+
+    mocker.patch('alpacadsc.alpaca_models.AlpacaAltAzTelescopeModel.get_pointing_snapshot',
+                 side_effect=AttributeError('broken'))
+    rv = client.get(REST_API_URI + '/altitude')
+    assert rv.json['ErrorNumber'] == ALPACA_ERROR_UNSPECIFIEDERRROR
+
+
+def test_state_endpoint(client, mocker):
+    """
+    Test '/state' endpoint returns all dynamic properties from one
+    encoder read.
+    """
+
+    create_test_profile()
+
+    rest = REST_Handler(client, REST_API_URI)
+
+    state = rest.get('state').json['Value']
+    assert state['Connected'] is False
+    assert state['Altitude'] is None
+    assert state['EncoderAltitude'] is None
+
+    read = mocker.patch(
+        'alpacadsc.encoders_altaz_simulator.EncodersAltAzSimulator.get_encoder_position',
+        return_value=(1000, 2000))
+
+    rest.put('connected', data=dict(Connected=True))
+    rest.put('synctocoordinates', data=dict(RightAscension=12.0,
+                                            Declination=45.0))
+    read.reset_mock()
+
+    state = rest.get('state').json['Value']
+
+    assert read.call_count == 1
+    assert state['Connected'] is True
+    assert state['Synchronized'] is True
+    assert state['EncoderAltitude'] == 1000
+    assert state['EncoderAzimuth'] == 2000
+    assert abs(state['RightAscension'] - 12.0) < 0.1
+    assert abs(state['Declination'] - 45.0) < 0.1
+    assert 0 <= state['SiderealTime'] < 24
+
+    # sidereal time should agree with astropy to within a second
+    loc = EarthLocation(lat=45*u.deg, lon=135*u.deg, height=100*u.m)
+    lst = Time(state['Timestamp'], format='unix').sidereal_time('mean', longitude=loc.lon)
+    assert abs((lst.hour - state['SiderealTime'] + 12) % 24 - 12) < 1/3600
+
+
+def test_read_deadline_uses_last_sample(client):
+    """
+    Test requests return the last encoder position read with its age
+    when the encoders stop responding instead of waiting for the serial
+    port timeout.
+    """
+
+    with EncoderEmulator(latency=0.01) as emulator:
+        test_profile = create_test_profile()
+        test_profile.encoders.driver = 'Generic'
+        test_profile.encoders.serial_port = emulator.port
+        test_profile.encoders.read_deadline = 0.1
+        test_profile.pointing.snapshot_window = 0.0
+        test_profile.write()
+
+        rest = REST_Handler(client, REST_API_URI)
+
+        rest.put('connected', data=dict(Connected=True))
+        try:
+            rest.put('synctocoordinates', data=dict(RightAscension=12.0,
+                                                    Declination=45.0))
+
+            state = rest.get('state').json['Value']
+            good_alt = state['EncoderAltitude']
+            assert state['EncoderAge'] < 0.1
+
+            # encoders stop responding
+            emulator.latency = 2.0
+
+            start = time.monotonic()
+            state = rest.get('state').json['Value']
+            assert time.monotonic() - start < 0.5
+            assert state['EncoderAltitude'] == good_alt
+            assert state['EncoderAge'] >= 0.1
+            assert abs(state['RightAscension'] - 12.0) < 0.1
+
+            # sync needs a current position so fails
+            start = time.monotonic()
+            rv = client.put(REST_API_URI + '/synctocoordinates',
+                            data=dict(ClientID=1, ClientTransactionID=1,
+                                      RightAscension=12.0, Declination=45.0))
+            assert time.monotonic() - start < 0.5
+            assert rv.json['ErrorNumber'] == ALPACA_ERROR_UNSPECIFIEDERRROR
+        finally:
+            emulator.latency = 0.0
+            rest.put('connected', data=dict(Connected=False))
+            shared_encoder_pool().close()
+
+
+def test_connect_reuses_encoders(client):
+    """
+    Test connecting again after a disconnect reuses the open encoder
+    connection instead of reopening the port.
+    """
+
+    with EncoderEmulator() as emulator:
+        test_profile = create_test_profile()
+        test_profile.encoders.driver = 'Generic'
+        test_profile.encoders.serial_port = emulator.port
+        test_profile.write()
+
+        rest = REST_Handler(client, REST_API_URI)
+        pool = shared_encoder_pool()
+        reuses = pool.reuses
+
+        try:
+            rest.put('connected', data=dict(Connected=True))
+            rest.put('connected', data=dict(Connected=False))
+
+            start = time.monotonic()
+            rest.put('connected', data=dict(Connected=True))
+            assert time.monotonic() - start < 0.1
+            assert pool.reuses == reuses + 1
+
+            state = rest.get('state').json['Value']
+            assert state['EncoderAzimuth'] == 2000
+        finally:
+            rest.put('connected', data=dict(Connected=False))
+            pool.close()
@@ -0,0 +1,143 @@
+#
+# Test coordinate transform engines
+#
+#
+# Invocation:  Run from the root directory of alpacadsc git checkout:
+#              python -m pytest -v tests/
+#
+# To see logging output up to a certain log level add the options:
+#              "-v -o log_cli=true --log-cli-level=DEBUG"
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import sys
+import math
+import time
+import subprocess
+
+import pytest
+from astropy.time import Time
+from astropy import units as u
+from astropy.coordinates import EarthLocation, SkyCoord
+
+from alpacadsc.transforms import TRANSFORM_ENGINES, create_transform_engine
+from alpacadsc.transforms import ErfaTransformEngine, CachedTransformEngine
+
+# test site
+LATITUDE = 45.0
+LONGITUDE = 135.0
+ELEVATION = 100.0
+
+# alt/az grid to compare engines over
+TEST_ALTAZ = [(alt, az) for alt in [5.0, 30.0, 60.0, 85.0]
+              for az in [0.0, 45.0, 135.0, 225.0, 315.0]]
+
+# maximum allowed difference from astropy in arcseconds for each engine
+ENGINE_TOLERANCE = {
+    'astropy': 0.01,
+    'erfa': 0.1,
+    'cached': 0.5,
+    'fast': 60.0,
+}
+
+
+def separation(lon1, lat1, lon2, lat2):
+    """
+    Angular separation in arcseconds between two positions in degrees.
+    """
+    lon1, lat1, lon2, lat2 = map(math.radians, (lon1, lat1, lon2, lat2))
+    c = math.sin(lat1)*math.sin(lat2) + \
+        math.cos(lat1)*math.cos(lat2)*math.cos(lon1-lon2)
+    return math.degrees(math.acos(min(1.0, c)))*3600
+
+
+@pytest.mark.parametrize('engine_name', TRANSFORM_ENGINES)
+def test_transform_engine_matches_skycoord(engine_name):
+    """
+    Test each transform engine against the SkyCoord transforms in both
+    directions.
+    """
+
+    tolerance = ENGINE_TOLERANCE[engine_name]
+
+    engine = create_transform_engine(engine_name, LATITUDE, LONGITUDE, ELEVATION)
+    assert engine.name() == engine_name
+
+    location = EarthLocation(lat=LATITUDE, lon=LONGITUDE, height=ELEVATION*u.m)
+    obstime = time.time()
+
+    for alt, az in TEST_ALTAZ:
+        altaz = SkyCoord(alt=alt*u.deg, az=az*u.deg,
+                         obstime=Time(obstime, format='unix'),
+                         frame='altaz', location=location)
+        radec = altaz.transform_to('icrs')
+
+        ra, dec = engine.altaz_to_radec(alt, az, obstime)
+        assert separation(ra, dec, radec.ra.deg, radec.dec.deg) < tolerance
+
+        new_alt, new_az = engine.radec_to_altaz(radec.ra.deg, radec.dec.deg,
+                                                obstime)
+        assert separation(new_az, new_alt, az, alt) < tolerance
+
+
+def test_unknown_transform_engine():
+    """ Test an unknown engine name is rejected. """
+    assert create_transform_engine('bogus', LATITUDE, LONGITUDE, ELEVATION) is None
+
+
+def test_cached_transform_engine_between_refreshes(mocker):
+    """
+    Test cached engine only refreshes once per quantum and stays close to
+    the exact ERFA transform while the Earth rotates between refreshes.
+    """
+
+    exact = ErfaTransformEngine(LATITUDE, LONGITUDE, ELEVATION)
+    cached = CachedTransformEngine(LATITUDE, LONGITUDE, ELEVATION, quantum=5.0)
+    refresh = mocker.spy(cached, '_refresh')
+
+    obstime = time.time()
+    for dt in [0.0, 1.0, 2.5, 4.9]:
+        for alt, az in TEST_ALTAZ:
+            ra, dec = exact.altaz_to_radec(alt, az, obstime + dt)
+            cached_ra, cached_dec = cached.altaz_to_radec(alt, az, obstime + dt)
+            assert separation(ra, dec, cached_ra, cached_dec) < 0.5
+
+            cached_alt, cached_az = cached.radec_to_altaz(ra, dec, obstime + dt)
+            assert separation(cached_az, cached_alt, az, alt) < 0.5
+
+    assert refresh.call_count == 1
+
+    # cache expires after quantum
+    cached.altaz_to_radec(45.0, 90.0, obstime + 5.5)
+    assert refresh.call_count == 2
+
+
+def test_fast_transform_engine_without_astropy():
+    """
+    Test the service and fast engine can be used without loading astropy.
+    """
+
+    code = (
+        'import sys, time\n'
+        'from alpacadsc.startservice import create_app\n'
+        'from alpacadsc.transforms import create_transform_engine\n'
+        'create_app(warmup=False)\n'
+        f'engine = create_transform_engine("fast", {LATITUDE}, {LONGITUDE}, {ELEVATION})\n'
+        'engine.radec_to_altaz(*engine.altaz_to_radec(45, 90, time.time()), time.time())\n'
+        'assert not any(m.startswith("astropy") for m in sys.modules)\n'
+    )
+    subprocess.run([sys.executable, '-c', code], check=True)
@@ -114,6 +114,9 @@ def mock_encoder_and_read_values(client, mocker, mock_alt, mock_az):
         'alpacadsc.encoders_altaz_simulator.EncodersAltAzSimulator.get_encoder_position',
         return_value=(mock_alt, mock_az))
 
+    # page shows the cached pointing snapshot so make it read the mock
+    client.application.extensions['alpacadsc']['driver'].invalidate_pointing_snapshot()
+
     rv = client.get(MONITOR_ENCODER_URL)
     assert b'Alt/Az Setting Circles Driver Monitor Encoders' in rv.data
 